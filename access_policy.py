@@ -0,0 +1,129 @@
+"""Правила доступа к дисциплинам: какие группы видят дисциплину и какой документ им открывать.
+
+Правила лежат в access_policy.json и перечитываются без перезапуска, когда файл меняется.
+Замер скорости проверок: python access_policy.py
+"""
+import json
+import os
+import threading
+import time
+from types import MappingProxyType
+
+POLICY_PATH = os.environ.get(
+    'ACCESS_POLICY', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'access_policy.json'))
+RELOAD_CHECK_INTERVAL = 2  # Как часто (в секундах) проверять, не изменился ли файл
+
+OBSHCHESTVOZNANIE = 'obshchestvoznanie'
+PHILOSOPHY = 'philosophy'
+
+_EMPTY = MappingProxyType({})
+
+class Policy:
+    """Скомпилированные правила: все ответы заранее разложены по неизменяемым словарям"""
+    
+    def __init__(self, rules, mtime=None):
+        self.mtime = mtime
+        self.titles = MappingProxyType({d: rule.get('title', d) for d, rule in rules.items()})
+        
+        documents = {}  # дисциплина -> группа -> документ
+        defaults = {}   # дисциплина -> документ для групп вне списка (для админов и учителей)
+        groups = {}     # дисциплина -> отсортированные группы
+        for discipline, rule in rules.items():
+            by_group = {}
+            for document in rule.get('documents', ()):
+                for group in document['groups']:
+                    by_group[group] = document['id']
+            for group in rule.get('groups', ()):
+                by_group.setdefault(group, None)
+            documents[discipline] = MappingProxyType(by_group)
+            defaults[discipline] = rule.get('default_document')
+            groups[discipline] = tuple(sorted(by_group))
+        
+        self.groups = MappingProxyType(groups)
+        self._documents = MappingProxyType(documents)
+        self._defaults = MappingProxyType(defaults)
+        
+        # Готовые ответы "какие дисциплины и документы видит группа" для студентов и для персонала
+        all_groups = {group for by_group in documents.values() for group in by_group}
+        self._student = MappingProxyType({
+            group: self._build_access(group, is_staff=False) for group in all_groups})
+        self._staff = MappingProxyType({
+            group: self._build_access(group, is_staff=True) for group in all_groups})
+        self._staff_default = self._build_access(None, is_staff=True)
+    
+    def _build_access(self, group, is_staff):
+        access = {}
+        for discipline, by_group in self._documents.items():
+            if group in by_group:
+                access[discipline] = by_group[group] or self._defaults[discipline]
+            elif is_staff:
+                access[discipline] = self._defaults[discipline]
+        return MappingProxyType(access)
+    
+    def access_for(self, group, is_staff=False):
+        """Возвращает {дисциплина: id документа или None} для всех доступных дисциплин"""
+        if is_staff:
+            return self._staff.get(group, self._staff_default)
+        return self._student.get(group, _EMPTY)
+    
+    def has_access(self, discipline, group, is_staff=False):
+        return discipline in self.access_for(group, is_staff)
+    
+    def document_for(self, discipline, group):
+        """Документ дисциплины для группы, для неизвестной группы - документ по умолчанию"""
+        return self._documents.get(discipline, _EMPTY).get(group) or self._defaults.get(discipline)
+    
+    def groups_for(self, discipline):
+        return self.groups.get(discipline, ())
+
+def load(path=POLICY_PATH):
+    """Читает и компилирует правила из файла"""
+    mtime = os.stat(path).st_mtime_ns
+    with open(path, encoding='utf-8') as f:
+        return Policy(json.load(f), mtime=mtime)
+
+_policy = None
+_next_check = 0.0
+_failed_mtime = None  # Версия файла, которую не удалось прочитать - не пытаемся снова
+_lock = threading.Lock()
+
+def get_policy():
+    """Текущие правила; раз в RELOAD_CHECK_INTERVAL секунд проверяет, не изменился ли файл"""
+    global _policy, _next_check, _failed_mtime
+    
+    if _policy is not None and time.monotonic() < _next_check:
+        return _policy
+    
+    with _lock:
+        if _policy is not None and time.monotonic() < _next_check:
+            return _policy
+        _next_check = time.monotonic() + RELOAD_CHECK_INTERVAL
+        
+        mtime = None
+        try:
+            mtime = os.stat(POLICY_PATH).st_mtime_ns
+            if _policy is None or mtime not in (_policy.mtime, _failed_mtime):
+                # Новые правила собираются целиком и подменяют старые одним присваиванием
+                _policy = load(POLICY_PATH)
+                print(f"✅ Правила доступа загружены: {', '.join(_policy.groups)}")
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if _policy is None:
+                raise
+            _failed_mtime = mtime
+            print(f"⚠️ Не удалось перечитать {POLICY_PATH}, остаются прежние правила: {e}")
+        
+        return _policy
+
+if __name__ == '__main__':
+    policy = get_policy()
+    groups = [group for discipline in policy.groups for group in policy.groups[discipline]]
+    groups += ['ЧУЖАЯ', None]
+    checks = 1_000_000
+    
+    start = time.perf_counter()
+    for i in range(checks):
+        access = get_policy().access_for(groups[i % len(groups)], is_staff=i % 5 == 0)
+        OBSHCHESTVOZNANIE in access and access[OBSHCHESTVOZNANIE]
+    elapsed = time.perf_counter() - start
+    
+    print(f"✅ {checks} проверок за {elapsed:.2f} с: {checks / elapsed:,.0f} проверок/с")
@@ -1,22 +1,42 @@
-from flask import Flask, render_template, request, redirect, url_for, session, make_response, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, make_response, jsonify, g
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.middleware.proxy_fix import ProxyFix
+import os
 import secrets
-import random
 import asyncio
-from config import SECRET_KEY
+from config import SECRET_KEY, GROUPS, TRUSTED_PROXIES
 import database
+import access_policy
+import assets
+import fonts
+from render_cache import render_cached
+import roster_cache
+import code_store
+import export
+import session_store
+import metrics
 import bot as telegram_bot
+import delivery
+from limiter import create_limiter, MAX_ATTEMPTS
+
+JINJA_CACHE_DIR = os.path.join(database.DATA_DIR, 'jinja_cache')
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
 
 app = Flask(__name__)
 app.secret_key = SECRET_KEY
+# Скомпилированные шаблоны сохраняются на диск: новые воркеры не компилируют их заново
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+if TRUSTED_PROXIES:
+    # За прокси request.remote_addr - адрес прокси, а лимиты входа считаются по IP клиента
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
 
 database.init_db()
-
-GROUPS = [
-    "ИСиП25-1", "ИСиП25к", "МК23", "МНЭ25",
-    "ОИБ25-1", "ОИБ25-2", "ОИБ25к", "ТЭС25", "ТЭС24",
-    "УК25-1", "УК25-2", "УК25к",
-    "ЭМ23", "ЭМ25", "ЭС25-1", "ЭС25-2", "ЭС24"
-]
+access_policy.get_policy()
+limiter = create_limiter()
+assets.init_app(app)
+fonts.init_app(app)
+session_store.init_app(app)
+metrics.init_app(app, bots=(telegram_bot.bot,))
 
 def get_cookie_id():
     if 'cookie_id' not in session:
@@ -26,126 +46,89 @@ def get_cookie_id():
 def is_logged_in():
     return 'user_id' in session
 
-def get_current_user():
-    if 'user_id' in session:
-        return database.get_user_by_id(session['user_id'])
-    return None
+def get_doc_id_for_group(group_name):
+    """Получает ID документа Обществознания для конкретной группы"""
+    return access_policy.get_policy().document_for(access_policy.OBSHCHESTVOZNANIE, group_name)
 
-def is_admin_or_teacher():
-    """Проверяет, является ли пользователь админом или учителем"""
-    if not is_logged_in():
-        return False
-    
-    user = get_current_user()
-    if not user:
-        return False
+def _load_principal():
+    principal = {
+        'user': None,
+        'is_staff': False,
+        'obsh_access': None,
+        'doc_id': None,
+        'phil_access': False
+    }
     
-    return user.get('is_admin') or user.get('role') == 'teacher'
-
-def can_access_philosophy():
-    """Проверяет, может ли пользователь получить доступ к дисциплине 'Основы философии'"""
-    if not is_logged_in():
-        return False
+    if 'user_id' not in session:
+        return principal
     
-    user = get_current_user()
+    user = database.get_user_by_id(session['user_id'])
     if not user:
-        return False
+        return principal
     
-    # Админы и учителя имеют доступ ко всему
-    if is_admin_or_teacher():
-        return True
+    is_staff = bool(user.get('is_admin') or user.get('role') == 'teacher')
+    # Админы и учителя видят все дисциплины, студенты - только дисциплины своей группы
+    access = access_policy.get_policy().access_for(user.get('group_name'), is_staff)
     
-    # Доступ только для групп ЭС24 и ТЭС24
-    allowed_groups = ['ЭС24', 'ТЭС24']
-    return user.get('group_name') in allowed_groups
+    principal.update({
+        'user': user,
+        'is_staff': is_staff,
+        'obsh_access': access_policy.OBSHCHESTVOZNANIE in access,
+        'doc_id': access.get(access_policy.OBSHCHESTVOZNANIE),
+        'phil_access': access_policy.PHILOSOPHY in access
+    })
+    return principal
 
-def get_doc_id_for_group(group_name):
-    """Получает ID документа для конкретной группы"""
-    # Группа 1: УК25к, ИСиП25-1, ЭМ23, МК23, ЭС25-1, ЭС25-2, УК25-2
-    group1 = ['УК25к', 'ИСиП25-1', 'ЭМ23', 'МК23', 'ЭС25-1', 'ЭС25-2', 'УК25-2']
-    doc1_id = '1NinpeaaHuRZtMvFWs3Wp3vXVPnzu05PDCoJhh5RnWYQ'
-    
-    # Группа 2: ОИБ25-1, ОИБ25-2, ОИБ25к, УК25-1, ИСиП25к, МНЭ25, ТЭС25, ЭМ25
-    group2 = ['ОИБ25-1', 'ОИБ25-2', 'ОИБ25к', 'УК25-1', 'ИСиП25к', 'МНЭ25', 'ТЭС25', 'ЭМ25']
-    doc2_id = '1DYEZFxMTJ9v76dWqkAy8vZ_A0n1EeZDtZCBcmcDoBIw'
-    
-    if group_name in group1:
-        return doc1_id
-    elif group_name in group2:
-        return doc2_id
-    else:
-        return doc1_id  # По умолчанию
+def get_principal():
+    """Возвращает пользователя и его права, загруженные один раз за запрос"""
+    if 'principal' not in g:
+        g.principal = _load_principal()
+    return g.principal
+
+def get_current_user():
+    return get_principal()['user']
+
+def is_admin_or_teacher():
+    """Проверяет, является ли пользователь админом или учителем"""
+    return get_principal()['is_staff']
+
+def can_access_philosophy():
+    """Проверяет, может ли пользователь получить доступ к дисциплине 'Основы философии'"""
+    return get_principal()['phil_access']
 
 def get_obshchestvoznanie_access():
     """Возвращает информацию о доступе к Обществознанию и ссылку на документ"""
-    if not is_logged_in():
-        return None, None
-    
-    user = get_current_user()
-    if not user:
-        return None, None
-    
-    group = user.get('group_name')
-    
-    # Админы и учителя имеют доступ к документу своей группы (или к первому, если группы нет)
-    if is_admin_or_teacher():
-        doc_id = get_doc_id_for_group(group) if group else '1NinpeaaHuRZtMvFWs3Wp3vXVPnzu05PDCoJhh5RnWYQ'
-        return True, doc_id
-    
-    # Группа 1: УК25к, ИСиП25-1, ЭМ23, МК23, ЭС25-1, ЭС25-2, УК25-2
-    group1 = ['УК25к', 'ИСиП25-1', 'ЭМ23', 'МК23', 'ЭС25-1', 'ЭС25-2', 'УК25-2']
-    doc1_id = '1NinpeaaHuRZtMvFWs3Wp3vXVPnzu05PDCoJhh5RnWYQ'
-    
-    # Группа 2: ОИБ25-1, ОИБ25-2, ОИБ25к, УК25-1, ИСиП25к, МНЭ25, ТЭС25, ЭМ25
-    group2 = ['ОИБ25-1', 'ОИБ25-2', 'ОИБ25к', 'УК25-1', 'ИСиП25к', 'МНЭ25', 'ТЭС25', 'ЭМ25']
-    doc2_id = '1DYEZFxMTJ9v76dWqkAy8vZ_A0n1EeZDtZCBcmcDoBIw'
-    
-    if group in group1:
-        return True, doc1_id
-    elif group in group2:
-        return True, doc2_id
-    else:
-        return False, None
+    principal = get_principal()
+    return principal['obsh_access'], principal['doc_id']
 
 @app.context_processor
 def inject_user():
-    user = get_current_user()
-    has_obsh_access = False
-    has_phil_access = False
-    
-    if user:
-        # Проверка доступа к обществознанию
-        has_obsh_access, _ = get_obshchestvoznanie_access()
-        has_obsh_access = has_obsh_access or False
-        
-        # Проверка доступа к философии
-        has_phil_access = can_access_philosophy()
-    
+    principal = get_principal()
     return {
-        'user': user,
-        'has_obsh_access': has_obsh_access,
-        'has_phil_access': has_phil_access
+        'user': principal['user'],
+        'has_obsh_access': principal['obsh_access'] or False,
+        'has_phil_access': principal['phil_access']
     }
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_cached(get_principal(), 'index.html')
 
 @app.route('/info')
 def info():
-    return render_template('info.html')
+    return render_cached(get_principal(), 'info.html')
 
 @app.route('/profile')
 def profile():
     if not is_logged_in():
         return redirect(url_for('login'))
     
-    user = database.get_user_by_id(session['user_id'])
+    user = get_current_user()
     if not user:
         session.clear()
         return redirect(url_for('login'))
     
-    return render_template('profile.html', user=user)
+    return render_template('profile.html', user=user, groups=GROUPS, can_export=is_admin_or_teacher())
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -154,7 +137,7 @@ def login():
     
     cookie_id = get_cookie_id()
     
-    if database.is_cookie_blocked(cookie_id):
+    if limiter.is_blocked(cookie_id, request.remote_addr, session.get('login_user_id')):
         return render_template('blocked.html')
     
     if request.method == 'POST':
@@ -164,61 +147,76 @@ def login():
             group = request.form.get('group')
             if group in GROUPS:
                 session['selected_group'] = group
-                users = database.get_users_by_group(group)
+                users = roster_cache.get_users(group)
                 return render_template('login.html', groups=GROUPS, step='select_user', 
                                      selected_group=group, users=users)
         
         elif action == 'select_user':
+            # Список имён мог прийти из /login/roster без шага select_group на сервере
+            if request.form.get('group') in GROUPS:
+                session['selected_group'] = request.form['group']
             user_id = request.form.get('user_id')
             user = database.get_user_by_id(int(user_id))
             
             if user:
-                code = ''.join([str(random.randint(0, 9)) for _ in range(4)])
-                database.create_login_code(user['id'], code)
+                code = code_store.issue(user['id'])
+                
+                delivery_id = delivery.send_login_code(user['telegram_id'], code)
                 
-                try:
-                    success = telegram_bot.send_login_code_sync(user['telegram_id'], code)
-                    
-                    if success:
-                        session['login_user_id'] = user['id']
-                        return render_template('login.html', groups=GROUPS, step='enter_code', 
-                                             user=user)
-                    else:
-                        return render_template('login.html', groups=GROUPS, step='select_user',
-                                             selected_group=session.get('selected_group'),
-                                             users=database.get_users_by_group(session.get('selected_group')),
-                                             error='Ошибка отправки кода. Проверь токен бота.')
-                except Exception as e:
-                    print(f"❌ Критическая ошибка отправки кода: {e}")
-                    import traceback
-                    traceback.print_exc()
+                if delivery_id:
+                    session['login_user_id'] = user['id']
+                    session['delivery_id'] = delivery_id
+                    return render_template('login.html', groups=GROUPS, step='enter_code', 
+                                         user=user)
+                else:
                     return render_template('login.html', groups=GROUPS, step='select_user',
                                          selected_group=session.get('selected_group'),
-                                         users=database.get_users_by_group(session.get('selected_group')),
-                                         error=f'Ошибка отправки кода: {str(e)}')
+                                         users=roster_cache.get_users(session.get('selected_group')),
+                                         error='Слишком много запросов кода. Попробуй через минуту.')
         
         elif action == 'verify_code':
             code = request.form.get('code')
             user_id = session.get('login_user_id')
+            if user_id is None or not code:
+                # Код не запрашивали или не ввели - это не попытка подбора, в лимиты не идёт
+                return redirect(url_for('login'))
             
-            if database.verify_code(user_id, code):
-                database.reset_failed_attempts(cookie_id, user_id)
+            if code_store.verify(user_id, code):
+                limiter.register_success(cookie_id, user_id)
+                database.record_login(user_id)
                 session['user_id'] = user_id
                 session.permanent = True
                 return redirect(url_for('profile'))
             else:
-                attempts = database.increment_failed_attempts(cookie_id, user_id)
+                attempts = limiter.register_failure(cookie_id, user_id, request.remote_addr)
                 
-                if attempts >= 3:
-                    database.block_cookie(cookie_id)
+                if attempts >= MAX_ATTEMPTS:
                     return redirect(url_for('blocked'))
                 
                 user = database.get_user_by_id(user_id)
                 return render_template('login.html', groups=GROUPS, step='enter_code',
-                                     user=user, error=f'Неверный код. Осталось попыток: {3 - attempts}')
+                                     user=user, error=f'Неверный код. Осталось попыток: {MAX_ATTEMPTS - attempts}')
     
     return render_template('login.html', groups=GROUPS, step='select_group')
 
+@app.route('/login/roster/<group>')
+def login_roster(group):
+    """Список студентов группы в JSON; браузер кэширует его и сверяет по ETag"""
+    if group not in GROUPS:
+        return jsonify({'error': 'unknown group'}), 404
+    
+    payload, etag = roster_cache.get_payload(group)
+    response = make_response(payload)
+    response.mimetype = 'application/json'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/login/code-status')
+def login_code_status():
+    """Статус доставки кода входа для опроса со страницы ввода кода"""
+    return jsonify({'status': delivery.get_status(session.get('delivery_id'))})
+
 @app.route('/blocked')
 def blocked():
     return render_template('blocked.html')
@@ -238,7 +236,7 @@ def rub_login():
     
     cookie_id = get_cookie_id()
     
-    if database.is_cookie_blocked(cookie_id):
+    if limiter.is_blocked(cookie_id, request.remote_addr, session.get('login_user_id')):
         return redirect(url_for('blocked'))
     
     if request.method == 'POST':
@@ -250,51 +248,61 @@ def rub_login():
             
             # Только учителя могут входить через /rub
             if user and user.get('role') == 'teacher':
-                code = ''.join([str(random.randint(0, 9)) for _ in range(4)])
-                database.create_login_code(user['id'], code)
+                code = code_store.issue(user['id'])
                 
-                try:
-                    success = telegram_bot.send_login_code_sync(user['telegram_id'], code)
-                    if success:
-                        session['login_user_id'] = user['id']
-                        session['selected_group'] = user.get('group_name')
-                        return render_template('rub.html', step='enter_code', user=user)
-                    else:
-                        return render_template('rub.html', step='select_user',
-                                             users=database.get_teachers(),
-                                             error='Ошибка отправки кода. Проверь токен бота.')
-                except Exception as e:
-                    print(f"❌ Ошибка отправки кода: {e}")
+                delivery_id = delivery.send_login_code(user['telegram_id'], code)
+                if delivery_id:
+                    session['login_user_id'] = user['id']
+                    session['delivery_id'] = delivery_id
+                    session['selected_group'] = user.get('group_name')
+                    return render_template('rub.html', step='enter_code', user=user)
+                else:
                     return render_template('rub.html', step='select_user',
                                          users=database.get_teachers(),
-                                         error=f'Ошибка отправки кода: {str(e)}')
+                                         error='Слишком много запросов кода. Попробуй через минуту.')
         
         elif action == 'verify_code':
             code = request.form.get('code')
             user_id = session.get('login_user_id')
+            if user_id is None or not code:
+                # Код не запрашивали или не ввели - это не попытка подбора, в лимиты не идёт
+                return redirect(url_for('rub_login'))
             
-            if database.verify_code(user_id, code):
-                database.reset_failed_attempts(cookie_id, user_id)
+            if code_store.verify(user_id, code):
+                limiter.register_success(cookie_id, user_id)
+                database.record_login(user_id)
                 session['user_id'] = user_id
                 session.pop('login_user_id', None)
                 return redirect(url_for('profile'))
             else:
-                attempts = database.increment_failed_attempts(cookie_id, user_id)
-                if attempts >= 3:
-                    database.block_cookie(cookie_id)
+                attempts = limiter.register_failure(cookie_id, user_id, request.remote_addr)
+                if attempts >= MAX_ATTEMPTS:
                     return redirect(url_for('blocked'))
                 
                 user = database.get_user_by_id(user_id)
                 return render_template('rub.html', step='enter_code',
-                                     user=user, error=f'Неверный код. Осталось попыток: {3 - attempts}')
+                                     user=user, error=f'Неверный код. Осталось попыток: {MAX_ATTEMPTS - attempts}')
     
     users = database.get_teachers()
     return render_template('rub.html', step='select_user', users=users)
 
+@app.route('/export')
+def export_users():
+    """Выгрузка пользователей в CSV/XLSX для учителей и админов, отдаётся потоком"""
+    if not is_admin_or_teacher():
+        return redirect(url_for('login'))
+    
+    fmt = request.args.get('format', 'csv')
+    group = request.args.get('group') or None
+    role = request.args.get('role') or None
+    if fmt not in export.FORMATS or (group and group not in GROUPS) or (role and role not in export.ROLES):
+        return jsonify({'error': 'bad filter'}), 400
+    return export.users_response(fmt, group, role)
+
 @app.route('/conf')
 def conf():
     from datetime import datetime
-    return render_template('conf.html', current_date=datetime.now().strftime('%d.%m.%Y'))
+    return render_cached(get_principal(), 'conf.html', current_date=datetime.now().strftime('%d.%m.%Y'))
 
 @app.route('/o')
 def obshchestvoznanie():
@@ -310,19 +318,12 @@ def obshchestvoznanie():
     
     # Для админов и учителей показываем выбор группы
     if is_admin_or_teacher():
-        # Все группы, у которых есть Обществознание
-        all_groups = [
-            'ИСиП25-1', 'ИСиП25к', 'МК23', 'МНЭ25',
-            'ОИБ25-1', 'ОИБ25-2', 'ОИБ25к',
-            'ТЭС25', 'УК25-1', 'УК25-2', 'УК25к',
-            'ЭМ23', 'ЭМ25', 'ЭС25-1', 'ЭС25-2'
-        ]
-        # Сортируем в алфавитном порядке
-        all_groups.sort()
-        return render_template('obshchestvoznanie_select_group.html', 
+        # Все группы, у которых есть Обществознание, уже отсортированы
+        all_groups = access_policy.get_policy().groups_for(access_policy.OBSHCHESTVOZNANIE)
+        return render_cached(get_principal(), 'obshchestvoznanie_select_group.html', 
                              all_groups=all_groups)
     
-    return render_template('obshchestvoznanie.html')
+    return render_cached(get_principal(), 'obshchestvoznanie.html')
 
 @app.route('/o/group/<group_name>')
 def obshchestvoznanie_for_group(group_name):
@@ -354,7 +355,7 @@ def obshchestvoznanie_document():
         doc_id = get_doc_id_for_group(selected_group)
     
     document_url = f'https://docs.google.com/document/d/{doc_id}'
-    return render_template('obshchestvoznanie_document.html', document_url=document_url)
+    return render_cached(get_principal(), 'obshchestvoznanie_document.html', document_url=document_url)
 
 @app.route('/o/fullscreen')
 def obshchestvoznanie_fullscreen():
@@ -376,20 +377,24 @@ def obshchestvoznanie_fullscreen():
     iframe_url = f'https://docs.google.com/document/d/{doc_id}/preview'
     return render_template('obshchestvoznanie_fullscreen.html', iframe_url=iframe_url)
 
+def philosophy_blocked_message():
+    groups = access_policy.get_policy().groups_for(access_policy.PHILOSOPHY)
+    return f'Дисциплина "Основы философии" доступна только для групп {" и ".join(groups)}'
+
 @app.route('/of')
 def osnovy_filosofii():
     if not can_access_philosophy():
         return render_template('blocked.html', 
                              title='Доступ ограничен',
-                             message='Дисциплина "Основы философии" доступна только для групп ЭС24 и ТЭС24')
-    return render_template('philosophy.html')
+                             message=philosophy_blocked_message())
+    return render_cached(get_principal(), 'philosophy.html')
 
 @app.route('/of/document')
 def philosophy_document():
     if not can_access_philosophy():
         return render_template('blocked.html', 
                              title='Доступ ограничен',
-                             message='Дисциплина "Основы философии" доступна только для групп ЭС24 и ТЭС24')
+                             message=philosophy_blocked_message())
     return render_template('philosophy_document.html')
 
 @app.route('/of/fullscreen')
@@ -397,10 +402,11 @@ def philosophy_fullscreen():
     if not can_access_philosophy():
         return render_template('blocked.html', 
                              title='Доступ ограничен',
-                             message='Дисциплина "Основы философии" доступна только для групп ЭС24 и ТЭС24')
+                             message=philosophy_blocked_message())
     return render_template('philosophy_fullscreen.html')
 
-
 if __name__ == '__main__':
     database.init_db()
+    assets.build()
+    delivery.start_in_thread(telegram_bot.bot)
     app.run(host='0.0.0.0', port=80)
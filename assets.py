@@ -0,0 +1,351 @@
+"""Сборка статики: минификация, хэш в имени файла, сжатые gzip/brotli копии,
+уменьшенные копии картинок в WebP/AVIF.
+
+Запуск сборки: python assets.py (main.py делает это сам при старте)
+Байты по сети для первого и повторного визита: python assets.py bench
+"""
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+import sys
+from flask import request, send_from_directory, abort, url_for
+from markupsafe import Markup
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+# Что собирать: каталоги внутри static и расширения файлов
+SOURCES = {
+    'css': ('.css',),
+    'js': ('.js',),
+}
+
+# Уже сжатые файлы: копируются с хэшем в имени, без gzip/brotli
+BINARY_SOURCES = {
+    'fonts': ('.woff2',),
+}
+
+# Картинки: каталог -> ширины уменьшенных копий (None - только исходный размер)
+IMAGE_SOURCES = {
+    'images': (320, 640, 960, 1280),
+    'icon': None,
+}
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Дополнительные форматы картинок в порядке предпочтения
+IMAGE_FORMATS = {
+    'avif': {'format': 'AVIF', 'quality': 55, 'speed': 6},
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 6},
+}
+IMAGE_MIMETYPES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+}
+MIMETYPES = {**IMAGE_MIMETYPES, 'woff2': 'font/woff2'}
+
+HASHED_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# files: исходный путь -> путь собранного файла внутри static
+# images: исходный путь -> размеры, уменьшенные копии и доступные форматы
+_manifest = {'files': {}, 'images': {}}
+
+def minify_css(text):
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    text = re.sub(r':\s+', ':', text)
+    return text.replace(';}', '}').strip()
+
+def minify_js(text):
+    # Осторожная минификация без разбора JS: убираем отступы, пустые строки
+    # и строки, целиком состоящие из комментария
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+MINIFIERS = {
+    '.css': minify_css,
+    '.js': minify_js,
+}
+
+def build():
+    """Собирает статику в static/dist и пишет manifest.json, возвращает манифест"""
+    manifest = {'files': {}, 'images': {}}
+    
+    for directory, extensions in SOURCES.items():
+        source_dir = os.path.join(STATIC_DIR, directory)
+        for name in sorted(os.listdir(source_dir)):
+            base, ext = os.path.splitext(name)
+            if ext not in extensions:
+                continue
+            
+            with open(os.path.join(source_dir, name), encoding='utf-8') as f:
+                content = MINIFIERS[ext](f.read()).encode('utf-8')
+            
+            digest = hashlib.sha256(content).hexdigest()[:10]
+            hashed_name = f'{directory}/{base}.{digest}{ext}'
+            _write_variants(hashed_name, _compressed_variants(content))
+            manifest['files'][f'{directory}/{name}'] = f'dist/{hashed_name}'
+    
+    for directory, extensions in BINARY_SOURCES.items():
+        source_dir = os.path.join(STATIC_DIR, directory)
+        if not os.path.isdir(source_dir):
+            continue
+        for name in sorted(os.listdir(source_dir)):
+            base, ext = os.path.splitext(name)
+            if ext not in extensions:
+                continue
+            
+            with open(os.path.join(source_dir, name), 'rb') as f:
+                content = f.read()
+            
+            digest = hashlib.sha256(content).hexdigest()[:10]
+            hashed_name = f'{directory}/{base}.{digest}{ext}'
+            _write_variants(hashed_name, {'': content})
+            manifest['files'][f'{directory}/{name}'] = f'dist/{hashed_name}'
+    
+    if Image is not None:
+        for directory, widths in IMAGE_SOURCES.items():
+            source_dir = os.path.join(STATIC_DIR, directory)
+            for name in sorted(os.listdir(source_dir)):
+                if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+                    continue
+                source = f'{directory}/{name}'
+                image = _build_image(source, widths)
+                manifest['images'][source] = image
+                # Исходный путь ведёт на самую большую копию
+                manifest['files'][source] = image['srcset'][-1][1]
+    else:
+        print("⚠️ Pillow не установлен - картинки отдаются без обработки")
+    
+    os.makedirs(DIST_DIR, exist_ok=True)
+    tmp_path = MANIFEST_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, MANIFEST_PATH)
+    _manifest.update(manifest)
+    return manifest
+
+def _compressed_variants(content):
+    variants = {'': content, '.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(content, quality=11)
+    return variants
+
+def _write_variants(hashed_name, variants):
+    path = os.path.join(DIST_DIR, hashed_name)
+    # Имя содержит хэш содержимого - уже записанные варианты актуальны, дописываются
+    # только недостающие (например, .br после установки brotli)
+    missing = [suffix for suffix in variants if not os.path.exists(path + suffix)]
+    if not missing:
+        return
+    
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Сначала дополнительные варианты, затем сам файл - по нему проверяется готовность
+    for suffix in sorted(missing, key=bool, reverse=True):
+        with open(path + suffix, 'wb') as f:
+            f.write(variants[suffix])
+
+def _build_image(source, widths):
+    """Создаёт уменьшенные копии картинки в исходном формате, WebP и AVIF"""
+    with open(os.path.join(STATIC_DIR, source), 'rb') as f:
+        data = f.read()
+    
+    digest = hashlib.sha256(data).hexdigest()[:10]
+    directory, name = source.split('/', 1)
+    base = os.path.splitext(name)[0]
+    
+    with Image.open(io.BytesIO(data)) as original:
+        original.load()
+    # Расширение по настоящему формату файла (nsk.png на самом деле JPEG)
+    is_jpeg = original.format == 'JPEG'
+    ext = '.jpg' if is_jpeg else '.png'
+    
+    sizes = sorted({w for w in (widths or ()) if w < original.width} | {original.width})
+    srcset = []
+    for width in sizes:
+        hashed_name = f'{directory}/{base}.{digest}.{width}{ext}'
+        if not os.path.exists(os.path.join(DIST_DIR, hashed_name)):
+            height = round(original.height * width / original.width)
+            resized = original if width == original.width else original.resize((width, height), Image.LANCZOS)
+            _write_variants(hashed_name, _image_variants(resized, is_jpeg))
+        srcset.append([width, f'dist/{hashed_name}'])
+    
+    formats = [fmt for fmt in IMAGE_FORMATS if features.check(fmt)]
+    return {'width': original.width, 'height': original.height, 'srcset': srcset, 'formats': formats}
+
+def _image_variants(image, is_jpeg):
+    variants = {}
+    
+    buffer = io.BytesIO()
+    if is_jpeg:
+        image.convert('RGB').save(buffer, 'JPEG', quality=82, optimize=True, progressive=True)
+    else:
+        image.save(buffer, 'PNG', optimize=True)
+    variants[''] = buffer.getvalue()
+    
+    for suffix, options in IMAGE_FORMATS.items():
+        if not features.check(suffix):
+            continue
+        options = dict(options)
+        buffer = io.BytesIO()
+        image.save(buffer, options.pop('format'), **options)
+        variants[f'.{suffix}'] = buffer.getvalue()
+    
+    return variants
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _accepted(header):
+    return {part.split(';')[0].strip() for part in request.headers.get(header, '').split(',')}
+
+def picture(filename, alt, class_=None, sizes='100vw'):
+    """<picture> с AVIF/WebP и srcset уменьшенных копий; без сборки - обычный <img>"""
+    class_attr = Markup(' class="{}"').format(class_) if class_ else ''
+    image = _manifest['images'].get(filename)
+    if image is None:
+        return Markup('<img src="{}" alt="{}"{}>').format(
+            url_for('static', filename=filename), alt, class_attr)
+    
+    def srcset(suffix):
+        return ', '.join(
+            f"{url_for('static', filename=path)}{suffix} {width}w" for width, path in image['srcset'])
+    
+    sources = ''.join(
+        Markup('<source type="{}" srcset="{}" sizes="{}">').format(
+            IMAGE_MIMETYPES[fmt], srcset(f'.{fmt}'), sizes)
+        for fmt in image['formats']
+    )
+    img = Markup(
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}"{} loading="lazy" decoding="async">'
+    ).format(url_for('static', filename=filename), srcset(''), sizes,
+             image['width'], image['height'], alt, class_attr)
+    return Markup('<picture>') + Markup(sources) + img + Markup('</picture>')
+
+def init_app(app):
+    """Подменяет url_for('static', ...) на собранные файлы и отдаёт их с долгим кэшем"""
+    manifest = load_manifest()
+    _manifest['files'].update(manifest.get('files', {}))
+    _manifest['images'].update(manifest.get('images', {}))
+    app.add_template_global(picture)
+    
+    @app.url_defaults
+    def hashed_static_url(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in _manifest['files']:
+            values['filename'] = _manifest['files'][values['filename']]
+    
+    @app.route('/static/dist/<path:filename>')
+    def hashed_static(filename):
+        if not os.path.isfile(os.path.join(DIST_DIR, filename)):
+            abort(404)
+        
+        ext = filename.rsplit('.', 1)[-1]
+        mimetype = MIMETYPES.get(ext) or mimetypes.guess_type(filename)[0]
+        
+        if ext in ('png', 'jpg'):
+            # Картинка по исходному адресу (иконки, url_for) - лучший формат из Accept
+            accepted = _accepted('Accept')
+            for fmt in IMAGE_FORMATS:
+                if IMAGE_MIMETYPES[fmt] in accepted and os.path.isfile(os.path.join(DIST_DIR, f'{filename}.{fmt}')):
+                    response = send_from_directory(DIST_DIR, f'{filename}.{fmt}', mimetype=IMAGE_MIMETYPES[fmt])
+                    break
+            else:
+                response = send_from_directory(DIST_DIR, filename, mimetype=mimetype)
+            response.headers['Vary'] = 'Accept'
+        else:
+            accepted = _accepted('Accept-Encoding')
+            for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+                if encoding in accepted and os.path.isfile(os.path.join(DIST_DIR, filename + suffix)):
+                    response = send_from_directory(DIST_DIR, filename + suffix, mimetype=mimetype)
+                    response.headers['Content-Encoding'] = encoding
+                    break
+            else:
+                response = send_from_directory(DIST_DIR, filename, mimetype=mimetype)
+            response.headers['Vary'] = 'Accept-Encoding'
+        
+        response.headers['Cache-Control'] = HASHED_CACHE_CONTROL
+        return response
+
+def _wire_check(pages=('/', '/info')):
+    """Байты по сети для первого и повторного визита: исходные файлы против собранных
+    (минификация, gzip/brotli, immutable-кэш)"""
+    import tempfile
+    accept = 'image/avif,image/webp,image/png,*/*'
+    os.environ.setdefault('BOT_TOKEN', '123456:ABCDEFabcdef')
+    import database
+    from app import app
+    
+    built = build()
+    source_of = {f"/static/{target}": source for source, target in built['files'].items()}
+    database.close_pool()
+    database.DATABASE = os.path.join(tempfile.mkdtemp(), 'wire.db')
+    database.init_db()
+    client = app.test_client()
+    
+    assets = set()
+    for page in pages:
+        html = client.get(page).get_data(as_text=True)
+        assets.update(re.findall(r'(?:href|src)="(/static/[^"]+)"', html))
+    assets = sorted(assets)
+    assert assets and all(url in source_of for url in assets), f"Не все файлы собраны: {assets}"
+    
+    print(f"{'файл':<40}{'исходный':>10}{'собранный':>11}{'gzip':>8}{'br':>8}")
+    raw_total = 0
+    first_visit = {}
+    for url in assets:
+        with open(os.path.join(STATIC_DIR, source_of[url]), 'rb') as f:
+            raw = len(f.read())
+        raw_total += raw
+        sizes = {}
+        for encoding in ('identity', 'gzip', 'br'):
+            response = client.get(url, headers={'Accept-Encoding': encoding, 'Accept': accept})
+            sizes[encoding] = len(response.get_data())
+            compressible = url.endswith(('.css', '.js')) and encoding != 'identity' and (encoding == 'gzip' or brotli)
+            assert response.headers.get('Content-Encoding') == (encoding if compressible else None), url
+            assert response.headers['Cache-Control'] == HASHED_CACHE_CONTROL, url
+            response.close()
+        first_visit[url] = sizes
+        print(f"{source_of[url]:<40}{raw:>10}{sizes['identity']:>11}{sizes['gzip']:>8}{sizes['br']:>8}")
+    
+    # Повторный визит: хэшированные файлы с immutable браузер берёт из кэша без запроса.
+    # Без сборки Flask отдаёт static без Cache-Control - браузер перепроверяет каждый файл (304)
+    for encoding in ('identity', 'gzip', 'br'):
+        total = sum(sizes[encoding] for sizes in first_visit.values())
+        print(f"✅ Первый визит ({encoding}): {total} байт против {raw_total} без сборки ({total / raw_total:.0%})")
+    revalidated = 0
+    for url in assets:
+        response = client.get(f'/static/{source_of[url]}')
+        etag = response.headers.get('ETag')
+        if 'max-age' not in response.headers.get('Cache-Control', '') and etag:
+            revalidated += client.get(f'/static/{source_of[url]}', headers={'If-None-Match': etag}).status_code == 304
+        response.close()
+    print(f"✅ Повторный визит: 0 байт и 0 запросов за статикой против {revalidated} перепроверок (304) без сборки")
+    assert sum(sizes['gzip'] for sizes in first_visit.values()) < raw_total
+    database.close_pool()
+
+if __name__ == '__main__' and len(sys.argv) == 2 and sys.argv[1] == 'bench':
+    _wire_check()
+elif __name__ == '__main__':
+    built = build()
+    print(f"✅ Собрано файлов: {len(built['files'])}")
+    for source, target in built['files'].items():
+        print(f"  {source} -> {target}")
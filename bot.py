@@ -1,24 +1,26 @@
 import asyncio
+import os
 import random
+import tempfile
+from datetime import datetime, timedelta
 from aiogram import Bot, Dispatcher, F
-from aiogram.filters import Command, StateFilter
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
-from config import BOT_TOKEN
-import database
-
-GROUPS = [
-    "ИСиП25-1", "ИСиП25к", "МК23", "МНЭ25",
-    "ОИБ25-1", "ОИБ25-2", "ОИБ25к", "ТЭС25", "ТЭС24",
-    "УК25-1", "УК25-2", "УК25к",
-    "ЭМ23", "ЭМ25", "ЭС25-1", "ЭС25-2", "ЭС24"
-]
+from config import BOT_TOKEN, GROUPS
+from fsm_storage import SQLiteStorage
+import database_async
+import webhook
+import broadcast
+import roster_import
 
 SUPER_ADMIN_ID = 5720640497
 ADMIN_PASSWORD = "админ123"
 
+PHOTO_CACHE_TTL = timedelta(hours=12)  # Как часто сверять фото профиля с Telegram
+
 class Registration(StatesGroup):
     waiting_for_group = State()
     waiting_for_fio = State()
@@ -29,10 +31,22 @@ class AdminRegistration(StatesGroup):
     waiting_for_group = State()
     waiting_for_confirmation = State()
 
+class BroadcastForm(StatesGroup):
+    waiting_for_group = State()
+    waiting_for_text = State()
+    waiting_for_confirmation = State()
+
+# sqlite - состояния регистрации переживают перезапуск, memory - только в памяти
+FSM_STORAGE = os.environ.get('FSM_STORAGE', 'sqlite')
+
 bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+storage = MemoryStorage() if FSM_STORAGE == 'memory' else SQLiteStorage()
 dp = Dispatcher(storage=storage)
 
+@dp.shutdown()
+async def on_shutdown():
+    await storage.close()
+
 def get_groups_keyboard(with_back=True):
     buttons = []
     row = []
@@ -57,40 +71,72 @@ def get_role_choice_keyboard():
     ]
     return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
 
+def get_broadcast_confirm_keyboard():
+    keyboard = [
+        [KeyboardButton(text="✅ Отправить")],
+        [KeyboardButton(text="◀️ Отмена")]
+    ]
+    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+
 def get_profile_keyboard():
     keyboard = [[KeyboardButton(text="👤 Профиль")]]
     return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
 
-async def get_user_photo_url(user_id: int):
-    """Получает URL фото профиля пользователя"""
+def _cached_photo(user):
+    return {
+        'photo_url': user.get('photo_url'),
+        'photo_file_id': user.get('photo_file_id'),
+        'photo_file_unique_id': user.get('photo_file_unique_id')
+    }
+
+async def get_user_photo(telegram_id: int, user=None):
+    """Получает фото профиля пользователя: {'photo_url', 'photo_file_id', 'photo_file_unique_id'}.
+    Пока кэш в записи пользователя свежий, Bot API не вызывается; get_file -
+    только если фото сменилось. Для зарегистрированных кэш сохраняется в базу"""
+    if user and user.get('photo_checked_at'):
+        checked_at = datetime.fromisoformat(user['photo_checked_at'])
+        if datetime.now() - checked_at < PHOTO_CACHE_TTL:
+            return _cached_photo(user)
+    
     try:
-        photos = await bot.get_user_profile_photos(user_id, limit=1)
+        photos = await bot.get_user_profile_photos(telegram_id, limit=1)
         if photos.total_count > 0:
             photo = photos.photos[0][-1]  # Берём самое большое фото
-            file = await bot.get_file(photo.file_id)
-            photo_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file.file_path}"
-            return photo_url
+            if user and user.get('photo_file_unique_id') == photo.file_unique_id:
+                photo_url = user.get('photo_url')
+            else:
+                file = await bot.get_file(photo.file_id)
+                photo_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file.file_path}"
+            result = {
+                'photo_url': photo_url,
+                'photo_file_id': photo.file_id,
+                'photo_file_unique_id': photo.file_unique_id
+            }
+        else:
+            result = _cached_photo({})
     except Exception as e:
         print(f"Ошибка получения фото: {e}")
-    return None
+        return _cached_photo(user or {})
+    
+    if user:
+        await database_async.update_user_photo(telegram_id, **result)
+    return result
 
 @dp.message(Command("start"))
 async def cmd_start(message: Message, state: FSMContext):
     telegram_id = message.from_user.id
     telegram_username = message.from_user.username
     telegram_name = message.from_user.full_name
-    
-    photo_url = await get_user_photo_url(telegram_id)
     has_premium = message.from_user.is_premium or False
     
-    user = database.get_user_by_telegram(telegram_id)
+    user = await database_async.get_user_by_telegram(telegram_id)
     
     if user:
-        database.update_user_profile(
+        await get_user_photo(telegram_id, user)
+        await database_async.update_user_profile(
             telegram_id=telegram_id,
             telegram_username=telegram_username,
             telegram_name=telegram_name,
-            photo_url=photo_url,
             has_premium=has_premium
         )
         
@@ -132,10 +178,126 @@ async def cmd_help(message: Message):
     await message.answer(
         "📖 Команды бота:\n\n"
         "/start - Регистрация или проверка профиля\n"
-        "/help - Помощь\n\n"
+        "/help - Помощь\n"
+        "/broadcast - Сообщение всей группе (для учителей и администраторов)\n"
+        "/import - Загрузка списка студентов группы (для администраторов)\n\n"
         "Для входа на сайт используй систему авторизации через выбор группы и имени."
     )
 
+@dp.message(Command("broadcast"))
+async def cmd_broadcast(message: Message, state: FSMContext):
+    user = await database_async.get_user_by_telegram(message.from_user.id)
+    if not user or not (user.get('role') == 'teacher' or user.get('is_admin')):
+        await message.answer("❌ Рассылка доступна только учителям и администраторам.")
+        return
+    
+    await state.clear()
+    await message.answer(
+        "📢 Сообщение всей группе\n\n"
+        "Выбери группу:",
+        reply_markup=get_groups_keyboard()
+    )
+    await state.set_state(BroadcastForm.waiting_for_group)
+
+@dp.message(BroadcastForm.waiting_for_group)
+async def process_broadcast_group(message: Message, state: FSMContext):
+    if message.text == "◀️ Назад":
+        await state.clear()
+        await message.answer("Рассылка отменена.", reply_markup=get_profile_keyboard())
+        return
+    
+    if message.text not in GROUPS:
+        await message.answer(
+            "❌ Пожалуйста, выбери группу из списка:",
+            reply_markup=get_groups_keyboard()
+        )
+        return
+    
+    await state.update_data(group_name=message.text)
+    await message.answer(
+        f"✏️ Напиши сообщение для группы {message.text}:",
+        reply_markup=ReplyKeyboardRemove()
+    )
+    await state.set_state(BroadcastForm.waiting_for_text)
+
+@dp.message(BroadcastForm.waiting_for_text)
+async def process_broadcast_text(message: Message, state: FSMContext):
+    if not message.text:
+        await message.answer("❌ Отправь сообщение текстом.")
+        return
+    
+    await state.update_data(text=message.text)
+    data = await state.get_data()
+    await message.answer(
+        f"📋 Сообщение для группы {data['group_name']}:\n\n"
+        f"{message.text}\n\n"
+        f"Отправить?",
+        reply_markup=get_broadcast_confirm_keyboard()
+    )
+    await state.set_state(BroadcastForm.waiting_for_confirmation)
+
+@dp.message(BroadcastForm.waiting_for_confirmation)
+async def process_broadcast_confirmation(message: Message, state: FSMContext):
+    if message.text != "✅ Отправить":
+        await state.clear()
+        await message.answer("Рассылка отменена.", reply_markup=get_profile_keyboard())
+        return
+    
+    data = await state.get_data()
+    user = await database_async.get_user_by_telegram(message.from_user.id)
+    sender = f"{user['last_name']} {user['first_name']} {user['middle_name'] or ''}".strip()
+    _, total = await broadcast.create(
+        message.from_user.id,
+        data['group_name'],
+        f"📢 Сообщение от {sender}:\n\n{data['text']}"
+    )
+    await state.clear()
+    await message.answer(
+        f"🚀 Рассылка запущена: {total} получателей в группе {data['group_name']}.\n"
+        f"Пришлю отчёт, когда она закончится.",
+        reply_markup=get_profile_keyboard()
+    )
+
+@dp.message(Command("import"))
+async def cmd_import(message: Message, command: CommandObject):
+    """Загрузка списка студентов: файл CSV или XLSX с подписью /import [группа]"""
+    user = await database_async.get_user_by_telegram(message.from_user.id)
+    if message.from_user.id != SUPER_ADMIN_ID and not (user and user.get('is_admin')):
+        await message.answer("❌ Загрузка списков доступна только администраторам.")
+        return
+    
+    if not message.document:
+        waiting = await database_async.count_roster_students()
+        text = (
+            "📥 Загрузка списка студентов\n\n"
+            "Отправь файл CSV или XLSX с подписью /import.\n"
+            "Нужны столбцы «Группа», «Фамилия», «Имя», «Отчество» (или один столбец «ФИО»).\n"
+            "Если столбца группы нет, укажи её в подписи: /import ЭМ25"
+        )
+        if waiting:
+            text += "\n\nЕщё не зарегистрировались:\n" + "\n".join(
+                f"{group}: {count}" for group, count in waiting.items())
+        await message.answer(text)
+        return
+    
+    file_name = message.document.file_name or ''
+    if not file_name.lower().endswith(('.csv', '.xlsx', '.xlsm')):
+        await message.answer("❌ Поддерживаются только файлы CSV и XLSX.")
+        return
+    
+    await message.answer("⏳ Загружаю список...")
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, os.path.basename(file_name))
+            await bot.download(message.document, destination=path)
+            report = await asyncio.to_thread(roster_import.import_file, path, (command.args or '').strip() or None)
+    except Exception as e:
+        print(f"❌ Ошибка загрузки списка: {e}")
+        await message.answer(f"❌ Не удалось загрузить список: {e}")
+        return
+    
+    await message.answer(roster_import.format_report(report))
+
 # ПРИОРИТЕТНЫЙ обработчик пароля админа - обрабатывается ПЕРЕД всеми состояниями!
 @dp.message(F.text == ADMIN_PASSWORD)
 async def admin_password_entered(message: Message, state: FSMContext):
@@ -143,7 +305,7 @@ async def admin_password_entered(message: Message, state: FSMContext):
     telegram_id = message.from_user.id
     
     # Проверяем, не зарегистрирован ли уже пользователь
-    existing_user = database.get_user_by_telegram(telegram_id)
+    existing_user = await database_async.get_user_by_telegram(telegram_id)
     if existing_user:
         await message.answer(
             "❌ Ты уже зарегистрирован в системе!\n"
@@ -240,25 +402,26 @@ async def process_fio(message: Message, state: FSMContext):
     telegram_username = message.from_user.username
     telegram_name = message.from_user.full_name
     
-    photo_url = await get_user_photo_url(telegram_id)
+    photo = await get_user_photo(telegram_id)
     has_premium = message.from_user.is_premium or False
     
     try:
-        user_id = database.create_user(
+        # Если студент есть в загруженном списке группы, ФИО возьмётся оттуда
+        user, _ = await database_async.register_student(
             telegram_id=telegram_id,
             telegram_username=telegram_username,
             telegram_name=telegram_name,
-            photo_url=photo_url,
             has_premium=has_premium,
             group_name=group,
             last_name=last_name,
             first_name=first_name,
-            middle_name=middle_name
+            middle_name=middle_name,
+            **photo
         )
         
-        full_name = f"{last_name} {first_name}"
-        if middle_name:
-            full_name += f" {middle_name}"
+        full_name = f"{user['last_name']} {user['first_name']}"
+        if user['middle_name']:
+            full_name += f" {user['middle_name']}"
         
         await message.answer(
             f"✅ Регистрация завершена!\n\n"
@@ -398,11 +561,11 @@ async def process_admin_fio(message: Message, state: FSMContext):
     telegram_id = message.from_user.id
     telegram_username = message.from_user.username
     telegram_name = message.from_user.full_name
-    photo_url = await get_user_photo_url(telegram_id)
+    photo = await get_user_photo(telegram_id)
     has_premium = message.from_user.is_premium or False
     
     # Создаем ожидающую регистрацию
-    confirmation_code = database.create_pending_registration(
+    confirmation_code = await database_async.create_pending_registration(
         telegram_id=telegram_id,
         last_name=last_name,
         first_name=first_name,
@@ -412,7 +575,7 @@ async def process_admin_fio(message: Message, state: FSMContext):
         group_name=group_name,
         telegram_username=telegram_username,
         telegram_name=telegram_name,
-        photo_url=photo_url,
+        photo_url=photo['photo_url'],
         has_premium=has_premium
     )
     
@@ -460,12 +623,10 @@ async def process_confirmation_code(message: Message, state: FSMContext):
         )
         return
     
-    # Проверяем и подтверждаем регистрацию
-    success = database.confirm_pending_registration(telegram_id, confirmation_code)
+    # Проверяем и подтверждаем регистрацию: пользователь создаётся одной транзакцией
+    user = await database_async.confirm_pending_registration(telegram_id, confirmation_code)
     
-    if success:
-        user = database.get_user_by_telegram(telegram_id)
-        
+    if user:
         if user['role'] == "teacher":
             await message.answer(
                 f"✅ Регистрация подтверждена!\n\n"
@@ -508,7 +669,7 @@ async def process_confirmation_code(message: Message, state: FSMContext):
 @dp.message(F.text == "👤 Профиль")
 async def show_profile(message: Message):
     telegram_id = message.from_user.id
-    user = database.get_user_by_telegram(telegram_id)
+    user = await database_async.get_user_by_telegram(telegram_id)
     
     if not user:
         await message.answer(
@@ -518,19 +679,19 @@ async def show_profile(message: Message):
         )
         return
     
-    # Обновляем фото при просмотре профиля
-    photo_url = await get_user_photo_url(telegram_id)
-    has_premium = message.from_user.is_premium or False
-    
-    if photo_url:
-        database.update_user_profile(
-            telegram_id=telegram_id,
-            telegram_username=message.from_user.username,
-            telegram_name=message.from_user.full_name,
-            photo_url=photo_url,
-            has_premium=has_premium
-        )
-        user = database.get_user_by_telegram(telegram_id)  # Обновляем данные
+    # Обновляем фото при просмотре профиля (из кэша, пока он свежий)
+    user.update(await get_user_photo(telegram_id, user))
+    user.update(
+        telegram_username=message.from_user.username,
+        telegram_name=message.from_user.full_name,
+        has_premium=message.from_user.is_premium or False
+    )
+    await database_async.update_user_profile(
+        telegram_id=telegram_id,
+        telegram_username=user['telegram_username'],
+        telegram_name=user['telegram_name'],
+        has_premium=user['has_premium']
+    )
     
     profile_text = f"👤 *Мой профиль*\n\n"
     profile_text += f"🆔 ID: `{user['telegram_id']}`\n"
@@ -574,10 +735,14 @@ async def show_profile(message: Message):
     else:
         profile_text += f"https://pashq.ru/login"
     
-    if user.get('photo_url'):
+    if user.get('photo_file_id') or user.get('photo_url'):
         try:
-            from aiogram.types import URLInputFile
-            photo = URLInputFile(user['photo_url'])
+            if user.get('photo_file_id'):
+                # Отправка по file_id не требует повторной загрузки фото в Telegram
+                photo = user['photo_file_id']
+            else:
+                from aiogram.types import URLInputFile
+                photo = URLInputFile(user['photo_url'])
             await message.answer_photo(
                 photo=photo,
                 caption=profile_text,
@@ -598,34 +763,14 @@ async def show_profile(message: Message):
             reply_markup=get_profile_keyboard()
         )
 
-def send_login_code_sync(telegram_id: int, code: str):
-    """Синхронная функция для отправки кода"""
-    try:
-        import requests
-        from config import BOT_TOKEN
-        
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-        data = {
-            "chat_id": telegram_id,
-            "text": f"🔐 Код для входа на сайт:\n\n*{code}*\n\nКод действителен 5 минут.\nУ тебя есть 3 попытки ввода.",
-            "parse_mode": "Markdown"
-        }
-        
-        response = requests.post(url, json=data, timeout=5)
-        return response.status_code == 200
-    except Exception as e:
-        print(f"❌ Ошибка отправки кода: {e}")
-        return False
-
-async def send_login_code(telegram_id: int, code: str):
-    """Асинхронная обертка"""
-    return send_login_code_sync(telegram_id, code)
-
 async def main():
-    database.init_db()
+    import delivery
+    await database_async.init_db()
     print("✅ База данных инициализирована")
+    delivery.start(bot)
+    await broadcast.start(bot)
     print("🤖 Бот запущен")
-    await dp.start_polling(bot)
+    await webhook.run(bot, dp)
 
 if __name__ == '__main__':
     asyncio.run(main())
@@ -0,0 +1,193 @@
+"""Рассылки учителей по группам через бота.
+
+Получатели фиксируются в базе при создании рассылки, результаты сохраняются
+после каждой пачки, поэтому после перезапуска рассылка продолжается с места
+остановки (сообщения последней несохранённой пачки могут уйти повторно).
+
+Нагрузочная проверка с поддельным Bot API: python broadcast.py bench [получателей]
+"""
+import asyncio
+import sys
+import time
+from aiogram.exceptions import (TelegramRetryAfter, TelegramForbiddenError, TelegramNetworkError,
+                                TelegramServerError, RestartingTelegram)
+import database_async
+
+GLOBAL_RATE = 25            # Сообщений в секунду на всех (лимит Telegram ~30, запас - для кодов входа)
+PER_CHAT_INTERVAL = 1       # Не чаще одного сообщения в секунду в один чат
+BATCH_SIZE = 100            # Получателей в пачке; прогресс сохраняется после каждой
+SEND_CONCURRENCY = 10       # Одновременных запросов к Bot API внутри пачки
+MAX_RETRIES = 4
+BACKOFF_BASE = 1
+
+class RateLimiter:
+    """Выдаёт моменты отправки: не больше rate сообщений в секунду всего
+    и не чаще per_chat_interval в один чат; retry_after от Telegram ставит паузу для всех"""
+    
+    def __init__(self, rate=GLOBAL_RATE, per_chat_interval=PER_CHAT_INTERVAL):
+        self._interval = 1 / rate
+        self._per_chat_interval = per_chat_interval
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._chat_next = {}  # chat_id -> когда можно писать в чат снова
+    
+    async def wait(self, chat_id):
+        now = time.monotonic()
+        slot = max(now, self._next_slot, self._paused_until)
+        self._next_slot = slot + self._interval
+        
+        chat_slot = max(slot, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = chat_slot + self._per_chat_interval
+        if len(self._chat_next) > 10000:
+            self._chat_next = {chat: t for chat, t in self._chat_next.items() if t > now}
+        
+        if chat_slot > now:
+            await asyncio.sleep(chat_slot - now)
+    
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+_bot = None
+_limiter = None
+_tasks = {}  # broadcast_id -> задача отправки
+
+async def _send(chat_id, text):
+    for attempt in range(MAX_RETRIES + 1):
+        await _limiter.wait(chat_id)
+        try:
+            await _bot.send_message(chat_id, text)
+            return True
+        except TelegramRetryAfter as e:
+            # Превышен лимит - Telegram просит подождать, это касается всех отправок
+            _limiter.pause(e.retry_after)
+            continue
+        except TelegramForbiddenError:
+            return False  # Пользователь заблокировал бота
+        except (TelegramNetworkError, TelegramServerError, RestartingTelegram) as e:
+            print(f"⚠️ Ошибка отправки рассылки (попытка {attempt + 1}): {e}")
+            await asyncio.sleep(BACKOFF_BASE * 2 ** attempt)
+        except Exception as e:
+            print(f"❌ Ошибка отправки рассылки: {e}")
+            return False
+    return False
+
+async def _run(broadcast_id):
+    broadcast = await database_async.get_broadcast(broadcast_id)
+    semaphore = asyncio.Semaphore(SEND_CONCURRENCY)
+    started = time.perf_counter()
+    sent_now = 0
+    
+    async def send_one(chat_id):
+        async with semaphore:
+            return chat_id, await _send(chat_id, broadcast['text'])
+    
+    while True:
+        batch = await database_async.get_broadcast_batch(broadcast_id, BATCH_SIZE)
+        if not batch:
+            break
+        results = await asyncio.gather(*(send_one(chat_id) for chat_id in batch))
+        sent = [chat_id for chat_id, ok in results if ok]
+        failed = [chat_id for chat_id, ok in results if not ok]
+        await database_async.save_broadcast_results(broadcast_id, sent, failed)
+        sent_now += len(results)
+    
+    await database_async.finish_broadcast(broadcast_id)
+    elapsed = time.perf_counter() - started
+    broadcast = await database_async.get_broadcast(broadcast_id)
+    report = {
+        'id': broadcast_id,
+        'group': broadcast['group_name'],
+        'total': broadcast['total'],
+        'sent': broadcast['sent'],
+        'failed': broadcast['failed'],
+        'seconds': round(elapsed, 2),
+        'per_second': round(sent_now / elapsed, 1) if elapsed else 0
+    }
+    print(f"📢 Рассылка {broadcast_id} завершена: {report}")
+    return report
+
+async def _run_and_notify(broadcast_id):
+    try:
+        report = await _run(broadcast_id)
+        broadcast = await database_async.get_broadcast(broadcast_id)
+        await _bot.send_message(
+            broadcast['sender_telegram_id'],
+            f"📢 Рассылка для группы {report['group']} завершена\n\n"
+            f"✅ Доставлено: {report['sent']} из {report['total']}\n"
+            f"❌ Не доставлено: {report['failed']}\n"
+            f"⏱ {report['seconds']} с ({report['per_second']} сообщений в секунду)"
+        )
+    except Exception as e:
+        print(f"❌ Ошибка рассылки {broadcast_id}: {e}")
+    finally:
+        _tasks.pop(broadcast_id, None)
+
+def launch(broadcast_id):
+    if broadcast_id not in _tasks:
+        _tasks[broadcast_id] = asyncio.create_task(_run_and_notify(broadcast_id))
+
+async def create(sender_telegram_id, group_name, text):
+    """Создаёт рассылку и запускает её отправку, возвращает (id, число получателей)"""
+    broadcast_id = await database_async.create_broadcast(sender_telegram_id, group_name, text)
+    broadcast = await database_async.get_broadcast(broadcast_id)
+    launch(broadcast_id)
+    return broadcast_id, broadcast['total']
+
+async def start(bot, rate=GLOBAL_RATE):
+    """Запускается в цикле бота: продолжает рассылки, прерванные перезапуском"""
+    global _bot, _limiter
+    _bot = bot
+    _limiter = RateLimiter(rate)
+    for broadcast_id in await database_async.get_running_broadcasts():
+        print(f"📢 Продолжаем рассылку {broadcast_id}")
+        launch(broadcast_id)
+
+async def _benchmark(recipients=10000, rate=1000):
+    """Рассылка на recipients получателей через поддельный Bot API с задержкой ответа,
+    редкими retry_after и заблокированными пользователями"""
+    import os
+    import random
+    import tempfile
+    from aiogram.methods import SendMessage
+    import database
+    
+    database.DATABASE = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    database.init_db()
+    with database.get_db() as conn:
+        conn.executemany(
+            'INSERT INTO users (telegram_id, group_name, last_name, first_name) VALUES (?, ?, ?, ?)',
+            [(100000 + i, 'ЭМ25', f'Фамилия{i}', 'Имя') for i in range(recipients)]
+        )
+        conn.commit()
+    
+    class FakeBot:
+        def __init__(self):
+            self.calls = 0
+        
+        async def send_message(self, chat_id, text, **kwargs):
+            self.calls += 1
+            await asyncio.sleep(random.uniform(0.02, 0.06))  # Время ответа Bot API
+            method = SendMessage(chat_id=chat_id, text=text)
+            if random.random() < 0.001:
+                raise TelegramRetryAfter(method=method, message='Too Many Requests', retry_after=1)
+            if chat_id % 50 == 0:
+                raise TelegramForbiddenError(method=method, message='bot was blocked by the user')
+    
+    fake = FakeBot()
+    await start(fake, rate=rate)
+    started = time.perf_counter()
+    broadcast_id = await database_async.create_broadcast(1, 'ЭМ25', 'Тестовая рассылка')
+    prepared = time.perf_counter() - started
+    report = await _run(broadcast_id)
+    database_async.shutdown()
+    
+    print(f"✅ {recipients} получателей выбраны за {prepared * 1000:.0f} мс, "
+          f"запросов к Bot API: {fake.calls}")
+    print(f"   при лимите {rate}/с: {report['per_second']} сообщений в секунду, {report['seconds']} с")
+    print(f"   с боевым лимитом {GLOBAL_RATE}/с та же рассылка займёт ~{recipients / GLOBAL_RATE / 60:.1f} мин")
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'bench':
+        asyncio.run(_benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 10000))
+    else:
+        print(__doc__)
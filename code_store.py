@@ -0,0 +1,201 @@
+"""Коды входа на сайт: один действующий код на пользователя, срок жизни 5 минут.
+
+CODE_STORE_BACKEND=memory - коды в памяти процесса, выдача и проверка без записи на диск.
+При остановке действующие коды сохраняются в login_codes и подхватываются после
+перезапуска при первой проверке.
+CODE_STORE_BACKEND=sqlite - коды сразу пишутся в login_codes; нужно, когда код
+проверяет не тот процесс, что выдал (несколько воркеров gunicorn).
+
+В обоих режимах хранится только HMAC кода, сравнение - за постоянное время.
+
+Нагрузочная проверка: python code_store.py bench
+"""
+import heapq
+import hmac
+import os
+import secrets
+import sys
+import threading
+import time
+from datetime import datetime
+from hashlib import sha256
+from config import SECRET_KEY
+from limiter import MAX_ATTEMPTS
+import database
+
+CODE_STORE_BACKEND = os.environ.get('CODE_STORE_BACKEND', 'memory')
+CODE_TTL = 5 * 60   # Срок жизни кода, секунд
+CODE_LENGTH = 4
+
+def _digest(user_id, code):
+    return hmac.new(SECRET_KEY.encode(), f'{user_id}:{code}'.encode(), sha256).hexdigest()
+
+def _new_code():
+    return f'{secrets.randbelow(10 ** CODE_LENGTH):0{CODE_LENGTH}d}'
+
+class MemoryCodeStore:
+    """Коды в памяти: словарь по пользователю и куча сроков для удаления просроченных"""
+    
+    def __init__(self, ttl=CODE_TTL, max_attempts=MAX_ATTEMPTS):
+        self._ttl = ttl
+        self._max_attempts = max_attempts
+        self._codes = {}   # user_id -> [хэш, истекает (unix time), неудачных попыток]
+        self._expiry = []  # (истекает, user_id); устаревшие записи пропускаются при разборе
+        self._lock = threading.Lock()
+    
+    def _expire(self, now):
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, user_id = heapq.heappop(self._expiry)
+            entry = self._codes.get(user_id)
+            if entry is not None and entry[1] == expires_at:
+                del self._codes[user_id]
+    
+    def _put(self, user_id, digest, expires_at, attempts=0):
+        self._codes[user_id] = [digest, expires_at, attempts]
+        heapq.heappush(self._expiry, (expires_at, user_id))
+    
+    def issue(self, user_id):
+        """Выдаёт новый код пользователю, прежний перестаёт действовать"""
+        code = _new_code()
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            self._put(user_id, _digest(user_id, code), now + self._ttl)
+        return code
+    
+    def _restore(self, user_id):
+        """Код, сохранённый при остановке процесса, переносится обратно в память"""
+        record = database.get_login_code(user_id)
+        if record is None:
+            return
+        database.delete_login_code(user_id)
+        with self._lock:
+            if user_id not in self._codes:
+                self._put(user_id, record['code'], record['expires_at'].timestamp(), record['attempts'])
+    
+    def verify(self, user_id, code):
+        """Проверяет код; верный код гасится, после max_attempts ошибок - тоже"""
+        digest = _digest(user_id, code or '')
+        with self._lock:
+            self._expire(time.time())
+            missing = user_id not in self._codes
+        if missing:
+            self._restore(user_id)
+        
+        with self._lock:
+            entry = self._codes.get(user_id)
+            if entry is None or entry[1] <= time.time():
+                return False
+            if hmac.compare_digest(entry[0], digest):
+                del self._codes[user_id]
+                return True
+            entry[2] += 1
+            if entry[2] >= self._max_attempts:
+                del self._codes[user_id]
+            return False
+    
+    def spill(self):
+        """Сохраняет действующие коды в базу перед остановкой процесса, возвращает их число"""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            codes = [(user_id, digest, datetime.fromtimestamp(expires_at), attempts)
+                     for user_id, (digest, expires_at, attempts) in self._codes.items()]
+            self._codes.clear()
+            self._expiry.clear()
+        if codes:
+            database.save_login_codes(codes)
+        return len(codes)
+
+@database.unit_of_work
+def _verify_shared(user_id, digest, max_attempts):
+    # Чтение, сравнение и погашение кода - одна транзакция, даже если проверяют два воркера сразу
+    record = database.get_login_code(user_id)
+    if record is None:
+        return False
+    if hmac.compare_digest(record['code'], digest):
+        database.delete_login_code(user_id)
+        return True
+    if database.record_login_code_failure(user_id) >= max_attempts:
+        database.delete_login_code(user_id)
+    return False
+
+class SQLiteCodeStore:
+    """Коды в login_codes: их видят все процессы"""
+    
+    def __init__(self, ttl=CODE_TTL, max_attempts=MAX_ATTEMPTS):
+        self._ttl = ttl
+        self._max_attempts = max_attempts
+    
+    def issue(self, user_id):
+        code = _new_code()
+        expires_at = datetime.fromtimestamp(time.time() + self._ttl)
+        database.save_login_codes([(user_id, _digest(user_id, code), expires_at, 0)])
+        return code
+    
+    def verify(self, user_id, code):
+        return _verify_shared(user_id, _digest(user_id, code or ''), self._max_attempts)
+    
+    def spill(self):
+        return 0
+
+def create_store(backend=CODE_STORE_BACKEND):
+    if backend == 'sqlite':
+        return SQLiteCodeStore()
+    return MemoryCodeStore()
+
+_store = create_store()
+
+def issue(user_id):
+    """Выдаёт пользователю новый код входа и возвращает его"""
+    return _store.issue(user_id)
+
+def verify(user_id, code):
+    """Проверяет код пользователя; подошедший код больше не действует"""
+    if user_id is None:
+        return False
+    return _store.verify(user_id, code)
+
+def spill():
+    """Вызывается при остановке процесса сайта"""
+    count = _store.spill()
+    if count:
+        print(f"✅ Сохранено кодов входа: {count}")
+
+def _benchmark(users=20000):
+    import tempfile
+    
+    database.DATABASE = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    database.init_db()
+    
+    for backend in ('memory', 'sqlite'):
+        store = create_store(backend)
+        count = users if backend == 'memory' else users // 10
+        
+        started = time.perf_counter()
+        codes = [store.issue(user_id) for user_id in range(count)]
+        issued = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        wrong = sum(store.verify(user_id, 'abcd') for user_id in range(count))
+        failed = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        right = sum(store.verify(user_id, code) for user_id, code in enumerate(codes))
+        verified = time.perf_counter() - started
+        
+        print(f"{backend}: выдача {count / issued:.0f}/с, неверный код {count / failed:.0f}/с, "
+              f"верный код {count / verified:.0f}/с (подошло {right} из {count}, ложных {wrong})")
+    
+    store = create_store('memory')
+    codes = [store.issue(user_id) for user_id in range(1000)]
+    spilled = store.spill()
+    restored = sum(create_store('memory').verify(user_id, code) for user_id, code in enumerate(codes))
+    print(f"перезапуск: сохранено {spilled}, после перезапуска подошло {restored}")
+    database.stop_writer()
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2 and sys.argv[1] == 'bench':
+        _benchmark()
+    else:
+        print(__doc__)
@@ -21,3 +21,14 @@ if not BOT_TOKEN:
 if not SECRET_KEY:
     SECRET_KEY = 'default-secret-key-change-this-in-production'
 
+# Сколько reverse proxy стоит перед сайтом (nginx и т.п.): IP клиента берётся из
+# X-Forwarded-For с учётом только их записей. 0 - сайт принимает соединения напрямую
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+
+# Учебные группы: выбор при регистрации и входе, проверка загружаемых списков
+GROUPS = [
+    "ИСиП25-1", "ИСиП25к", "МК23", "МНЭ25",
+    "ОИБ25-1", "ОИБ25-2", "ОИБ25к", "ТЭС25", "ТЭС24",
+    "УК25-1", "УК25-2", "УК25к",
+    "ЭМ23", "ЭМ25", "ЭС25-1", "ЭС25-2", "ЭС24"
+]
@@ -1,6 +1,12 @@
 import sqlite3
+import functools
 import json
 import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
 from datetime import datetime, timedelta
 from contextlib import contextmanager
 
@@ -10,15 +16,392 @@ if not os.path.exists(DATA_DIR):
 
 DATABASE = os.path.join(DATA_DIR, 'npek.db')
 
+# Пул соединений: Flask-потоки и цикл бота берут готовое соединение вместо connect/close
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+POOL_HEALTHCHECK_AFTER = 30  # секунд простоя, после которых соединение проверяется
+STATEMENT_CACHE_SIZE = 256
+
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 67108864',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA busy_timeout = 5000',
+)
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+
+def _connect():
+    conn = sqlite3.connect(
+        DATABASE,
+        timeout=5,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE
+    )
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def _is_healthy(conn):
+    try:
+        conn.execute('SELECT 1').fetchone()
+        return True
+    except sqlite3.Error:
+        return False
+
+def _acquire():
+    """Берёт соединение из пула или открывает новое"""
+    while True:
+        try:
+            conn, released_at = _pool.get_nowait()
+        except queue.Empty:
+            return _connect()
+        
+        if time.monotonic() - released_at < POOL_HEALTHCHECK_AFTER or _is_healthy(conn):
+            return conn
+        
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+def _release(conn):
+    """Возвращает соединение в пул, откатывая незавершённую транзакцию"""
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        _pool.put_nowait((conn, time.monotonic()))
+    except (sqlite3.Error, queue.Full):
+        # Соединение сломано или пул заполнен - просто закрываем
+        conn.close()
+
+def close_pool():
+    """Останавливает писателя и закрывает все простаивающие соединения пула"""
+    stop_writer()
+    while True:
+        try:
+            conn, _ = _pool.get_nowait()
+        except queue.Empty:
+            return
+        conn.close()
+
 @contextmanager
 def get_db():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+    # Внутри писателя - его соединение и текущая транзакция пачки
+    writer_conn = getattr(_writer_local, 'conn', None)
+    if writer_conn is not None:
+        yield writer_conn
+        return
+    
+    conn = _acquire()
     try:
         yield conn
     finally:
+        _release(conn)
+
+# Единственный писатель процесса: все изменения идут через одну очередь и один поток,
+# который складывает накопившиеся операции в одну транзакцию (group commit)
+WRITE_BATCH_SIZE = 256  # Максимум операций в одной транзакции
+
+_write_queue = queue.Queue()
+_writer_local = threading.local()
+_writer_thread = None
+_writer_lock = threading.Lock()
+_write_stats = {'jobs': 0, 'failed_jobs': 0, 'commits': 0, 'failed_commits': 0,
+                'commit_seconds': 0.0, 'max_batch': 0}
+WRITE_OBSERVERS = []  # callback(размер пачки, секунды) после каждого commit
+
+class _BatchConnection:
+    """Соединение писателя для одной операции пачки: commit() делает сам писатель"""
+    
+    def __init__(self, conn):
+        self._conn = conn
+    
+    def commit(self):
+        pass
+    
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+def _ensure_writer():
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None or not _writer_thread.is_alive():
+            _writer_thread = threading.Thread(target=_writer_loop, name='db-writer', daemon=True)
+            _writer_thread.start()
+
+def stop_writer():
+    """Дописывает очередь и останавливает поток писателя"""
+    global _writer_thread
+    with _writer_lock:
+        thread, _writer_thread = _writer_thread, None
+    if thread is not None and thread.is_alive():
+        _write_queue.put(None)
+        thread.join()
+
+def _writer_loop():
+    conn = _connect()
+    _writer_local.conn = _BatchConnection(conn)
+    try:
+        while True:
+            job = _write_queue.get()
+            if job is None:
+                return
+            batch = [job]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    job = _write_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    _write_queue.put(None)  # Остановимся после этой пачки
+                    break
+                batch.append(job)
+            _commit_batch(conn, batch)
+    finally:
+        _writer_local.conn = None
         conn.close()
 
+def _commit_batch(conn, batch):
+    started = time.perf_counter()
+    done = []
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        for func, args, kwargs, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            # Ошибка одной операции откатывает только её, а не всю пачку
+            try:
+                with savepoint():
+                    result = func(*args, **kwargs)
+            except Exception as e:
+                future.set_exception(e)
+                _write_stats['failed_jobs'] += 1
+            else:
+                done.append((future, result))
+        conn.commit()
+    except sqlite3.Error as e:
+        # Не удалось начать или зафиксировать транзакцию - ошибка у всей пачки
+        if conn.in_transaction:
+            conn.rollback()
+        for *_, future in batch:
+            if not future.done():
+                future.set_exception(e)
+        _write_stats['failed_commits'] += 1
+        print(f"❌ Ошибка записи пачки из {len(batch)} операций: {e}")
+        return
+    
+    elapsed = time.perf_counter() - started
+    for future, result in done:
+        future.set_result(result)
+    
+    _write_stats['jobs'] += len(batch)
+    _write_stats['commits'] += 1
+    _write_stats['commit_seconds'] += elapsed
+    _write_stats['max_batch'] = max(_write_stats['max_batch'], len(batch))
+    for observer in WRITE_OBSERVERS:
+        observer(len(batch), elapsed)
+
+@contextmanager
+def savepoint():
+    """Вложенная транзакция в потоке писателя: исключение внутри блока
+    откатывает только его изменения, внешняя транзакция продолжается"""
+    conn = _writer_local.conn
+    depth = _writer_local.depth = getattr(_writer_local, 'depth', 0) + 1
+    name = f'uow_{depth}'
+    conn.execute(f'SAVEPOINT {name}')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute(f'ROLLBACK TO {name}')
+        raise
+    finally:
+        conn.execute(f'RELEASE {name}')
+        _writer_local.depth = depth - 1
+
+def submit_write(func, *args, **kwargs):
+    """Ставит func(*args, **kwargs) в очередь писателя, возвращает concurrent.futures.Future.
+    func работает через get_db() и выполняется внутри общей транзакции пачки"""
+    future = Future()
+    if getattr(_writer_local, 'conn', None) is not None:
+        # Вызов из другой операции записи - выполняем сразу, в той же транзакции
+        try:
+            with savepoint():
+                future.set_result(func(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    
+    _ensure_writer()
+    _write_queue.put((func, args, kwargs, future))
+    return future
+
+def unit_of_work(func):
+    """Единица работы: функция выполняется писателем одной транзакцией,
+    вызывающий поток ждёт результат.
+    
+    Функции с этим декоратором можно вызывать друг из друга: вложенный вызов
+    идёт на том же соединении внутри SAVEPOINT, поэтому составная операция
+    фиксируется одним commit, а пойманная ошибка вложенного вызова откатывает
+    только его изменения. conn.commit() внутри единицы работы ничего не делает.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if getattr(_writer_local, 'conn', None) is not None:
+            with savepoint():
+                return func(*args, **kwargs)
+        return submit_write(func, *args, **kwargs).result()
+    return wrapper
+
+def write_stats():
+    """Счётчики писателя и текущая длина очереди"""
+    return {**_write_stats, 'queue_depth': _write_queue.qsize()}
+
+def _bump_roster_version(row):
+    """SQL для триггера: увеличивает версию списка группы из строки NEW или OLD"""
+    return f'''INSERT INTO roster_versions (group_name, version)
+               SELECT {row}.group_name, 1 WHERE {row}.group_name IS NOT NULL
+               ON CONFLICT (group_name) DO UPDATE SET version = version + 1;'''
+
+# Версионированные миграции схемы: номер элемента списка + 1 = PRAGMA user_version
+SCHEMA_MIGRATIONS = [
+    # 1: покрывающие индексы для выборок по группе, ролям и кодам входа
+    [
+        'CREATE INDEX IF NOT EXISTS idx_users_group_name ON users (group_name, last_name, first_name)',
+        'CREATE INDEX IF NOT EXISTS idx_users_role ON users (role, last_name, first_name)',
+        'CREATE INDEX IF NOT EXISTS idx_users_is_admin ON users (is_admin)',
+        'CREATE INDEX IF NOT EXISTS idx_login_codes_lookup ON login_codes (user_id, code, used, expires_at)',
+    ],
+    # 2: индексы по срокам жизни для фоновой очистки
+    [
+        'CREATE INDEX IF NOT EXISTS idx_login_codes_expires_at ON login_codes (expires_at)',
+        'CREATE INDEX IF NOT EXISTS idx_blocked_cookies_blocked_until ON blocked_cookies (blocked_until)',
+        'CREATE INDEX IF NOT EXISTS idx_failed_attempts_last_attempt ON failed_attempts (last_attempt)',
+    ],
+    # 3: кэш фото профиля по file_id / file_unique_id
+    [
+        'ALTER TABLE users ADD COLUMN photo_file_id TEXT',
+        'ALTER TABLE users ADD COLUMN photo_file_unique_id TEXT',
+        'ALTER TABLE users ADD COLUMN photo_checked_at TIMESTAMP',
+    ],
+    # 4: состояния FSM бота (незавершённые регистрации)
+    [
+        '''CREATE TABLE IF NOT EXISTS fsm_states (
+               key TEXT PRIMARY KEY,
+               state TEXT,
+               data TEXT NOT NULL DEFAULT '{}',
+               updated_at TIMESTAMP NOT NULL
+           )''',
+        'CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states (updated_at)',
+    ],
+    # 5: версии списков групп - триггеры увеличивают версию группы при любом изменении
+    # её списка, кто бы его ни менял (сайт, бот, другой процесс)
+    [
+        '''CREATE TABLE IF NOT EXISTS roster_versions (
+               group_name TEXT PRIMARY KEY,
+               version INTEGER NOT NULL DEFAULT 0
+           )''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_users_roster_insert AFTER INSERT ON users
+            BEGIN {_bump_roster_version('NEW')} END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_users_roster_update
+            AFTER UPDATE OF group_name, last_name, first_name ON users
+            BEGIN {_bump_roster_version('OLD')} {_bump_roster_version('NEW')} END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_users_roster_delete AFTER DELETE ON users
+            BEGIN {_bump_roster_version('OLD')} END''',
+    ],
+    # 6: серверные сессии сайта
+    [
+        '''CREATE TABLE IF NOT EXISTS sessions (
+               sid TEXT PRIMARY KEY,
+               user_id INTEGER,
+               data TEXT NOT NULL DEFAULT '{}',
+               version INTEGER NOT NULL DEFAULT 1,
+               expires_at TIMESTAMP NOT NULL
+           )''',
+        'CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON sessions (user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)',
+    ],
+    # 7: рассылки учителей по группам и их получатели (для продолжения после перезапуска)
+    [
+        '''CREATE TABLE IF NOT EXISTS broadcasts (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               sender_telegram_id INTEGER NOT NULL,
+               group_name TEXT NOT NULL,
+               text TEXT NOT NULL,
+               status TEXT NOT NULL DEFAULT 'running',
+               total INTEGER NOT NULL DEFAULT 0,
+               sent INTEGER NOT NULL DEFAULT 0,
+               failed INTEGER NOT NULL DEFAULT 0,
+               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               finished_at TIMESTAMP
+           )''',
+        'CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status)',
+        '''CREATE TABLE IF NOT EXISTS broadcast_recipients (
+               broadcast_id INTEGER NOT NULL,
+               telegram_id INTEGER NOT NULL,
+               status INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (broadcast_id, telegram_id)
+           ) WITHOUT ROWID''',
+    ],
+    # 8: коды входа живут в памяти сайта (code_store.py); в login_codes остаются только HMAC
+    # кодов - сохранённые при остановке или общие для нескольких воркеров, по одному на пользователя
+    [
+        'DELETE FROM login_codes',
+        'DROP INDEX IF EXISTS idx_login_codes_lookup',
+        'ALTER TABLE login_codes ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_login_codes_user_id ON login_codes (user_id)',
+    ],
+    # 9: студенты из загруженных списков групп, ещё не зарегистрированные в боте
+    [
+        '''CREATE TABLE IF NOT EXISTS roster_students (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               group_name TEXT NOT NULL,
+               last_name TEXT NOT NULL,
+               first_name TEXT NOT NULL,
+               middle_name TEXT,
+               name_key TEXT NOT NULL,
+               imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+           )''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_roster_students_name ON roster_students (group_name, name_key)',
+    ],
+    # 10: активность входа на сайт для выгрузки списков
+    [
+        'ALTER TABLE users ADD COLUMN last_login_at TIMESTAMP',
+        'ALTER TABLE users ADD COLUMN login_count INTEGER NOT NULL DEFAULT 0',
+    ],
+    # 11: статусы доставки кодов входа, общие для воркеров gunicorn
+    [
+        '''CREATE TABLE IF NOT EXISTS delivery_statuses (
+               delivery_id TEXT PRIMARY KEY,
+               status TEXT NOT NULL,
+               updated_at TIMESTAMP NOT NULL
+           )''',
+        'CREATE INDEX IF NOT EXISTS idx_delivery_statuses_updated_at ON delivery_statuses (updated_at)',
+    ],
+]
+
+def apply_migrations(conn):
+    """Применяет миграции схемы, которых ещё нет в базе.
+    Каждая миграция вместе с новым user_version - одна транзакция: сбой не оставит схему
+    изменённой наполовину, а воркеры, стартующие одновременно, применят её один раз"""
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Версию читаем уже под блокировкой записи - другой процесс мог успеть раньше
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version >= len(SCHEMA_MIGRATIONS):
+                conn.rollback()
+                return
+            for statement in SCHEMA_MIGRATIONS[version]:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version + 1}')
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
 def init_db():
     with get_db() as conn:
         conn.execute('''
@@ -89,30 +472,46 @@ def init_db():
         ''')
         
         conn.commit()
+        apply_migrations(conn)
 
+@unit_of_work
 def create_user(telegram_id, group_name, last_name, first_name, middle_name=None, 
                 telegram_username=None, telegram_name=None, photo_url=None, has_premium=False,
-                role='student', is_admin=False):
+                role='student', is_admin=False, photo_file_id=None, photo_file_unique_id=None):
     with get_db() as conn:
         cursor = conn.execute(
             '''INSERT INTO users (telegram_id, telegram_username, telegram_name, photo_url, has_premium,
-                                  group_name, last_name, first_name, middle_name, role, is_admin) 
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                                  group_name, last_name, first_name, middle_name, role, is_admin,
+                                  photo_file_id, photo_file_unique_id) 
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
             (telegram_id, telegram_username, telegram_name, photo_url, has_premium,
-             group_name, last_name, first_name, middle_name, role, is_admin)
+             group_name, last_name, first_name, middle_name, role, is_admin,
+             photo_file_id, photo_file_unique_id)
         )
         conn.commit()
         return cursor.lastrowid
 
-def update_user_profile(telegram_id, telegram_username=None, telegram_name=None, 
-                       photo_url=None, has_premium=False):
+@unit_of_work
+def update_user_profile(telegram_id, telegram_username=None, telegram_name=None, has_premium=False):
     with get_db() as conn:
         conn.execute(
             '''UPDATE users 
-               SET telegram_username = ?, telegram_name = ?, photo_url = ?, 
+               SET telegram_username = ?, telegram_name = ?, 
                    has_premium = ?, updated_at = CURRENT_TIMESTAMP
                WHERE telegram_id = ?''',
-            (telegram_username, telegram_name, photo_url, has_premium, telegram_id)
+            (telegram_username, telegram_name, has_premium, telegram_id)
+        )
+        conn.commit()
+
+@unit_of_work
+def update_user_photo(telegram_id, photo_url, photo_file_id, photo_file_unique_id):
+    """Сохраняет фото профиля и время последней сверки с Telegram"""
+    with get_db() as conn:
+        conn.execute(
+            '''UPDATE users 
+               SET photo_url = ?, photo_file_id = ?, photo_file_unique_id = ?, photo_checked_at = ?
+               WHERE telegram_id = ?''',
+            (photo_url, photo_file_id, photo_file_unique_id, datetime.now(), telegram_id)
         )
         conn.commit()
 
@@ -134,77 +533,76 @@ def get_users_by_group(group_name):
         ).fetchall()
         return [dict(user) for user in users]
 
-def create_login_code(user_id, code):
-    expires_at = datetime.now() + timedelta(minutes=5)
+def get_roster_version(group_name):
+    """Версия списка группы: меняется при каждом добавлении, удалении или переименовании студента"""
     with get_db() as conn:
-        conn.execute(
-            'INSERT INTO login_codes (user_id, code, expires_at) VALUES (?, ?, ?)',
-            (user_id, code, expires_at)
-        )
-        conn.commit()
+        row = conn.execute('SELECT version FROM roster_versions WHERE group_name = ?', (group_name,)).fetchone()
+        return row[0] if row else 0
 
-def verify_code(user_id, code):
+def get_login_code(user_id):
+    """Действующий код входа пользователя: {'code': HMAC кода, 'expires_at', 'attempts'} или None"""
     with get_db() as conn:
-        result = conn.execute(
-            '''SELECT * FROM login_codes 
-               WHERE user_id = ? AND code = ? AND used = 0 AND expires_at > ?''',
-            (user_id, code, datetime.now())
+        record = conn.execute(
+            'SELECT code, expires_at, attempts FROM login_codes WHERE user_id = ? AND expires_at > ?',
+            (user_id, datetime.now())
         ).fetchone()
-        
-        if result:
-            conn.execute('UPDATE login_codes SET used = 1 WHERE id = ?', (result['id'],))
-            conn.commit()
-            return True
-        return False
+        if not record:
+            return None
+        return {
+            'code': record['code'],
+            'expires_at': datetime.fromisoformat(record['expires_at']),
+            'attempts': record['attempts']
+        }
 
-def is_cookie_blocked(cookie_id):
+@unit_of_work
+def save_login_codes(codes):
+    """Сохраняет коды входа, заменяя прежние коды тех же пользователей.
+    codes - [(user_id, HMAC кода, expires_at, неудачных попыток)]"""
     with get_db() as conn:
-        result = conn.execute(
-            'SELECT * FROM blocked_cookies WHERE cookie_id = ? AND blocked_until > ?',
-            (cookie_id, datetime.now())
-        ).fetchone()
-        return result is not None
-
-def block_cookie(cookie_id):
-    blocked_until = datetime.now() + timedelta(minutes=10)
-    with get_db() as conn:
-        conn.execute(
-            'INSERT OR REPLACE INTO blocked_cookies (cookie_id, blocked_until) VALUES (?, ?)',
-            (cookie_id, blocked_until)
+        conn.executemany(
+            'INSERT OR REPLACE INTO login_codes (user_id, code, expires_at, attempts) VALUES (?, ?, ?, ?)',
+            codes
         )
         conn.commit()
 
-def increment_failed_attempts(cookie_id, user_id):
+@unit_of_work
+def record_login_code_failure(user_id):
+    """Учитывает неверный ввод кода, возвращает число неудачных попыток"""
     with get_db() as conn:
-        result = conn.execute(
-            'SELECT attempts FROM failed_attempts WHERE cookie_id = ? AND user_id = ?',
-            (cookie_id, user_id)
+        row = conn.execute(
+            'UPDATE login_codes SET attempts = attempts + 1 WHERE user_id = ? RETURNING attempts',
+            (user_id,)
         ).fetchone()
-        
-        if result:
-            new_attempts = result['attempts'] + 1
-            conn.execute(
-                'UPDATE failed_attempts SET attempts = ?, last_attempt = ? WHERE cookie_id = ? AND user_id = ?',
-                (new_attempts, datetime.now(), cookie_id, user_id)
-            )
-        else:
-            new_attempts = 1
-            conn.execute(
-                'INSERT INTO failed_attempts (cookie_id, user_id, attempts, last_attempt) VALUES (?, ?, ?, ?)',
-                (cookie_id, user_id, new_attempts, datetime.now())
-            )
-        
         conn.commit()
-        return new_attempts
+        return row[0] if row else 0
 
-def reset_failed_attempts(cookie_id, user_id):
+@unit_of_work
+def delete_login_code(user_id):
+    with get_db() as conn:
+        conn.execute('DELETE FROM login_codes WHERE user_id = ?', (user_id,))
+        conn.commit()
+
+def get_active_blocks():
+    """Возвращает действующие блокировки: {ключ: datetime окончания}"""
+    with get_db() as conn:
+        rows = conn.execute(
+            'SELECT cookie_id, blocked_until FROM blocked_cookies WHERE blocked_until > ?',
+            (datetime.now(),)
+        ).fetchall()
+        return {row['cookie_id']: datetime.fromisoformat(row['blocked_until']) for row in rows}
+
+@unit_of_work
+def block_cookie(cookie_id, blocked_until=None):
+    if blocked_until is None:
+        blocked_until = datetime.now() + timedelta(minutes=10)
     with get_db() as conn:
         conn.execute(
-            'DELETE FROM failed_attempts WHERE cookie_id = ? AND user_id = ?',
-            (cookie_id, user_id)
+            'INSERT OR REPLACE INTO blocked_cookies (cookie_id, blocked_until) VALUES (?, ?)',
+            (cookie_id, blocked_until)
         )
         conn.commit()
 
+@unit_of_work
 def create_pending_registration(telegram_id, last_name, first_name, middle_name, role, is_admin,
                                 group_name=None, telegram_username=None, telegram_name=None, 
                                 photo_url=None, has_premium=False):
@@ -233,8 +631,10 @@ def get_pending_registration(telegram_id):
         ).fetchone()
         return dict(pending) if pending else None
 
+@unit_of_work
 def confirm_pending_registration(telegram_id, confirmation_code):
-    """Подтверждает регистрацию и создает пользователя"""
+    """Подтверждает регистрацию и создает пользователя одной транзакцией.
+    Возвращает созданного пользователя или None, если код не подошёл"""
     with get_db() as conn:
         pending = conn.execute(
             'SELECT * FROM pending_registrations WHERE telegram_id = ? AND confirmation_code = ?',
@@ -242,9 +642,9 @@ def confirm_pending_registration(telegram_id, confirmation_code):
         ).fetchone()
         
         if not pending:
-            return False
+            return None
         
-        # Создаем пользователя
+        # Создаем пользователя - в той же транзакции
         create_user(
             telegram_id=pending['telegram_id'],
             group_name=pending['group_name'],
@@ -262,21 +662,92 @@ def confirm_pending_registration(telegram_id, confirmation_code):
         # Удаляем ожидающую регистрацию
         conn.execute('DELETE FROM pending_registrations WHERE telegram_id = ?', (telegram_id,))
         conn.commit()
-        return True
+        return get_user_by_telegram(telegram_id)
 
+@unit_of_work
 def delete_pending_registration(telegram_id):
     """Удаляет ожидающую регистрацию"""
     with get_db() as conn:
         conn.execute('DELETE FROM pending_registrations WHERE telegram_id = ?', (telegram_id,))
         conn.commit()
 
+def roster_name_key(last_name, first_name, middle_name=None):
+    """Ключ для сравнения ФИО без учёта регистра, лишних пробелов и ё/е"""
+    parts = (last_name, first_name, middle_name or '')
+    return ' '.join(' '.join(parts).split()).casefold().replace('ё', 'е')
+
+@unit_of_work
+def import_roster_students(students):
+    """Добавляет пачку студентов из списка группы одной транзакцией, пропуская уже загруженных.
+    students - [(group_name, last_name, first_name, middle_name)]; возвращает число добавленных"""
+    with get_db() as conn:
+        cursor = conn.executemany(
+            '''INSERT OR IGNORE INTO roster_students (group_name, last_name, first_name, middle_name, name_key)
+               VALUES (?, ?, ?, ?, ?)''',
+            [(group_name, last_name, first_name, middle_name,
+              roster_name_key(last_name, first_name, middle_name))
+             for group_name, last_name, first_name, middle_name in students]
+        )
+        conn.commit()
+        return cursor.rowcount
+
+def find_roster_student(group_name, last_name, first_name, middle_name=None):
+    """Незарегистрированный студент из списка группы. Если отчество не указано,
+    подходит запись с любым отчеством, но только когда она одна"""
+    key = roster_name_key(last_name, first_name, middle_name)
+    with get_db() as conn:
+        rows = conn.execute(
+            '''SELECT * FROM roster_students
+               WHERE group_name = ? AND (name_key = ? OR substr(name_key, 1, length(?) + 1) = ? || ' ')
+               ORDER BY name_key = ? DESC LIMIT 2''',
+            (group_name, key, key, key, key)
+        ).fetchall()
+        if not rows:
+            return None
+        if rows[0]['name_key'] == key or len(rows) == 1:
+            return dict(rows[0])
+        return None
+
+@unit_of_work
+def register_student(telegram_id, group_name, last_name, first_name, middle_name=None, **profile):
+    """Регистрирует студента из бота. Если он есть в загруженном списке группы, ФИО берётся
+    из списка, а запись списка удаляется - в той же транзакции.
+    Возвращает (пользователь, найден ли студент в списке)"""
+    student = find_roster_student(group_name, last_name, first_name, middle_name)
+    if student is not None:
+        last_name, first_name, middle_name = student['last_name'], student['first_name'], student['middle_name']
+        with get_db() as conn:
+            conn.execute('DELETE FROM roster_students WHERE id = ?', (student['id'],))
+    
+    create_user(telegram_id, group_name, last_name, first_name, middle_name, **profile)
+    return get_user_by_telegram(telegram_id), student is not None
+
+def get_registered_names():
+    """ФИО и группы всех пользователей с группой: [(group_name, last_name, first_name, middle_name)]"""
+    with get_db() as conn:
+        rows = conn.execute(
+            'SELECT group_name, last_name, first_name, middle_name FROM users WHERE group_name IS NOT NULL'
+        ).fetchall()
+        return [tuple(row) for row in rows]
+
+def count_roster_students():
+    """Сколько студентов из загруженных списков ещё не зарегистрировались: {группа: число}"""
+    with get_db() as conn:
+        rows = conn.execute(
+            'SELECT group_name, COUNT(*) FROM roster_students GROUP BY group_name ORDER BY group_name'
+        ).fetchall()
+        return {row[0]: row[1] for row in rows}
+
 def get_teachers_and_admins():
     """Получает всех учителей и админов для страницы /rub"""
     with get_db() as conn:
         users = conn.execute(
-            '''SELECT id, last_name, first_name, middle_name, role, is_admin, group_name 
-               FROM users 
-               WHERE role = "teacher" OR is_admin = 1
+            # UNION вместо OR: каждая половина ищет по своему индексу, а не просматривает таблицу
+            '''SELECT id, last_name, first_name, middle_name, role, is_admin, group_name
+               FROM users WHERE role = 'teacher'
+               UNION
+               SELECT id, last_name, first_name, middle_name, role, is_admin, group_name
+               FROM users WHERE is_admin = 1
                ORDER BY role DESC, last_name, first_name'''
         ).fetchall()
         return [dict(user) for user in users]
@@ -292,3 +763,359 @@ def get_teachers():
         ).fetchall()
         return [dict(user) for user in users]
 
+@unit_of_work
+def record_login(user_id):
+    """Отмечает успешный вход на сайт"""
+    with get_db() as conn:
+        conn.execute(
+            'UPDATE users SET last_login_at = ?, login_count = login_count + 1 WHERE id = ?',
+            (datetime.now(), user_id)
+        )
+        conn.commit()
+
+def iter_users_export(group_name=None, role=None, batch_size=1000):
+    """Пользователи с активностью входа для выгрузки - пачками по batch_size строк.
+    Строки читаются курсором по мере отправки, весь результат в памяти не собирается.
+    role: student, teacher или admin"""
+    conditions, params = [], [datetime.now()]
+    if group_name is not None:
+        conditions.append('u.group_name = ?')
+        params.append(group_name)
+    # Унарный плюс не даёт выбрать индекс по роли: порядок выдачи берётся из индекса
+    # по группе и ФИО, и SQLite не сортирует весь результат во временной таблице
+    if role == 'admin':
+        conditions.append('+u.is_admin = 1')
+    elif role is not None:
+        conditions.append('+u.role = ?')
+        params.append(role)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    
+    with get_db() as conn:
+        cursor = conn.execute(
+            f'''SELECT u.id, u.group_name, u.last_name, u.first_name, u.middle_name, u.role, u.is_admin,
+                       u.telegram_username, u.created_at, u.last_login_at, u.login_count,
+                       (SELECT COUNT(*) FROM sessions s WHERE s.user_id = u.id AND s.expires_at > ?) AS active_sessions
+                FROM users u {where}
+                ORDER BY u.group_name, u.last_name, u.first_name''',
+            params
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+
+# Статусы получателей рассылки
+RECIPIENT_PENDING = 0
+RECIPIENT_SENT = 1
+RECIPIENT_FAILED = 2
+
+@unit_of_work
+def create_broadcast(sender_telegram_id, group_name, text):
+    """Создаёт рассылку и сразу фиксирует список получателей - всех пользователей группы"""
+    with get_db() as conn:
+        broadcast_id = conn.execute(
+            'INSERT INTO broadcasts (sender_telegram_id, group_name, text) VALUES (?, ?, ?)',
+            (sender_telegram_id, group_name, text)
+        ).lastrowid
+        total = conn.execute(
+            '''INSERT INTO broadcast_recipients (broadcast_id, telegram_id)
+               SELECT ?, telegram_id FROM users WHERE group_name = ?''',
+            (broadcast_id, group_name)
+        ).rowcount
+        conn.execute('UPDATE broadcasts SET total = ? WHERE id = ?', (total, broadcast_id))
+        conn.commit()
+        return broadcast_id
+
+def get_broadcast(broadcast_id):
+    with get_db() as conn:
+        broadcast = conn.execute('SELECT * FROM broadcasts WHERE id = ?', (broadcast_id,)).fetchone()
+        return dict(broadcast) if broadcast else None
+
+def get_running_broadcasts():
+    """Незавершённые рассылки - их нужно продолжить после перезапуска"""
+    with get_db() as conn:
+        rows = conn.execute("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id").fetchall()
+        return [row['id'] for row in rows]
+
+def get_broadcast_batch(broadcast_id, limit):
+    """Следующая пачка получателей, которым сообщение ещё не отправлялось"""
+    with get_db() as conn:
+        rows = conn.execute(
+            '''SELECT telegram_id FROM broadcast_recipients
+               WHERE broadcast_id = ? AND status = 0 ORDER BY telegram_id LIMIT ?''',
+            (broadcast_id, limit)
+        ).fetchall()
+        return [row['telegram_id'] for row in rows]
+
+@unit_of_work
+def save_broadcast_results(broadcast_id, sent_ids, failed_ids):
+    """Отмечает результаты пачки и обновляет счётчики рассылки одной транзакцией"""
+    with get_db() as conn:
+        conn.executemany(
+            'UPDATE broadcast_recipients SET status = ? WHERE broadcast_id = ? AND telegram_id = ?',
+            [(RECIPIENT_SENT, broadcast_id, telegram_id) for telegram_id in sent_ids] +
+            [(RECIPIENT_FAILED, broadcast_id, telegram_id) for telegram_id in failed_ids]
+        )
+        conn.execute(
+            'UPDATE broadcasts SET sent = sent + ?, failed = failed + ? WHERE id = ?',
+            (len(sent_ids), len(failed_ids), broadcast_id)
+        )
+        conn.commit()
+
+@unit_of_work
+def finish_broadcast(broadcast_id):
+    with get_db() as conn:
+        conn.execute(
+            "UPDATE broadcasts SET status = 'done', finished_at = ? WHERE id = ?",
+            (datetime.now(), broadcast_id)
+        )
+        conn.commit()
+
+def get_fsm_record(key, not_older_than):
+    """Получает состояние FSM, его данные и время изменения, если оно было не раньше not_older_than"""
+    with get_db() as conn:
+        record = conn.execute(
+            'SELECT state, data, updated_at FROM fsm_states WHERE key = ? AND updated_at > ?',
+            (key, not_older_than)
+        ).fetchone()
+        if not record:
+            return None
+        return {'state': record['state'], 'data': json.loads(record['data']),
+                'updated_at': datetime.fromisoformat(record['updated_at'])}
+
+@unit_of_work
+def save_fsm_records(records):
+    """Сохраняет пачку состояний FSM одной транзакцией.
+    records - {key: {'state', 'data'} или None для удаления}"""
+    now = datetime.now()
+    upserts = [
+        (key, record['state'], json.dumps(record['data'], ensure_ascii=False), now)
+        for key, record in records.items() if record is not None
+    ]
+    deletes = [(key,) for key, record in records.items() if record is None]
+    
+    with get_db() as conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)',
+            upserts
+        )
+        conn.executemany('DELETE FROM fsm_states WHERE key = ?', deletes)
+        conn.commit()
+
+def get_delivery_status(delivery_id, not_older_than):
+    """Статус доставки сообщения, если он обновлялся не раньше not_older_than"""
+    with get_db() as conn:
+        record = conn.execute(
+            'SELECT status FROM delivery_statuses WHERE delivery_id = ? AND updated_at > ?',
+            (delivery_id, not_older_than)
+        ).fetchone()
+        return record['status'] if record else None
+
+def save_delivery_status(delivery_id, status):
+    """Сохраняет статус доставки. Цикл бота не ждёт записи: вызывается через submit_write"""
+    with get_db() as conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO delivery_statuses (delivery_id, status, updated_at) VALUES (?, ?, ?)',
+            (delivery_id, status, datetime.now())
+        )
+        conn.commit()
+
+def get_session(sid, known_version=None):
+    """Получает действующую сессию сайта. Если версия равна known_version,
+    данные не читаются и не разбираются повторно - data будет None"""
+    with get_db() as conn:
+        record = conn.execute(
+            '''SELECT version, expires_at, CASE WHEN version = ? THEN NULL ELSE data END AS data
+               FROM sessions WHERE sid = ? AND expires_at > ?''',
+            (known_version, sid, datetime.now())
+        ).fetchone()
+        if not record:
+            return None
+        return {
+            'version': record['version'],
+            'expires_at': datetime.fromisoformat(record['expires_at']),
+            'data': json.loads(record['data']) if record['data'] is not None else None
+        }
+
+@unit_of_work
+def save_session(sid, user_id, data, expires_at):
+    """Создаёт или перезаписывает сессию, возвращает её новую версию"""
+    with get_db() as conn:
+        version = conn.execute(
+            '''INSERT INTO sessions (sid, user_id, data, expires_at) VALUES (?, ?, ?, ?)
+               ON CONFLICT (sid) DO UPDATE SET user_id = excluded.user_id, data = excluded.data,
+                   expires_at = excluded.expires_at, version = version + 1
+               RETURNING version''',
+            (sid, user_id, json.dumps(data, ensure_ascii=False, separators=(',', ':')), expires_at)
+        ).fetchone()[0]
+        conn.commit()
+        return version
+
+@unit_of_work
+def replace_session(old_sid, sid, user_id, data, expires_at):
+    """Заменяет сессию новой под другим идентификатором (вход, выход) одной транзакцией"""
+    delete_session(old_sid)
+    return save_session(sid, user_id, data, expires_at)
+
+@unit_of_work
+def touch_session(sid, expires_at):
+    """Продлевает срок жизни сессии, не меняя её данные и версию"""
+    with get_db() as conn:
+        conn.execute('UPDATE sessions SET expires_at = ? WHERE sid = ?', (expires_at, sid))
+        conn.commit()
+
+@unit_of_work
+def delete_session(sid):
+    with get_db() as conn:
+        conn.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+        conn.commit()
+
+@unit_of_work
+def delete_user_sessions(user_id):
+    """Завершает все сессии пользователя на всех устройствах, возвращает их количество"""
+    with get_db() as conn:
+        cursor = conn.execute('DELETE FROM sessions WHERE user_id = ?', (user_id,))
+        conn.commit()
+        return cursor.rowcount
+
+def purge_expired_rows(table, column, cutoff, batch_size=500):
+    """Удаляет строки, у которых column <= cutoff, пачками по batch_size.
+    Каждая пачка - отдельная короткая транзакция, чтобы не держать блокировку записи"""
+    deleted = 0
+    while True:
+        count = _purge_batch(table, column, cutoff, batch_size)
+        deleted += count
+        if count < batch_size:
+            return deleted
+        time.sleep(0.01)  # Даём другим писателям захватить блокировку
+
+@unit_of_work
+def _purge_batch(table, column, cutoff, batch_size):
+    with get_db() as conn:
+        return conn.execute(
+            f'''DELETE FROM {table} WHERE rowid IN (
+                   SELECT rowid FROM {table} WHERE {column} <= ? LIMIT ?
+               )''',
+            (cutoff, batch_size)
+        ).rowcount
+
+def enable_incremental_vacuum():
+    """Переводит базу в режим auto_vacuum = INCREMENTAL (однократный VACUUM)"""
+    with get_db() as conn:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            return False
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        return True
+
+def incremental_vacuum(pages=1000):
+    """Возвращает в файловую систему до pages свободных страниц, возвращает их число"""
+    with get_db() as conn:
+        freed = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+        return min(freed, pages)
+
+def optimize():
+    """Обновляет статистику планировщика там, где она устарела (PRAGMA optimize),
+    не пересчитывая все таблицы, как ANALYZE"""
+    with get_db() as conn:
+        conn.execute('PRAGMA optimize')
+        conn.commit()
+
+def _stress_test(writers=200, writes_per_writer=50):
+    """Сравнение под нагрузкой: каждый поток пишет и делает commit сам против общего писателя"""
+    import tempfile
+    global DATABASE
+    DATABASE = os.path.join(tempfile.mkdtemp(), 'stress.db')
+    init_db()
+    
+    def direct_write(user_id):
+        with get_db() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO blocked_cookies (cookie_id, blocked_until) VALUES (?, ?)',
+                (f'stress:{user_id}', datetime.now() + timedelta(minutes=10))
+            )
+            conn.commit()
+    
+    def run(label, write):
+        errors = []
+        barrier = threading.Barrier(writers + 1)
+        
+        def worker(n):
+            barrier.wait()
+            for i in range(writes_per_writer):
+                try:
+                    write(n * writes_per_writer + i)
+                except sqlite3.OperationalError as e:
+                    errors.append(e)
+        
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(writers)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        
+        total = writers * writes_per_writer
+        print(f"{label}: {total} записей за {elapsed:.2f} с ({total / elapsed:.0f} в секунду), "
+              f"ошибок 'database is locked': {sum('locked' in str(e) for e in errors)}, всего ошибок: {len(errors)}")
+    
+    print(f"🔥 {writers} потоков по {writes_per_writer} записей")
+    run("Каждый поток сам", direct_write)
+    run("Через писателя", lambda user_id: block_cookie(f'stress:{user_id}'))
+    stats = write_stats()
+    print(f"   транзакций писателя: {stats['commits']}, в среднем {stats['jobs'] / stats['commits']:.1f} "
+          f"операций на транзакцию, максимум {stats['max_batch']}, "
+          f"среднее время транзакции {stats['commit_seconds'] / stats['commits'] * 1000:.2f} мс")
+    stop_writer()
+
+def _unit_of_work_benchmark(registrations=2000):
+    """Подтверждение регистраций: создание пользователя и удаление заявки
+    отдельными транзакциями против одной единицы работы"""
+    import tempfile
+    global DATABASE
+    DATABASE = os.path.join(tempfile.mkdtemp(), 'uow.db')
+    init_db()
+    
+    def add_pending(first_id):
+        telegram_ids = range(first_id, first_id + registrations)
+        with get_db() as conn:
+            conn.executemany(
+                '''INSERT INTO pending_registrations (telegram_id, last_name, first_name, role, is_admin,
+                                                     group_name, confirmation_code)
+                   VALUES (?, ?, 'Имя', 'student', 1, 'ЭМ25', '123456')''',
+                [(telegram_id, f'Фамилия{telegram_id}') for telegram_id in telegram_ids]
+            )
+            conn.commit()
+        return telegram_ids
+    
+    def separately(telegram_id):
+        pending = get_pending_registration(telegram_id)
+        create_user(telegram_id, pending['group_name'], pending['last_name'], pending['first_name'],
+                    role=pending['role'], is_admin=pending['is_admin'])
+        delete_pending_registration(telegram_id)
+    
+    def run(label, confirm, telegram_ids):
+        commits = write_stats()['commits']
+        started = time.perf_counter()
+        for telegram_id in telegram_ids:
+            confirm(telegram_id)
+        elapsed = time.perf_counter() - started
+        commits = write_stats()['commits'] - commits
+        print(f"{label}: {registrations} регистраций за {elapsed:.2f} с ({registrations / elapsed:.0f} в секунду), "
+              f"транзакций {commits}")
+    
+    print(f"🔥 Подтверждение {registrations} регистраций")
+    run("Отдельными транзакциями", separately, add_pending(1000000))
+    run("Одной единицей работы", lambda telegram_id: confirm_pending_registration(telegram_id, '123456'),
+        add_pending(2000000))
+    stop_writer()
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'uow':
+        _unit_of_work_benchmark()
+    else:
+        _stress_test()
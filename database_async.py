@@ -0,0 +1,154 @@
+import asyncio
+import functools
+import inspect
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import database
+
+# Отдельный пул потоков для запросов бота: цикл событий не ждёт SQLite,
+# а число потоков не превышает размер пула соединений
+EXECUTOR_WORKERS = int(os.environ.get('DB_ASYNC_WORKERS', min(4, database.POOL_SIZE)))
+
+_executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix='db')
+
+def _run_in_executor(func):
+    """Превращает синхронную функцию database.py в корутину"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+    return wrapper
+
+def _run_in_writer(func):
+    """Изменение через очередь писателя database.py: корутина ждёт Future, не занимая поток пула"""
+    raw = inspect.unwrap(func)  # Без обёртки, которая ждёт результат в потоке
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.wrap_future(database.submit_write(raw, *args, **kwargs))
+    return wrapper
+
+init_db = _run_in_executor(database.init_db)
+
+create_user = _run_in_writer(database.create_user)
+update_user_profile = _run_in_writer(database.update_user_profile)
+update_user_photo = _run_in_writer(database.update_user_photo)
+get_user_by_telegram = _run_in_executor(database.get_user_by_telegram)
+get_user_by_id = _run_in_executor(database.get_user_by_id)
+get_users_by_group = _run_in_executor(database.get_users_by_group)
+
+create_pending_registration = _run_in_writer(database.create_pending_registration)
+get_pending_registration = _run_in_executor(database.get_pending_registration)
+confirm_pending_registration = _run_in_writer(database.confirm_pending_registration)
+delete_pending_registration = _run_in_writer(database.delete_pending_registration)
+
+register_student = _run_in_writer(database.register_student)
+count_roster_students = _run_in_executor(database.count_roster_students)
+
+get_teachers_and_admins = _run_in_executor(database.get_teachers_and_admins)
+get_teachers = _run_in_executor(database.get_teachers)
+
+create_broadcast = _run_in_writer(database.create_broadcast)
+get_broadcast = _run_in_executor(database.get_broadcast)
+get_running_broadcasts = _run_in_executor(database.get_running_broadcasts)
+get_broadcast_batch = _run_in_executor(database.get_broadcast_batch)
+save_broadcast_results = _run_in_writer(database.save_broadcast_results)
+finish_broadcast = _run_in_writer(database.finish_broadcast)
+
+get_fsm_record = _run_in_executor(database.get_fsm_record)
+save_fsm_records = _run_in_writer(database.save_fsm_records)
+
+def shutdown():
+    _executor.shutdown(wait=True)
+
+async def _benchmark(updates=5000, users=3000, rate=1000):
+    """Поток обновлений от тысяч пользователей через Dispatcher: обработчики вызывают
+    database.py прямо в цикле событий против этих обёрток. Параллельно другой процесс
+    (сайт, обслуживание) периодически держит блокировку записи"""
+    import tempfile
+    import threading
+    from aiogram import Bot, Dispatcher
+    from aiogram.types import Update
+    
+    database.DATABASE = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    database.init_db()
+    with database.get_db() as conn:
+        conn.executemany(
+            "INSERT INTO users (telegram_id, group_name, last_name, first_name) VALUES (?, 'ЭМ25', ?, 'Имя')",
+            [(1000 + i, f'Фамилия{i}') for i in range(users)]
+        )
+        conn.commit()
+    
+    stop = threading.Event()
+    
+    def other_writer():
+        # Каждые 0.5 с чужая транзакция держит блокировку записи 0.1 с
+        conn = database._connect()
+        while not stop.wait(0.4):
+            conn.execute('BEGIN IMMEDIATE')
+            time.sleep(0.1)
+            conn.rollback()
+        conn.close()
+    
+    def make_update(n):
+        user = {'id': 1000 + n * 7919 % users, 'is_bot': False, 'first_name': 'Тест', 'username': f'user{n}'}
+        # Каждое десятое обновление - /start с записью профиля, остальные - только чтение
+        return {'update_id': n, 'message': {
+            'message_id': n, 'date': int(time.time()), 'text': '/start' if n % 10 == 0 else '/profile',
+            'chat': {'id': user['id'], 'type': 'private'}, 'from': user}}
+    
+    async def run(label, read, write):
+        bot = Bot(token='123456:ABCDEFabcdef')
+        dp = Dispatcher()
+        
+        @dp.message()
+        async def handler(message):
+            user = message.from_user
+            await read(user.id)
+            if message.text == '/start':
+                await write(user.id, user.username, user.first_name)
+        
+        latencies = []
+        
+        async def deliver(n, due):
+            update = Update.model_validate(make_update(n), context={'bot': bot})
+            await dp.feed_update(bot, update)
+            latencies.append(time.perf_counter() - due)
+        
+        tasks = []
+        started = time.perf_counter()
+        for n in range(updates):
+            due = started + n / rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(deliver(n, due)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        await bot.session.close()
+        
+        latencies.sort()
+        p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+        print(f"{label}: {updates} обновлений за {elapsed:.2f} с, задержка p50 {p(0.5):.1f} мс, "
+              f"p95 {p(0.95):.1f} мс, p99 {p(0.99):.1f} мс, максимум {latencies[-1] * 1000:.0f} мс")
+    
+    async def sync_read(telegram_id):
+        return database.get_user_by_telegram(telegram_id)
+    
+    async def sync_write(*args):
+        return database.update_user_profile(*args)
+    
+    locker = threading.Thread(target=other_writer, daemon=True)
+    locker.start()
+    print(f"🔥 {updates} обновлений от {users} пользователей, {rate} в секунду, 10% с записью")
+    await run("database.py в цикле событий", sync_read, sync_write)
+    await run("database_async", get_user_by_telegram, update_user_profile)
+    stop.set()
+    locker.join()
+    shutdown()
+    database.close_pool()
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'bench':
+        asyncio.run(_benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 5000))
@@ -0,0 +1,213 @@
+import asyncio
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError, RestartingTelegram
+import database
+
+QUEUE_SIZE = 1000       # Максимум сообщений в очереди
+WORKERS = 4             # Параллельных отправителей в цикле бота
+MAX_RETRIES = 4         # Повторов при сетевых ошибках
+BACKOFF_BASE = 1        # Задержка перед повтором: 1, 2, 4, 8 секунд
+STATUS_TTL = 10 * 60    # Сколько хранить статус доставки, секунд
+
+# memory - статус виден только процессу, который отправляет код;
+# sqlite - статус пишется и в delivery_statuses, его видят все воркеры gunicorn
+DELIVERY_STATUS_BACKEND = os.environ.get('DELIVERY_STATUS_BACKEND', 'memory')
+
+QUEUED = 'queued'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+_lock = threading.Lock()
+_jobs = deque()
+_statuses = {}  # delivery_id -> (статус, время обновления)
+
+_bot = None
+_loop = None
+_wakeup = None
+
+def _set_status(delivery_id, status):
+    with _lock:
+        _store_status(delivery_id, status)
+
+def _store_status(delivery_id, status):
+    # Вызывается под _lock: записи в базу встают в очередь писателя в том же порядке, что и в памяти
+    _statuses[delivery_id] = (status, time.monotonic())
+    if DELIVERY_STATUS_BACKEND == 'sqlite':
+        database.submit_write(database.save_delivery_status, delivery_id, status).add_done_callback(_log_write_error)
+
+def _log_write_error(future):
+    if future.exception() is not None:
+        print(f"❌ Ошибка сохранения статуса доставки: {future.exception()}")
+
+def _prune_statuses():
+    deadline = time.monotonic() - STATUS_TTL
+    for delivery_id, (_, updated_at) in list(_statuses.items()):
+        if updated_at < deadline:
+            del _statuses[delivery_id]
+
+def get_status(delivery_id):
+    """Статус доставки: queued, sending, sent, failed или None, если неизвестен"""
+    with _lock:
+        entry = _statuses.get(delivery_id)
+    if entry is not None:
+        return entry[0]
+    if DELIVERY_STATUS_BACKEND == 'sqlite' and delivery_id:
+        # Код отправлял другой воркер
+        return database.get_delivery_status(delivery_id, datetime.now() - timedelta(seconds=STATUS_TTL))
+    return None
+
+def enqueue(chat_id, text, parse_mode=None):
+    """Ставит сообщение в очередь отправки, не дожидаясь Telegram.
+    Возвращает delivery_id или None, если очередь переполнена"""
+    delivery_id = secrets.token_urlsafe(12)
+    with _lock:
+        if len(_jobs) >= QUEUE_SIZE:
+            return None
+        if len(_statuses) > QUEUE_SIZE:
+            _prune_statuses()
+        _jobs.append((delivery_id, chat_id, text, parse_mode))
+        _store_status(delivery_id, QUEUED)
+    
+    loop, wakeup = _loop, _wakeup
+    if loop is not None and wakeup is not None:
+        loop.call_soon_threadsafe(wakeup.set)
+    return delivery_id
+
+def send_login_code(telegram_id, code):
+    return enqueue(
+        telegram_id,
+        f"🔐 Код для входа на сайт:\n\n*{code}*\n\nКод действителен 5 минут.\nУ тебя есть 3 попытки ввода.",
+        parse_mode="Markdown"
+    )
+
+async def _send(chat_id, text, parse_mode):
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            await _bot.send_message(chat_id, text, parse_mode=parse_mode)
+            return True
+        except TelegramRetryAfter as e:
+            delay = e.retry_after
+        except (TelegramNetworkError, TelegramServerError, RestartingTelegram) as e:
+            print(f"⚠️ Ошибка отправки сообщения (попытка {attempt + 1}): {e}")
+            delay = BACKOFF_BASE * 2 ** attempt
+        except Exception as e:
+            print(f"❌ Ошибка отправки сообщения: {e}")
+            return False
+        
+        if attempt < MAX_RETRIES:
+            await asyncio.sleep(delay)
+    
+    print(f"❌ Сообщение для {chat_id} не доставлено после {MAX_RETRIES + 1} попыток")
+    return False
+
+async def _worker():
+    while True:
+        with _lock:
+            job = _jobs.popleft() if _jobs else None
+        
+        if job is None:
+            _wakeup.clear()
+            await _wakeup.wait()
+            continue
+        
+        delivery_id, chat_id, text, parse_mode = job
+        _set_status(delivery_id, SENDING)
+        sent = await _send(chat_id, text, parse_mode)
+        _set_status(delivery_id, SENT if sent else FAILED)
+
+def start(bot):
+    """Запускает отправителей в текущем цикле событий (цикл бота), переиспользуя сессию bot"""
+    global _bot, _loop, _wakeup
+    _bot = bot
+    wakeup = asyncio.Event()
+    wakeup.set()  # Разбираем то, что накопилось до запуска
+    # Событие создаётся раньше, чем публикуется цикл: enqueue() из потока Flask
+    # проверяет _loop и сразу обращается к _wakeup
+    _wakeup = wakeup
+    _loop = asyncio.get_running_loop()
+    return [asyncio.create_task(_worker()) for _ in range(WORKERS)]
+
+def start_in_thread(bot):
+    """Для запуска сайта без бота: отдельный поток со своим циклом событий"""
+    async def run():
+        await asyncio.gather(*start(bot))
+    
+    threading.Thread(target=asyncio.run, args=(run(),), daemon=True).start()
+
+async def _fake_telegram_check(chats=50, latency=0.5):
+    """Отправка через настоящий Bot против локального поддельного Bot API:
+    медленные ответы, 429 с retry_after, 502 и 400"""
+    import sys
+    from aiohttp import web
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    
+    calls = {}
+    
+    async def send_message(request):
+        form = await request.post()
+        chat_id = int(form['chat_id'])
+        calls[chat_id] = calls.get(chat_id, 0) + 1
+        await asyncio.sleep(latency)
+        if chat_id == 1 and calls[chat_id] == 1:
+            return web.json_response({'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                                      'parameters': {'retry_after': 1}}, status=429)
+        if chat_id == 2 and calls[chat_id] == 1:
+            return web.json_response({'ok': False, 'error_code': 502, 'description': 'Bad Gateway'}, status=502)
+        if chat_id == 3:
+            return web.json_response({'ok': False, 'error_code': 400, 'description': 'Bad Request: chat not found'},
+                                     status=400)
+        return web.json_response({'ok': True, 'result': {
+            'message_id': calls[chat_id], 'date': int(time.time()), 'text': form['text'],
+            'chat': {'id': chat_id, 'type': 'private'}}})
+    
+    app = web.Application()
+    app.router.add_post('/bot{token}/sendMessage', send_message)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 18082).start()
+    
+    session = AiohttpSession(api=TelegramAPIServer.from_base('http://127.0.0.1:18082'))
+    start_in_thread(Bot(token='123456:ABCDEFabcdef', session=session))
+    
+    # Сайт ставит коды в очередь из своих потоков и не ждёт Telegram
+    chat_ids = [1, 2, 3] + list(range(10, 10 + chats))
+    started = time.perf_counter()
+    slowest = 0.0
+    deliveries = {}
+    for chat_id in chat_ids:
+        call_started = time.perf_counter()
+        deliveries[chat_id] = send_login_code(chat_id, '1234')
+        slowest = max(slowest, time.perf_counter() - call_started)
+    
+    final = (SENT, FAILED)
+    while any(get_status(delivery_id) not in final for delivery_id in deliveries.values()):
+        if time.perf_counter() - started > 30:
+            break
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    await runner.cleanup()
+    
+    statuses = {chat_id: get_status(delivery_id) for chat_id, delivery_id in deliveries.items()}
+    checks = [
+        (f"постановка в очередь не ждёт Telegram (самая долгая {slowest * 1000:.2f} мс)", slowest < 0.05),
+        (f"429: повтор после retry_after ({calls.get(1)} запроса)", statuses[1] == SENT and calls.get(1) == 2),
+        (f"502: повтор с задержкой ({calls.get(2)} запроса)", statuses[2] == SENT and calls.get(2) == 2),
+        (f"400: без повторов, статус {statuses[3]}", statuses[3] == FAILED and calls.get(3) == 1),
+        (f"{chats} обычных сообщений доставлены за {elapsed:.1f} с при ответе Telegram {latency} с",
+         all(statuses[chat_id] == SENT for chat_id in chat_ids[3:])),
+    ]
+    for label, ok in checks:
+        print(f"{'✅' if ok else '❌'} {label}")
+    if not all(ok for _, ok in checks):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    asyncio.run(_fake_telegram_check())
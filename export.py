@@ -0,0 +1,242 @@
+"""Выгрузка пользователей с активностью входа в CSV или XLSX.
+
+Строки читаются из базы пачками и сразу отдаются клиенту (Transfer-Encoding: chunked),
+поэтому память не зависит от числа пользователей. Сайт: /export (учителя и админы).
+
+python export.py файл.csv|файл.xlsx [--group ЭМ25] [--role student|teacher|admin]
+python export.py bench [строк]   - время до первого байта и пик памяти на синтетической базе
+"""
+import csv
+import io
+import os
+import sys
+import time
+import zipfile
+from datetime import datetime
+from urllib.parse import quote
+from flask import Response
+import database
+
+FORMATS = ('csv', 'xlsx')
+ROLES = ('student', 'teacher', 'admin')
+BATCH_SIZE = 1000  # Строк из базы за раз и в одном куске ответа
+
+COLUMNS = ('ID', 'Группа', 'Фамилия', 'Имя', 'Отчество', 'Роль', 'Telegram',
+           'Зарегистрирован', 'Последний вход', 'Входов', 'Активных сессий')
+
+MIMETYPES = {
+    'csv': 'text/csv',  # charset=utf-8 Flask добавляет сам
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# Начало ячейки CSV, с которого Excel и LibreOffice читают формулу (CSV/formula injection)
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def _safe_cell(value):
+    """Текст, похожий на формулу, экранируется апострофом и показывается как есть"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def _role_title(role, is_admin):
+    if is_admin:
+        return 'Администратор'
+    return 'Учитель' if role == 'teacher' else 'Студент'
+
+def _timestamp(value):
+    return str(value)[:19] if value else ''  # Без долей секунды
+
+def _batches(group_name=None, role=None):
+    """Пачки строк выгрузки в порядке COLUMNS"""
+    for rows in database.iter_users_export(group_name, role, BATCH_SIZE):
+        yield [
+            (row['id'], row['group_name'] or '', row['last_name'], row['first_name'], row['middle_name'] or '',
+             _role_title(row['role'], row['is_admin']),
+             row['telegram_username'] or '',
+             _timestamp(row['created_at']), _timestamp(row['last_login_at']), row['login_count'], row['active_sessions'])
+            for row in rows
+        ]
+
+def csv_chunks(batches, header=COLUMNS):
+    # BOM и точка с запятой - чтобы Excel сразу открыл файл с кириллицей по столбцам
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+    buffer.write('\ufeff')
+    writer.writerow(map(_safe_cell, header))
+    for batch in batches:
+        writer.writerows(map(_safe_cell, row) for row in batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+class _Pipe:
+    """Файл только для записи: zipfile пишет в него, генератор забирает накопленное"""
+    
+    def __init__(self):
+        self._chunks = []
+    
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Пользователи" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'
+    ),
+}
+
+# \r ссылкой на символ: голый \r парсер XML превращает в \n
+_XML_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', '\r': '&#13;',
+                              **{code: None for code in range(32) if code not in (9, 10, 13)}})
+
+def _xlsx_cell(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    # Текст inlineStr Excel не вычисляет как формулу, апостроф здесь был бы виден в ячейке
+    text = str(value).translate(_XML_ESCAPES)
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+def _xlsx_row(values):
+    return '<row>' + ''.join(_xlsx_cell(value) for value in values) + '</row>'
+
+def xlsx_chunks(batches, header=COLUMNS):
+    """XLSX с одним листом, который пишется в zip по мере чтения строк"""
+    pipe = _Pipe()
+    with zipfile.ZipFile(pipe, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_PARTS.items():
+            archive.writestr(name, content)
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            sheet.write(_xlsx_row(header).encode('utf-8'))
+            yield pipe.drain()
+            for batch in batches:
+                sheet.write(''.join(_xlsx_row(row) for row in batch).encode('utf-8'))
+                data = pipe.drain()
+                if data:
+                    yield data
+            sheet.write(b'</sheetData></worksheet>')
+    yield pipe.drain()
+
+def write_xlsx(path, rows):
+    """Записывает строки (первая - заголовок) в XLSX-файл потоком"""
+    rows = iter(rows)
+    header = next(rows)
+    with open(path, 'wb') as f:
+        for chunk in xlsx_chunks(([row] for row in rows), header):
+            f.write(chunk)
+
+def export_chunks(fmt, group_name=None, role=None):
+    batches = _batches(group_name, role)
+    return csv_chunks(batches) if fmt == 'csv' else xlsx_chunks(batches)
+
+def users_response(fmt, group_name=None, role=None):
+    """Ответ Flask, который отдаёт выгрузку по мере чтения из базы"""
+    parts = ['users', group_name, role, datetime.now().strftime('%Y-%m-%d')]
+    filename = '_'.join(part for part in parts if part) + f'.{fmt}'
+    response = Response(export_chunks(fmt, group_name, role), mimetype=MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def _benchmark(count=1000000):
+    import resource
+    import tempfile
+    from flask import Flask
+    from config import GROUPS
+    
+    database.DATABASE = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    database.init_db()
+    started = time.perf_counter()
+    with database.get_db() as conn:
+        for first in range(0, count, 10000):
+            conn.executemany(
+                '''INSERT INTO users (telegram_id, group_name, last_name, first_name, middle_name,
+                                      role, login_count, last_login_at)
+                   VALUES (?, ?, ?, ?, 'Отчество', ?, ?, CURRENT_TIMESTAMP)''',
+                [(i, GROUPS[i % len(GROUPS)], f'Фамилия{i}', f'Имя{i}',
+                  'teacher' if i % 100 == 0 else 'student', i % 7)
+                 for i in range(first, min(first + 10000, count))]
+            )
+        conn.commit()
+    print(f"🔧 База на {count} пользователей создана за {time.perf_counter() - started:.1f} с, "
+          f"пик памяти {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} МБ")
+    
+    app = Flask(__name__)
+    
+    @app.route('/export')
+    def export_users():
+        from flask import request
+        return users_response(request.args['format'], request.args.get('group'), request.args.get('role'))
+    
+    client = app.test_client()
+    for query in ('format=csv', 'format=xlsx', 'format=csv&role=teacher', 'format=xlsx&group=ЭМ25'):
+        started = time.perf_counter()
+        response = client.get(f'/export?{query}', buffered=False)
+        first_byte = None
+        size = 0
+        for chunk in response.response:
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            size += len(chunk)
+        response.close()
+        elapsed = time.perf_counter() - started
+        print(f"{query}: первый байт через {first_byte * 1000:.1f} мс, {size / 2 ** 20:.1f} МБ за {elapsed:.1f} с, "
+              f"пик памяти процесса {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} МБ")
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'bench':
+        _benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    elif len(sys.argv) >= 2 and sys.argv[1].endswith(FORMATS):
+        import argparse
+        parser = argparse.ArgumentParser(description='Выгрузка пользователей в CSV или XLSX')
+        parser.add_argument('path')
+        parser.add_argument('--group')
+        parser.add_argument('--role', choices=ROLES)
+        args = parser.parse_args()
+        database.init_db()
+        with open(args.path, 'wb') as f:
+            for chunk in export_chunks(args.path.rsplit('.', 1)[1], args.group, args.role):
+                f.write(chunk)
+        print(f"✅ Выгрузка сохранена: {args.path}")
+        database.stop_writer()
+    else:
+        print(__doc__)
@@ -0,0 +1,143 @@
+"""Сборка шрифта Inter для самостоятельной раздачи: только латиница и кириллица,
+только начертания, которые используются в style.css, формат WOFF2.
+
+Исходники (скачать с https://github.com/rsms/inter/releases) положить в static/fonts/src:
+вариативный InterVariable.ttf или статические Inter-Regular.ttf, Inter-SemiBold.ttf и т.д.
+Сборка: python fonts.py (fonttools и brotli - в requirements.txt)
+Готовые static/fonts/inter-<вес>.woff2 коммитятся, дальше их подхватывает assets.py.
+"""
+import os
+import re
+from flask import url_for
+from markupsafe import Markup
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+FONT_DIR = os.path.join(STATIC_DIR, 'fonts')
+FONT_SRC_DIR = os.path.join(FONT_DIR, 'src')
+STYLE_PATH = os.path.join(STATIC_DIR, 'css', 'style.css')
+
+FONT_FAMILY = 'Inter'
+WEIGHT_NAMES = {
+    100: 'Thin', 200: 'ExtraLight', 300: 'Light', 400: 'Regular', 500: 'Medium',
+    600: 'SemiBold', 700: 'Bold', 800: 'ExtraBold', 900: 'Black',
+}
+
+# Начертания, нужные для первой отрисовки: обычный текст и заголовки
+PRELOAD_WEIGHTS = (400, 600)
+
+GOOGLE_FONTS_FALLBACK = (
+    '<link rel="preconnect" href="https://fonts.googleapis.com">\n'
+    '<link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>\n'
+    '<link href="https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800;900'
+    '&display=swap" rel="stylesheet">'
+)
+
+# Латиница и кириллица (те же диапазоны, что у Google Fonts)
+UNICODE_RANGE = (
+    'U+0000-00FF, U+0131, U+0152-0153, U+02BB-02BC, U+02C6, U+02DA, U+02DC, '
+    'U+0304, U+0308, U+0329, U+2000-206F, U+2074, U+20AC, U+2122, U+2191, U+2193, '
+    'U+2212, U+2215, U+FEFF, U+FFFD, U+0400-045F, U+0490-0491, U+04B0-04B1, U+2116'
+)
+
+def used_weights():
+    """Веса шрифта, которые встречаются в style.css (400 - всегда, это вес по умолчанию)"""
+    with open(STYLE_PATH, encoding='utf-8') as f:
+        css = f.read()
+    
+    keywords = {'normal': 400, 'bold': 700}
+    weights = {400}
+    for value in re.findall(r'font-weight\s*:\s*([a-z0-9]+)', css):
+        weight = keywords.get(value) or (int(value) if value.isdigit() else None)
+        if weight in WEIGHT_NAMES:
+            weights.add(weight)
+    return sorted(weights)
+
+def _unicodes():
+    unicodes = []
+    for part in UNICODE_RANGE.split(','):
+        bounds = part.strip()[2:].split('-')
+        start = int(bounds[0], 16)
+        end = int(bounds[-1], 16)
+        unicodes.extend(range(start, end + 1))
+    return unicodes
+
+def _load_source(weight):
+    from fontTools.ttLib import TTFont
+    from fontTools.varLib import instancer
+    
+    static_path = os.path.join(FONT_SRC_DIR, f'{FONT_FAMILY}-{WEIGHT_NAMES[weight]}.ttf')
+    if os.path.exists(static_path):
+        return TTFont(static_path)
+    
+    variable_path = os.path.join(FONT_SRC_DIR, f'{FONT_FAMILY}Variable.ttf')
+    if os.path.exists(variable_path):
+        return instancer.instantiateVariableFont(TTFont(variable_path), {'wght': weight})
+    
+    raise FileNotFoundError(f'Нет исходника для веса {weight} в {FONT_SRC_DIR}')
+
+def build():
+    """Собирает static/fonts/inter-<вес>.woff2, возвращает список собранных весов"""
+    from fontTools import subset
+    
+    options = subset.Options()
+    options.flavor = 'woff2'
+    options.layout_features = ['*']
+    options.name_IDs = ['*']
+    options.notdef_outline = True
+    
+    unicodes = _unicodes()
+    weights = used_weights()
+    os.makedirs(FONT_DIR, exist_ok=True)
+    
+    for weight in weights:
+        font = _load_source(weight)
+        subsetter = subset.Subsetter(options=options)
+        subsetter.populate(unicodes=unicodes)
+        subsetter.subset(font)
+        subset.save_font(font, os.path.join(FONT_DIR, f'inter-{weight}.woff2'), options)
+    
+    # Начертания, которые больше не используются, удаляем
+    for name in os.listdir(FONT_DIR):
+        match = re.fullmatch(r'inter-(\d+)\.woff2', name)
+        if match and int(match.group(1)) not in weights:
+            os.remove(os.path.join(FONT_DIR, name))
+    
+    return weights
+
+def available_weights():
+    if not os.path.isdir(FONT_DIR):
+        return []
+    weights = []
+    for name in os.listdir(FONT_DIR):
+        match = re.fullmatch(r'inter-(\d+)\.woff2', name)
+        if match:
+            weights.append(int(match.group(1)))
+    return sorted(weights)
+
+def init_app(app):
+    """Регистрирует в шаблонах font_faces(): @font-face и preload для собранных шрифтов"""
+    weights = available_weights()
+    
+    def font_faces():
+        if not weights:
+            # Шрифты ещё не собраны - берём Inter с Google Fonts, как раньше
+            return Markup(GOOGLE_FONTS_FALLBACK)
+        
+        links = Markup('').join(
+            Markup('<link rel="preload" href="{}" as="font" type="font/woff2" crossorigin>\n').format(
+                url_for('static', filename=f'fonts/inter-{weight}.woff2'))
+            for weight in PRELOAD_WEIGHTS if weight in weights
+        )
+        faces = ''.join(
+            f"@font-face{{font-family:'{FONT_FAMILY}';font-style:normal;font-weight:{weight};"
+            f"font-display:swap;src:url({url_for('static', filename=f'fonts/inter-{weight}.woff2')}) "
+            f"format('woff2');unicode-range:{UNICODE_RANGE}}}"
+            for weight in weights
+        )
+        return links + Markup('<style>') + Markup(faces) + Markup('</style>')
+    
+    app.add_template_global(font_faces)
+
+if __name__ == '__main__':
+    built = build()
+    print(f"✅ Собраны начертания {FONT_FAMILY}: {', '.join(map(str, built))}")
@@ -0,0 +1,158 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+import database_async
+
+FSM_STATE_TTL = timedelta(days=1)  # Незавершённые регистрации старше суток забываются
+CACHE_SIZE = 1024                  # Сколько ключей держать в LRU-кэше
+FLUSH_DELAY = 0.5                  # Задержка перед записью пачки изменений, секунд
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в SQLite: чтение через LRU-кэш, запись пачками в фоне.
+    Состояния переживают перезапуск бота. Кэш живёт в памяти процесса и не сверяется
+    с базой, поэтому с одной базой должен работать один процесс бота"""
+    
+    def __init__(self, cache_size=CACHE_SIZE, flush_delay=FLUSH_DELAY, ttl=FSM_STATE_TTL):
+        self._cache = OrderedDict()  # ключ -> ({'state', 'data'}, время последнего изменения)
+        self._dirty = {}             # ключ -> запись или None (удалить)
+        self._cache_size = cache_size
+        self._flush_delay = flush_delay
+        self._ttl = ttl
+        self._flush_task = None
+    
+    @staticmethod
+    def _key(key):
+        return (f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id}:"
+                f"{key.business_connection_id}:{key.destiny}")
+    
+    def _remember(self, key, record, updated_at):
+        self._cache[key] = (record, updated_at)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+    
+    async def _get_record(self, key):
+        now = datetime.now()
+        entry = self._cache.get(key)
+        # Срок жизни проверяется и у записей из кэша: иначе брошенная регистрация
+        # не забывается, пока работает процесс
+        if entry is not None and entry[1] > now - self._ttl:
+            self._cache.move_to_end(key)
+            return entry[0]
+        
+        if entry is not None:
+            record, updated_at = None, now
+        elif key in self._dirty:
+            record, updated_at = self._dirty[key], now
+        else:
+            record = await database_async.get_fsm_record(key, now - self._ttl)
+            updated_at = record.pop('updated_at') if record else now
+        
+        record = record or {'state': None, 'data': {}}
+        self._remember(key, record, updated_at)
+        return record
+    
+    def _put_record(self, key, record):
+        self._remember(key, record, datetime.now())
+        empty = record['state'] is None and not record['data']
+        self._dirty[key] = None if empty else record
+        
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+    
+    async def _flush_later(self):
+        await asyncio.sleep(self._flush_delay)
+        # Изменения, пришедшие, пока шла запись, уходят следующей пачкой этой же задачей
+        while self._dirty:
+            if not await self.flush():
+                await asyncio.sleep(self._flush_delay)
+    
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией, False - если не удалось"""
+        if not self._dirty:
+            return True
+        records, self._dirty = self._dirty, {}
+        try:
+            await database_async.save_fsm_records(records)
+        except BaseException as e:
+            # Не теряем изменения: вернём их, если новых по тем же ключам не было
+            for key, record in records.items():
+                self._dirty.setdefault(key, record)
+            if not isinstance(e, Exception):
+                raise  # Отмена задачи при остановке - изменения допишет close()
+            print(f"❌ Ошибка сохранения состояний FSM: {e}")
+            return False
+        return True
+    
+    async def set_state(self, key, state=None):
+        key = self._key(key)
+        record = await self._get_record(key)
+        state = state.state if isinstance(state, State) else state
+        self._put_record(key, {'state': state, 'data': record['data']})
+    
+    async def get_state(self, key):
+        record = await self._get_record(self._key(key))
+        return record['state']
+    
+    async def set_data(self, key, data):
+        key = self._key(key)
+        record = await self._get_record(key)
+        self._put_record(key, {'state': record['state'], 'data': data.copy()})
+    
+    async def get_data(self, key):
+        record = await self._get_record(self._key(key))
+        return record['data'].copy()
+    
+    async def close(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+def _storage_key(user_id):
+    from aiogram.fsm.storage.base import StorageKey
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+async def _benchmark(updates=20000, users=1000):
+    """Время на обновление (прочитать состояние и данные, записать их) против MemoryStorage"""
+    import database
+    from aiogram.fsm.storage.memory import MemoryStorage
+    
+    for label, storage in (('MemoryStorage', MemoryStorage()), ('SQLiteStorage', SQLiteStorage())):
+        commits = database.write_stats()['commits']
+        started = time.perf_counter()
+        for n in range(updates):
+            key = _storage_key(n * 7919 % users)
+            await storage.get_state(key)
+            data = await storage.get_data(key)
+            await storage.set_state(key, f'Registration:step{n % 3}')
+            await storage.set_data(key, {**data, 'step': n})
+            await asyncio.sleep(0)  # Другие обновления и фоновая запись пачек
+        elapsed = time.perf_counter() - started
+        await storage.close()
+        await asyncio.sleep(0.1)  # Счётчики писателя обновляются после ответа
+        print(f"{label}: {elapsed / updates * 1e6:.1f} мкс на обновление, "
+              f"транзакций записи {database.write_stats()['commits'] - commits}")
+    
+    # Первое обращение после перезапуска: каждое чтение идёт в базу
+    storage = SQLiteStorage()
+    started = time.perf_counter()
+    for user_id in range(users):
+        await storage.get_state(_storage_key(user_id))
+    print(f"SQLiteStorage без кэша: {(time.perf_counter() - started) / users * 1e6:.1f} мкс на чтение")
+
+if __name__ == '__main__':
+    import tempfile
+    import database
+    database.DATABASE = os.path.join(tempfile.mkdtemp(), 'fsm.db')
+    database.init_db()
+    asyncio.run(_benchmark())
+    database_async.shutdown()
+    database.close_pool()
@@ -0,0 +1,32 @@
+# Конфигурация gunicorn для продакшен-режима (WEB_SERVER=gunicorn в main.py)
+# Плавная перезагрузка без потери запросов: kill -HUP <pid мастера>
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 80)}"
+workers = int(os.environ.get('WEB_WORKERS', 4))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread'
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+# Код входа может проверить не тот воркер, что его выдал, а статус его доставки - опросить
+# не тот, что отправлял: храним и то и другое в базе
+if workers > 1:
+    os.environ.setdefault('CODE_STORE_BACKEND', 'sqlite')
+    os.environ.setdefault('DELIVERY_STATUS_BACKEND', 'sqlite')
+
+# Приложение импортируется в каждом воркере отдельно: соединения SQLite
+# нельзя переносить через fork, поэтому у каждого воркера свой пул
+preload_app = False
+
+def post_worker_init(worker):
+    # Бот работает отдельным процессом, а коды входа воркер отправляет сам
+    import bot
+    import delivery
+    delivery.start_in_thread(bot.bot)
+
+def worker_exit(server, worker):
+    # Коды, выданные этим воркером, переживут его перезапуск
+    import code_store
+    code_store.spill()
@@ -0,0 +1,150 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+import database
+
+MAX_ATTEMPTS = 3          # Неудачных попыток на cookie + пользователя до блокировки
+IP_USER_MAX_ATTEMPTS = 10  # Неудачных попыток на IP + пользователя (если cookie сбрасывают)
+# Весь колледж выходит в интернет с одного IP, поэтому IP целиком блокируется только
+# при явном переборе - намного больше, чем ошибаются все студенты за час
+IP_FLOOD_ATTEMPTS = 500
+ATTEMPTS_WINDOW = 60 * 60  # Скользящее окно учёта попыток, секунд
+BLOCK_DURATION = 10 * 60   # Длительность блокировки, секунд
+PRUNE_EVERY = 1000         # Чистить устаревшие счётчики раз в столько операций
+BLOCKS_SYNC_INTERVAL = 5   # Как часто подтягивать блокировки других процессов, секунд
+
+LIMITER_BACKEND = os.environ.get('LIMITER_BACKEND', 'sqlite')
+
+class MemoryBackend:
+    """Счётчики попыток (скользящее окно) и блокировки в памяти процесса"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hits = {}
+        self._blocked = {}
+        self._ops = 0
+    
+    def hit(self, key, window=ATTEMPTS_WINDOW):
+        """Атомарно регистрирует попытку и возвращает число попыток в окне"""
+        now = time.time()
+        with self._lock:
+            hits = self._hits.get(key)
+            if hits is None:
+                hits = self._hits[key] = deque()
+            while hits and hits[0] <= now - window:
+                hits.popleft()
+            hits.append(now)
+            
+            self._ops += 1
+            if self._ops >= PRUNE_EVERY:
+                self._prune(now, window)
+            return len(hits)
+    
+    def reset(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
+    
+    def block(self, key, duration=BLOCK_DURATION):
+        until = time.time() + duration
+        with self._lock:
+            self._blocked[key] = until
+        return until
+    
+    def is_blocked(self, key):
+        with self._lock:
+            until = self._blocked.get(key)
+            if until is None:
+                return False
+            if until <= time.time():
+                del self._blocked[key]
+                return False
+            return True
+    
+    def _prune(self, now, window):
+        self._ops = 0
+        self._hits = {key: hits for key, hits in self._hits.items() if hits and hits[-1] > now - window}
+        self._blocked = {key: until for key, until in self._blocked.items() if until > now}
+
+class SQLiteBackend(MemoryBackend):
+    """Как MemoryBackend, но блокировки в фоне сохраняются в blocked_cookies,
+    восстанавливаются при запуске и раз в BLOCKS_SYNC_INTERVAL подтягиваются
+    из базы - так блокировка видна всем воркерам gunicorn"""
+    
+    def __init__(self):
+        super().__init__()
+        self._pending = queue.Queue()
+        self._load_blocks()
+        threading.Thread(target=self._writer, daemon=True).start()
+    
+    def block(self, key, duration=BLOCK_DURATION):
+        until = super().block(key, duration)
+        self._pending.put((key, until))
+        return until
+    
+    def _load_blocks(self):
+        try:
+            blocks = database.get_active_blocks()
+        except Exception as e:
+            print(f"❌ Ошибка загрузки блокировок: {e}")
+            return
+        
+        with self._lock:
+            for key, until in blocks.items():
+                self._blocked[key] = max(self._blocked.get(key, 0), until.timestamp())
+    
+    def _writer(self):
+        while True:
+            try:
+                key, until = self._pending.get(timeout=BLOCKS_SYNC_INTERVAL)
+            except queue.Empty:
+                self._load_blocks()
+                continue
+            
+            try:
+                database.block_cookie(key, datetime.fromtimestamp(until))
+            except Exception as e:
+                print(f"❌ Ошибка сохранения блокировки: {e}")
+
+class Limiter:
+    """Защита входа от перебора: блокировки по cookie + пользователю и по IP + пользователю;
+    IP целиком - только при массовом переборе"""
+    
+    def __init__(self, backend):
+        self.backend = backend
+    
+    def is_blocked(self, cookie_id, ip=None, user_id=None):
+        if self.backend.is_blocked(cookie_id):
+            return True
+        if ip is None:
+            return False
+        if user_id is not None and self.backend.is_blocked(f'ip:{ip}:{user_id}'):
+            return True
+        return self.backend.is_blocked(f'ip:{ip}')
+    
+    def register_failure(self, cookie_id, user_id, ip=None):
+        """Учитывает неудачную попытку, блокирует при превышении лимита.
+        Возвращает число попыток для cookie + пользователя"""
+        attempts = self.backend.hit(f'{cookie_id}:{user_id}')
+        if attempts >= MAX_ATTEMPTS:
+            self.backend.block(cookie_id)
+        
+        # В счётчики IP идут только попытки ввести код за конкретного пользователя:
+        # пустые запросы не должны блокировать весь NAT колледжа
+        if ip is not None and user_id is not None:
+            if self.backend.hit(f'ip:{ip}:{user_id}') >= IP_USER_MAX_ATTEMPTS:
+                self.backend.block(f'ip:{ip}:{user_id}')
+            if self.backend.hit(f'ip:{ip}') >= IP_FLOOD_ATTEMPTS:
+                self.backend.block(f'ip:{ip}')
+        
+        return attempts
+    
+    def register_success(self, cookie_id, user_id):
+        self.backend.reset(f'{cookie_id}:{user_id}')
+
+def create_limiter(backend=LIMITER_BACKEND):
+    if backend == 'memory':
+        return Limiter(MemoryBackend())
+    return Limiter(SQLiteBackend())
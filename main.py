@@ -1,36 +1,158 @@
+import os
+import subprocess
+import sys
 import threading
+import time
 import asyncio
-from app import app
+import assets
 import database
+import database_async
 from bot import bot, dp
+from maintenance import maintenance_loop, prepare_database
+import delivery
+import webhook
+import broadcast
+import code_store
+
+# dev - встроенный сервер Flask в потоке рядом с ботом
+# gunicorn - сайт в отдельном процессе gunicorn (несколько воркеров), бот - в этом процессе
+WEB_SERVER = os.environ.get('WEB_SERVER', 'dev')
+PORT = int(os.environ.get('PORT', 80))
 
 def run_flask():
-    app.run(host='0.0.0.0', port=80, use_reloader=False)
+    from app import app
+    app.run(host='0.0.0.0', port=PORT, use_reloader=False)
+
+def start_gunicorn():
+    return subprocess.Popen([
+        sys.executable, '-m', 'gunicorn',
+        '-c', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py'),
+        'app:app'
+    ])
 
 async def run_bot():
     database.init_db()
     print("🤖 Telegram бот запускается...")
-    await dp.start_polling(bot, skip_updates=True)
+    maintenance_task = asyncio.create_task(maintenance_loop())
+    delivery.start(bot)
+    await broadcast.start(bot)
+    try:
+        await webhook.run(bot, dp)
+    finally:
+        maintenance_task.cancel()
+
+def _serve_for_benchmark(mode, port, db_path):
+    """Запускает сайт в отдельном процессе на временной базе: dev-сервер Flask или gunicorn"""
+    if mode == 'dev':
+        code = 'import main; main.run_flask()'
+    else:
+        code = ("sys.argv = ['gunicorn', '-c', 'gunicorn.conf.py', 'app:app']; "
+                "from gunicorn.app.wsgiapp import run; run()")
+    env = dict(os.environ, PORT=str(port))
+    return subprocess.Popen(
+        [sys.executable, '-c', f'import sys, database; database.DATABASE = {db_path!r}; {code}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+async def _load(url, cookies, connections, duration):
+    """connections клиентов без пауз шлют GET в течение duration секунд"""
+    import aiohttp
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    
+    async def client(session):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                async with session.get(url, allow_redirects=False) as response:
+                    await response.read()
+                    if response.status >= 500:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+    
+    async with aiohttp.ClientSession(cookies=cookies) as session:
+        await asyncio.gather(*(client(session) for _ in range(connections)))
+    latencies.sort()
+    return len(latencies) / duration, latencies[int(len(latencies) * 0.95)] * 1000, errors
 
-if __name__ == '__main__':
+def _benchmark(connections=32, duration=10):
+    """Сравнение dev-сервера Flask (как раньше) и gunicorn на /, /login и /profile"""
+    import tempfile
+    import urllib.request
+    from datetime import datetime, timedelta
+    
+    database.DATABASE = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    database.init_db()
+    with database.get_db() as conn:
+        conn.executemany(
+            "INSERT INTO users (telegram_id, group_name, last_name, first_name) VALUES (?, 'ЭМ25', ?, 'Имя')",
+            [(1000 + i, f'Фамилия{i}') for i in range(3000)]
+        )
+        conn.commit()
+    database.save_session('bench-session', 1, {'user_id': 1, 'cookie_id': 'bench'}, datetime.now() + timedelta(days=1))
+    database.close_pool()
+    
+    print(f"🔥 {connections} клиентов, по {duration} с на страницу, воркеры gunicorn: "
+          f"{os.environ.get('WEB_WORKERS', 4)} x {os.environ.get('WEB_THREADS', 4)} потоков, CPU: {os.cpu_count()}")
+    for mode, port in (('dev', 18090), ('gunicorn', 18091)):
+        server = _serve_for_benchmark(mode, port, database.DATABASE)
+        try:
+            for _ in range(100):
+                try:
+                    urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1).read()
+                    break
+                except OSError:
+                    time.sleep(0.2)
+            for path in ('/', '/login', '/profile'):
+                cookies = {'session': 'bench-session'} if path == '/profile' else None
+                per_second, p95, errors = asyncio.run(
+                    _load(f'http://127.0.0.1:{port}{path}', cookies, connections, duration))
+                print(f"{mode:>8} {path:<9} {per_second:7.0f} запросов/с, p95 {p95:6.1f} мс, ошибок {errors}")
+        finally:
+            server.terminate()
+            server.wait()
+
+if __name__ == '__main__' and len(sys.argv) >= 2 and sys.argv[1] == 'bench':
+    _benchmark()
+elif __name__ == '__main__':
     print("=" * 50)
     print("🚀 Запуск системы НПЭК")
     print("=" * 50)
     
     database.init_db()
     print(f"✅ База данных инициализирована: {database.DATABASE}")
+    prepare_database()
+    
+    assets.build()
+    print("✅ Статика собрана")
     
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
-    print("🌐 Flask сервер запущен")
+    web_process = None
+    if WEB_SERVER == 'gunicorn':
+        web_process = start_gunicorn()
+        print(f"🌐 gunicorn запущен (pid {web_process.pid})")
+    else:
+        flask_thread = threading.Thread(target=run_flask, daemon=True)
+        flask_thread.start()
+        print("🌐 Flask сервер запущен")
     
     print("=" * 50)
     print("📱 Бот: @npeks_bot")
-    print("🌍 Сайт: http://localhost:80")
+    print(f"🌍 Сайт: http://localhost:{PORT}")
     print("=" * 50)
     
     try:
         asyncio.run(run_bot())
     except KeyboardInterrupt:
         print("\n⚠️ Система остановлена")
-
+    finally:
+        if web_process is not None:
+            web_process.terminate()
+            web_process.wait()
+        code_store.spill()
+        database_async.shutdown()
+        database.close_pool()
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+import database
+from fsm_storage import FSM_STATE_TTL
+from delivery import STATUS_TTL
+
+MAINTENANCE_INTERVAL = 60 * 60  # Раз в час
+PURGE_BATCH_SIZE = 500
+VACUUM_PAGES = 2000
+
+# Неудачные попытки старше этого срока больше не учитываются
+FAILED_ATTEMPTS_TTL = timedelta(hours=1)
+
+def purge_expired():
+    """Удаляет устаревшие строки всех таблиц, возвращает {таблица: удалено строк}"""
+    now = datetime.now()
+    return {
+        'login_codes': database.purge_expired_rows(
+            'login_codes', 'expires_at', now, PURGE_BATCH_SIZE),
+        'blocked_cookies': database.purge_expired_rows(
+            'blocked_cookies', 'blocked_until', now, PURGE_BATCH_SIZE),
+        'failed_attempts': database.purge_expired_rows(
+            'failed_attempts', 'last_attempt', now - FAILED_ATTEMPTS_TTL, PURGE_BATCH_SIZE),
+        'fsm_states': database.purge_expired_rows(
+            'fsm_states', 'updated_at', now - FSM_STATE_TTL, PURGE_BATCH_SIZE),
+        'sessions': database.purge_expired_rows(
+            'sessions', 'expires_at', now, PURGE_BATCH_SIZE),
+        'delivery_statuses': database.purge_expired_rows(
+            'delivery_statuses', 'updated_at', now - timedelta(seconds=STATUS_TTL), PURGE_BATCH_SIZE),
+    }
+
+def run_maintenance():
+    """Один проход обслуживания базы, возвращает отчёт"""
+    started = time.perf_counter()
+    report = purge_expired()
+    report['vacuumed_pages'] = database.incremental_vacuum(VACUUM_PAGES)
+    database.optimize()
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    return report
+
+def format_report(report):
+    return (
+        f"🧹 Обслуживание БД: удалено кодов {report['login_codes']}, "
+        f"блокировок {report['blocked_cookies']}, "
+        f"попыток {report['failed_attempts']}, "
+        f"состояний FSM {report['fsm_states']}, "
+        f"сессий {report['sessions']}, "
+        f"статусов доставки {report['delivery_statuses']}, "
+        f"освобождено страниц {report['vacuumed_pages']} "
+        f"за {report['seconds']} с"
+    )
+
+def prepare_database():
+    """Шаг запуска до того, как сайт и бот начнут обслуживать запросы: сначала удаляет
+    устаревшие строки, затем один раз включает incremental vacuum (полный VACUUM
+    копирует всю базу и держит исключительную блокировку)"""
+    started = time.perf_counter()
+    purged = sum(purge_expired().values())
+    if database.enable_incremental_vacuum():
+        print(f"🧹 Включён режим incremental vacuum: удалено устаревших строк {purged}, "
+              f"база сжата за {time.perf_counter() - started:.1f} с")
+
+async def maintenance_loop():
+    """Фоновая задача: периодически чистит устаревшие строки и сжимает базу"""
+    while True:
+        try:
+            print(format_report(await asyncio.to_thread(run_maintenance)))
+        except Exception as e:
+            print(f"❌ Ошибка обслуживания БД: {e}")
+        await asyncio.sleep(MAINTENANCE_INTERVAL)
+
+if __name__ == '__main__':
+    database.init_db()
+    prepare_database()
+    print(format_report(run_maintenance()))
+    database.close_pool()
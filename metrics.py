@@ -0,0 +1,353 @@
+"""Метрики и профилирование сайта: время запросов, вызовы database.*, рендер шаблонов,
+запросы к Telegram. Гистограммы отдаются на /metrics в формате Prometheus.
+
+PROFILE_SLOW_MS=500 включает сэмплирующий профилировщик: стеки запросов дольше порога
+сохраняются в DATA_DIR/profiles в формате collapsed stacks (flamegraph.pl, speedscope).
+"""
+import functools
+import inspect
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from flask import request, Response, before_render_template, template_rendered
+from werkzeug.wsgi import ClosingIterator
+import database
+
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # Без него /metrics закрыт; с ним требует Authorization: Bearer
+PROFILE_SLOW_MS = int(os.environ.get('PROFILE_SLOW_MS', 0))  # 0 - профилировщик выключен
+PROFILE_INTERVAL = 0.005  # Секунд между снимками стеков
+PROFILE_DIR = os.path.join(database.DATA_DIR, 'profiles')
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+
+class Histogram:
+    """Гистограмма с фиксированными границами и метками"""
+    
+    def __init__(self, name, help_text, labels, buckets=TIME_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # значения меток -> [счётчики корзин..., сумма, количество]
+        self._lock = threading.Lock()
+    
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted(self._series.items())
+        for label_values, series in items:
+            labels = ','.join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+            prefix = labels + ',' if labels else ''
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-1]}')
+            suffix = f'{{{labels}}}' if labels else ''
+            lines.append(f'{self.name}_sum{suffix} {series[-2]:.6f}')
+            lines.append(f'{self.name}_count{suffix} {series[-1]}')
+        return lines
+
+class CounterMetric:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = Counter()
+        self._lock = threading.Lock()
+    
+    def inc(self, *label_values):
+        with self._lock:
+            self._values[label_values] += 1
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            labels = ','.join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+            lines.append(f'{self.name}{{{labels}}} {value}')
+        return lines
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Время обработки запроса', ('route', 'method'))
+REQUESTS = CounterMetric('http_requests_total', 'Запросы по маршрутам и кодам ответа', ('route', 'status'))
+REQUEST_DB_CALLS = Histogram('http_request_db_calls', 'Вызовов database.* за запрос', ('route',), COUNT_BUCKETS)
+REQUEST_DB_SECONDS = Histogram('http_request_db_seconds', 'Время в database.* за запрос', ('route',))
+DB_SECONDS = Histogram('db_call_duration_seconds', 'Время вызова функций database.*', ('function',))
+TEMPLATE_SECONDS = Histogram('template_render_seconds', 'Время рендера шаблонов Jinja', ('template',))
+TELEGRAM_SECONDS = Histogram('telegram_request_duration_seconds', 'Время запросов к Bot API', ('method',))
+TELEGRAM_ERRORS = CounterMetric('telegram_request_errors_total', 'Ошибки запросов к Bot API', ('method',))
+DB_COMMIT_SECONDS = Histogram('db_write_commit_seconds', 'Время транзакции пачки писателя', ())
+DB_COMMIT_BATCH = Histogram('db_write_batch_size', 'Операций записи в одной транзакции', (),
+                            (1, 2, 4, 8, 16, 32, 64, 128, 256))
+SLOW_PROFILES = CounterMetric('slow_request_profiles_total', 'Сохранённые профили медленных запросов', ('route',))
+
+METRICS = (REQUEST_SECONDS, REQUESTS, REQUEST_DB_CALLS, REQUEST_DB_SECONDS, DB_SECONDS,
+           DB_COMMIT_SECONDS, DB_COMMIT_BATCH, TEMPLATE_SECONDS, TELEGRAM_SECONDS, TELEGRAM_ERRORS,
+           SLOW_PROFILES)
+
+# Статистика текущего запроса в этом потоке
+_current = threading.local()
+
+def _stats():
+    return getattr(_current, 'stats', None)
+
+def _render_writer_stats():
+    stats = database.write_stats()
+    return [
+        '# HELP db_write_queue_depth Операций в очереди писателя',
+        '# TYPE db_write_queue_depth gauge',
+        f"db_write_queue_depth {stats['queue_depth']}",
+        '# HELP db_write_jobs_total Выполненных операций записи',
+        '# TYPE db_write_jobs_total counter',
+        f"db_write_jobs_total {stats['jobs']}",
+        '# HELP db_write_failed_total Операций записи, завершившихся ошибкой',
+        '# TYPE db_write_failed_total counter',
+        f"db_write_failed_total {stats['failed_jobs']}",
+    ]
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.extend(_render_writer_stats())
+    return '\n'.join(lines) + '\n'
+
+# Функции database.*, которые ходят в базу; служебные (пул, писатель, roster_name_key) не замеряются
+DB_QUERIES = (
+    'create_user', 'update_user_profile', 'update_user_photo', 'get_user_by_telegram', 'get_user_by_id',
+    'get_users_by_group', 'get_roster_version', 'get_login_code', 'save_login_codes',
+    'record_login_code_failure', 'delete_login_code', 'get_active_blocks', 'block_cookie',
+    'create_pending_registration', 'get_pending_registration', 'confirm_pending_registration',
+    'delete_pending_registration', 'import_roster_students', 'find_roster_student', 'register_student',
+    'get_registered_names', 'count_roster_students', 'get_teachers_and_admins', 'get_teachers',
+    'record_login', 'iter_users_export', 'create_broadcast', 'get_broadcast', 'get_running_broadcasts',
+    'get_broadcast_batch', 'save_broadcast_results', 'finish_broadcast', 'get_fsm_record',
+    'save_fsm_records', 'get_delivery_status', 'save_delivery_status', 'get_session', 'save_session',
+    'replace_session', 'touch_session', 'delete_session', 'delete_user_sessions', 'purge_expired_rows',
+    'incremental_vacuum', 'optimize',
+)
+
+def instrument_database(module=database, names=DB_QUERIES):
+    """Оборачивает функции запросов database.* замером времени и счётчиком вызовов.
+    Вложенные вызовы (одна функция database.* вызывает другую) считаются один раз"""
+    for name in names:
+        func = getattr(module, name)
+        if hasattr(func, '__instrumented__'):
+            continue
+        if inspect.isgeneratorfunction(func):
+            setattr(module, name, _timed_db_generator(name, func))
+        else:
+            setattr(module, name, _timed_db_call(name, func))
+
+def _observe_db_call(name, elapsed):
+    DB_SECONDS.observe(elapsed, name)
+    stats = _stats()
+    if stats is not None:
+        stats['db_calls'] += 1
+        stats['db_seconds'] += elapsed
+
+def _timed_db_call(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        depth = getattr(_current, 'db_depth', 0)
+        _current.db_depth = depth + 1
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.db_depth = depth
+            if depth == 0:
+                _observe_db_call(name, time.perf_counter() - started)
+    wrapper.__instrumented__ = True
+    return wrapper
+
+def _timed_db_generator(name, func):
+    """Генератор замеряется за всю выдачу: суммируется время внутри него, без работы того, кто читает"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        generator = func(*args, **kwargs)
+        elapsed = 0.0
+        nested = getattr(_current, 'db_depth', 0) > 0
+        try:
+            while True:
+                depth = getattr(_current, 'db_depth', 0)
+                _current.db_depth = depth + 1
+                started = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    _current.db_depth = depth
+                    elapsed += time.perf_counter() - started
+                yield item
+        finally:
+            generator.close()
+            if not nested:
+                _observe_db_call(name, elapsed)
+    wrapper.__instrumented__ = True
+    return wrapper
+
+async def _telegram_middleware(make_request, bot, method):
+    name = type(method).__name__
+    started = time.perf_counter()
+    try:
+        return await make_request(bot, method)
+    except Exception:
+        TELEGRAM_ERRORS.inc(name)
+        raise
+    finally:
+        TELEGRAM_SECONDS.observe(time.perf_counter() - started, name)
+
+def instrument_bot(bot):
+    """Замер всех запросов бота к Bot API"""
+    if not getattr(bot.session, '_metrics_instrumented', False):
+        bot.session.middleware(_telegram_middleware)
+        bot.session._metrics_instrumented = True
+
+class SamplingProfiler:
+    """Фоновый поток раз в PROFILE_INTERVAL снимает стеки потоков, обрабатывающих запросы"""
+    
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self._active = {}  # id потока -> Counter свёрнутых стеков
+        self._lock = threading.Lock()
+        self._thread = None
+    
+    def begin(self):
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+                self._thread.start()
+    
+    def end(self):
+        with self._lock:
+            return self._active.pop(threading.get_ident(), Counter())
+    
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, samples in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[_collapse(frame)] += 1
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+def _dump_profile(route, elapsed, samples):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe_route = route.strip('/').replace('/', '_').replace('<', '').replace('>', '') or 'index'
+    name = f"{datetime.now():%Y%m%d-%H%M%S}-{safe_route}-{int(elapsed * 1000)}ms.folded"
+    with open(os.path.join(PROFILE_DIR, name), 'w', encoding='utf-8') as f:
+        for stack, count in samples.most_common():
+            f.write(f'{stack} {count}\n')
+    SLOW_PROFILES.inc(route)
+
+_profiler = SamplingProfiler() if PROFILE_SLOW_MS else None
+
+class MetricsMiddleware:
+    """WSGI-обёртка: время запроса, вызовы базы и рендер шаблонов, заголовок Server-Timing"""
+    
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+    
+    def __call__(self, environ, start_response):
+        stats = {'route': None, 'db_calls': 0, 'db_seconds': 0.0, 'template_seconds': 0.0, 'status': '500'}
+        _current.stats = stats
+        started = time.perf_counter()
+        if _profiler is not None:
+            _profiler.begin()
+        
+        def timed_start_response(status, headers, exc_info=None):
+            stats['status'] = status.split(' ', 1)[0]
+            elapsed = time.perf_counter() - started
+            headers.append(('Server-Timing', ', '.join((
+                f'db;dur={stats["db_seconds"] * 1000:.1f};desc="{stats["db_calls"]} calls"',
+                f'tpl;dur={stats["template_seconds"] * 1000:.1f}',
+                f'app;dur={elapsed * 1000:.1f}',
+            ))))
+            return start_response(status, headers, exc_info)
+        
+        def finish():
+            elapsed = time.perf_counter() - started
+            route = stats['route'] or 'unmatched'
+            REQUEST_SECONDS.observe(elapsed, route, environ.get('REQUEST_METHOD', ''))
+            REQUESTS.inc(route, stats['status'])
+            REQUEST_DB_CALLS.observe(stats['db_calls'], route)
+            REQUEST_DB_SECONDS.observe(stats['db_seconds'], route)
+            _current.stats = None
+            if _profiler is not None:
+                samples = _profiler.end()
+                if elapsed * 1000 >= PROFILE_SLOW_MS and samples:
+                    _dump_profile(route, elapsed, samples)
+        
+        try:
+            return ClosingIterator(self.wsgi_app(environ, timed_start_response), finish)
+        except BaseException:
+            finish()
+            raise
+
+def init_app(app, bots=()):
+    """Подключает замеры к приложению, функциям database.* и ботам, добавляет /metrics"""
+    instrument_database()
+    database.WRITE_OBSERVERS.append(lambda size, seconds: (
+        DB_COMMIT_SECONDS.observe(seconds), DB_COMMIT_BATCH.observe(size)))
+    for bot in bots:
+        instrument_bot(bot)
+    app.wsgi_app = MetricsMiddleware(app.wsgi_app)
+    
+    @app.before_request
+    def remember_route():
+        stats = _stats()
+        if stats is not None and request.url_rule is not None:
+            stats['route'] = request.url_rule.rule
+    
+    def template_started(sender, template, context, **extra):
+        _current.template_started = time.perf_counter()
+    
+    def template_finished(sender, template, context, **extra):
+        elapsed = time.perf_counter() - getattr(_current, 'template_started', time.perf_counter())
+        TEMPLATE_SECONDS.observe(elapsed, template.name)
+        stats = _stats()
+        if stats is not None:
+            stats['template_seconds'] += elapsed
+    
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
+    
+    @app.route('/metrics')
+    def metrics():
+        # Метрики раскрывают маршруты и нагрузку, поэтому без токена закрыты для всех
+        if not METRICS_TOKEN:
+            return Response('Forbidden: METRICS_TOKEN is not set\n', status=403, mimetype='text/plain')
+        token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not secrets.compare_digest(token, METRICS_TOKEN):
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
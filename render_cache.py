@@ -0,0 +1,62 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import render_template, make_response, request
+
+CACHE_SIZE = 512  # Сколько готовых страниц держать в памяти
+
+class RenderCache:
+    """LRU-кэш отрендеренных страниц с ETag"""
+    
+    def __init__(self, size=CACHE_SIZE):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._size = size
+    
+    def get_or_render(self, key, render):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        
+        html = render()
+        entry = (html, hashlib.sha1(html.encode('utf-8')).hexdigest())
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+        return entry
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+_cache = RenderCache()
+
+def _principal_key(principal):
+    """Всё, что шаблоны берут из inject_user: доступы и данные для аватара в меню.
+    В ключ входят сами значения из строки пользователя, поэтому после изменения
+    профиля (фото, фамилия, группа, роль) страница рендерится заново"""
+    user = principal['user']
+    if user is None:
+        return None
+    return (
+        bool(principal['obsh_access']),
+        principal['phil_access'],
+        user.get('photo_url'),
+        user['last_name'][:1],
+    )
+
+def render_cached(principal, template_name, **context):
+    """Как render_template, но страница берётся из кэша по ключу (шаблон, контекст,
+    доступы пользователя), а повторный запрос с тем же ETag получает 304"""
+    key = (template_name, tuple(sorted(context.items())), _principal_key(principal))
+    html, etag = _cache.get_or_render(key, lambda: render_template(template_name, **context))
+    
+    response = make_response(html)
+    response.set_etag(etag)
+    # Страница зависит от сессии: браузер хранит её у себя, но каждый раз сверяет ETag
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
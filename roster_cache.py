@@ -0,0 +1,51 @@
+import hashlib
+import json
+import threading
+import database
+
+class RosterCache:
+    """Списки студентов по группам для выбора при входе.
+    
+    Каждая запись помнит версию списка из roster_versions: триггеры в базе меняют её
+    при create_user, подтверждении регистрации и смене фамилии/имени/группы, поэтому
+    сбрасывается только изменившаяся группа, в том числе после записи из бота.
+    """
+    
+    def __init__(self):
+        self._entries = {}  # группа -> (версия, строки, JSON, ETag)
+        self._lock = threading.Lock()
+        self._group_locks = {}
+    
+    def _group_lock(self, group_name):
+        with self._lock:
+            return self._group_locks.setdefault(group_name, threading.Lock())
+    
+    def get(self, group_name):
+        version = database.get_roster_version(group_name)
+        entry = self._entries.get(group_name)
+        if entry is not None and entry[0] == version:
+            return entry
+        
+        # Одновременные запросы одной группы ждут одну выборку, а не делают по своей
+        with self._group_lock(group_name):
+            entry = self._entries.get(group_name)
+            if entry is not None and entry[0] == version:
+                return entry
+            
+            users = tuple(database.get_users_by_group(group_name))
+            payload = json.dumps({'group': group_name, 'users': users},
+                                 ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            entry = (version, users, payload, hashlib.sha1(payload).hexdigest())
+            self._entries[group_name] = entry
+            return entry
+
+_cache = RosterCache()
+
+def get_users(group_name):
+    """Студенты группы в том же виде, что и database.get_users_by_group"""
+    return _cache.get(group_name)[1]
+
+def get_payload(group_name):
+    """Готовый JSON списка группы и его ETag"""
+    _, _, payload, etag = _cache.get(group_name)
+    return payload, etag
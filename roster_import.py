@@ -0,0 +1,314 @@
+"""Загрузка списков студентов из выгрузок колледжа (CSV или XLSX).
+
+Файл читается потоком, строки пишутся пачками по CHUNK_SIZE - одна транзакция
+на пачку, поэтому память не зависит от размера файла. Загруженные студенты ждут
+регистрации в roster_students: когда студент регистрируется в боте и его группа
+и ФИО совпадают со списком, ФИО берётся из списка.
+
+Столбцы ищутся по заголовку: Группа, Фамилия, Имя, Отчество или одно ФИО.
+Без столбца группы все строки относятся к группе, указанной при загрузке.
+
+python roster_import.py файл.csv|файл.xlsx [группа]  - загрузить список
+python roster_import.py bench [строк]                - нагрузочная проверка
+"""
+import codecs
+import csv
+import io
+import os
+import sqlite3
+import sys
+import time
+import zipfile
+from xml.etree import ElementTree
+from config import GROUPS
+import database
+
+CHUNK_SIZE = 1000          # Строк в одной транзакции
+HEADER_SEARCH_ROWS = 20    # Сколько первых строк просматривать в поисках заголовка
+MAX_REPORTED_ERRORS = 20   # Сколько ошибок перечислять в отчёте
+
+COLUMNS = {
+    'group_name': ('группа', 'учебнаягруппа', 'group'),
+    'last_name': ('фамилия', 'lastname'),
+    'first_name': ('имя', 'firstname'),
+    'middle_name': ('отчество', 'middlename'),
+    'fio': ('фио', 'студент', 'обучающийся', 'fullname'),
+}
+
+XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+def _normalize(value):
+    return ''.join(ch for ch in str(value).casefold() if ch.isalnum())
+
+def _csv_rows(path):
+    with open(path, 'rb') as raw:
+        sample = raw.read(64 * 1024)
+        raw.seek(0)
+        try:
+            text = codecs.getincrementaldecoder('utf-8-sig')().decode(sample)
+            encoding = 'utf-8-sig'
+        except UnicodeDecodeError:
+            # Excel в русской Windows сохраняет CSV в cp1251
+            text = sample.decode('cp1251', errors='replace')
+            encoding = 'cp1251'
+        try:
+            dialect = csv.Sniffer().sniff(text, delimiters=';,\t')
+        except csv.Error:
+            dialect = csv.excel
+        
+        with io.TextIOWrapper(raw, encoding=encoding, newline='') as stream:
+            yield from csv.reader(stream, dialect)
+
+def _column_index(ref):
+    index = 0
+    for ch in ref:
+        if not ch.isalpha():
+            break
+        index = index * 26 + ord(ch.upper()) - ord('A') + 1
+    return index - 1
+
+def _shared_strings(archive):
+    """Таблица строк XLSX во временной базе SQLite на диске: у больших файлов в ней
+    сотни тысяч строк, и в памяти держать их нельзя"""
+    conn = sqlite3.connect('')  # Временная база, удаляется при закрытии соединения
+    conn.execute('CREATE TABLE strings (id INTEGER PRIMARY KEY, text TEXT)')
+    if 'xl/sharedStrings.xml' in archive.namelist():
+        with archive.open('xl/sharedStrings.xml') as stream:
+            batch = []
+            index = 0
+            root = None
+            for event, element in ElementTree.iterparse(stream, events=('start', 'end')):
+                if root is None:
+                    root = element
+                if event == 'end' and element.tag == XLSX_NS + 'si':
+                    batch.append((index, ''.join(t.text or '' for t in element.iter(XLSX_NS + 't'))))
+                    index += 1
+                    if len(batch) >= CHUNK_SIZE:
+                        root.clear()  # Записанные строки больше не нужны
+                        conn.executemany('INSERT INTO strings (id, text) VALUES (?, ?)', batch)
+                        batch.clear()
+            conn.executemany('INSERT INTO strings (id, text) VALUES (?, ?)', batch)
+    return conn
+
+def _xlsx_rows(path):
+    """Строки первого листа XLSX без загрузки листа и таблицы строк в память"""
+    with zipfile.ZipFile(path) as archive:
+        names = archive.namelist()
+        sheets = sorted(name for name in names if name.startswith('xl/worksheets/sheet'))
+        if not sheets:
+            raise ValueError('В файле XLSX нет ни одного листа')
+        sheet = 'xl/worksheets/sheet1.xml' if 'xl/worksheets/sheet1.xml' in names else sheets[0]
+        
+        shared = _shared_strings(archive)
+        try:
+            with archive.open(sheet) as stream:
+                yield from _sheet_rows(stream, shared)
+        finally:
+            shared.close()
+
+def _sheet_rows(stream, shared):
+    sheet_data = None
+    for event, element in ElementTree.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            if element.tag == XLSX_NS + 'sheetData':
+                sheet_data = element
+            continue
+        if element.tag != XLSX_NS + 'row':
+            continue
+        
+        values = {}
+        for cell in element.iter(XLSX_NS + 'c'):
+            kind = cell.get('t')
+            if kind == 'inlineStr':
+                text = ''.join(t.text or '' for t in cell.iter(XLSX_NS + 't'))
+            else:
+                value = cell.find(XLSX_NS + 'v')
+                text = value.text if value is not None and value.text else ''
+                if kind == 's' and text:
+                    found = shared.execute('SELECT text FROM strings WHERE id = ?', (int(text),)).fetchone()
+                    text = found[0] if found else ''
+            ref = cell.get('r')
+            values[_column_index(ref) if ref else len(values)] = text
+        
+        yield [values.get(i, '') for i in range(max(values) + 1)] if values else []
+        sheet_data.clear()  # Разобранные строки больше не нужны
+
+def read_rows(path):
+    """Строки таблицы из CSV или XLSX по одной"""
+    if path.lower().endswith(('.xlsx', '.xlsm')):
+        return _xlsx_rows(path)
+    return _csv_rows(path)
+
+def _find_header(rows):
+    """Ищет строку заголовка, возвращает ({столбец: индекс}, номер строки)"""
+    aliases = {alias: column for column, names in COLUMNS.items() for alias in names}
+    for line, row in enumerate(rows, 1):
+        columns = {}
+        for index, title in enumerate(row):
+            column = aliases.get(_normalize(title))
+            if column is not None:
+                columns.setdefault(column, index)
+        if 'fio' in columns or ('last_name' in columns and 'first_name' in columns):
+            return columns, line
+        if line >= HEADER_SEARCH_ROWS:
+            break
+    raise ValueError('Не найден заголовок: нужны столбцы «Фамилия» и «Имя» или «ФИО»')
+
+def parse_students(rows, default_group=None, groups=GROUPS):
+    """Разбирает строки таблицы. Выдаёт (номер строки, студент или None, ошибка)"""
+    rows = iter(rows)
+    columns, line = _find_header(rows)
+    known_groups = {_normalize(group): group for group in groups}
+    
+    def cell(row, column):
+        index = columns.get(column)
+        return str(row[index]).strip() if index is not None and index < len(row) else ''
+    
+    for line, row in enumerate(rows, line + 1):
+        if not any(str(value).strip() for value in row):
+            continue
+        
+        if 'fio' in columns:
+            parts = cell(row, 'fio').split()
+            last_name, first_name = (parts + ['', ''])[:2]
+            middle_name = ' '.join(parts[2:])
+        else:
+            last_name, first_name, middle_name = cell(row, 'last_name'), cell(row, 'first_name'), cell(row, 'middle_name')
+        
+        raw_group = cell(row, 'group_name') or default_group or ''
+        group_name = known_groups.get(_normalize(raw_group))
+        if group_name is None:
+            yield line, None, f'неизвестная группа «{raw_group}»' if raw_group else 'не указана группа'
+        elif not last_name or not first_name:
+            yield line, None, 'нет фамилии или имени'
+        else:
+            yield line, (group_name, last_name, first_name, middle_name or None), None
+
+def import_rows(rows, default_group=None, groups=GROUPS, chunk_size=CHUNK_SIZE):
+    """Загружает студентов пачками, возвращает отчёт"""
+    started = time.perf_counter()
+    registered = set()
+    for group_name, last_name, first_name, middle_name in database.get_registered_names():
+        registered.add((group_name, database.roster_name_key(last_name, first_name, middle_name)))
+        registered.add((group_name, database.roster_name_key(last_name, first_name)))
+    
+    report = {'rows': 0, 'imported': 0, 'duplicates': 0, 'registered': 0, 'error_count': 0, 'errors': []}
+    chunk = []
+    
+    def flush():
+        imported = database.import_roster_students(chunk)
+        report['imported'] += imported
+        report['duplicates'] += len(chunk) - imported
+        chunk.clear()
+    
+    for line, student, error in parse_students(rows, default_group, groups):
+        report['rows'] += 1
+        if error:
+            report['error_count'] += 1
+            if len(report['errors']) < MAX_REPORTED_ERRORS:
+                report['errors'].append(f'строка {line}: {error}')
+            continue
+        
+        group_name, last_name, first_name, middle_name = student
+        if (group_name, database.roster_name_key(last_name, first_name, middle_name)) in registered:
+            report['registered'] += 1  # Уже зарегистрирован в боте
+            continue
+        
+        chunk.append(student)
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    
+    elapsed = time.perf_counter() - started
+    report['seconds'] = round(elapsed, 2)
+    report['per_second'] = round(report['rows'] / elapsed) if elapsed else 0
+    return report
+
+def import_file(path, default_group=None, groups=GROUPS):
+    return import_rows(read_rows(path), default_group, groups)
+
+def format_report(report):
+    text = (
+        f"📥 Строк: {report['rows']} за {report['seconds']} с ({report['per_second']} в секунду)\n"
+        f"✅ Добавлено: {report['imported']}\n"
+        f"↩️ Уже были в списке: {report['duplicates']}\n"
+        f"👤 Уже зарегистрированы: {report['registered']}\n"
+        f"❌ Ошибок: {report['error_count']}"
+    )
+    if report['errors']:
+        text += '\n\n' + '\n'.join(report['errors'])
+        if report['error_count'] > len(report['errors']):
+            text += f"\n… и ещё {report['error_count'] - len(report['errors'])}"
+    return text
+
+def _write_shared_strings_xlsx(path, rows):
+    """XLSX, как его сохраняет Excel: текст ячеек в xl/sharedStrings.xml, в листе только номера"""
+    import tempfile
+    from xml.sax.saxutils import escape
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive, \
+            tempfile.TemporaryFile('w+', encoding='utf-8') as strings:
+        count = 0
+        with archive.open('xl/worksheets/sheet1.xml', 'w') as raw:
+            sheet = io.TextIOWrapper(raw, encoding='utf-8')
+            sheet.write(f'<worksheet xmlns="{XLSX_NS[1:-1]}"><sheetData>')
+            for row in rows:
+                sheet.write('<row>')
+                for value in row:
+                    sheet.write(f'<c t="s"><v>{count}</v></c>')
+                    strings.write(f'<si><t>{escape(str(value))}</t></si>')
+                    count += 1
+                sheet.write('</row>')
+            sheet.write('</sheetData></worksheet>')
+            sheet.flush()
+            sheet.detach()
+        strings.seek(0)
+        with archive.open('xl/sharedStrings.xml', 'w') as raw:
+            shared = io.TextIOWrapper(raw, encoding='utf-8')
+            shared.write(f'<sst xmlns="{XLSX_NS[1:-1]}" count="{count}" uniqueCount="{count}">')
+            while chunk := strings.read(1024 * 1024):
+                shared.write(chunk)
+            shared.write('</sst>')
+            shared.flush()
+            shared.detach()
+
+def _benchmark(count=100000):
+    import resource
+    import tempfile
+    from export import write_xlsx
+    
+    directory = tempfile.mkdtemp()
+    database.DATABASE = os.path.join(directory, 'bench.db')
+    database.init_db()
+    
+    def rows():
+        yield ['№', 'Группа', 'Фамилия', 'Имя', 'Отчество']
+        for i in range(count):
+            group = GROUPS[i % len(GROUPS)] if i % 500 else 'ЭМ99'  # Каждая 500-я группа неверная
+            yield [str(i + 1), group, f'Фамилия{i}', f'Имя{i}', 'Отчество' if i % 3 else '']
+    
+    csv_path = os.path.join(directory, 'students.csv')
+    with open(csv_path, 'w', encoding='cp1251', newline='') as f:
+        csv.writer(f, delimiter=';').writerows(rows())
+    xlsx_path = os.path.join(directory, 'students.xlsx')
+    write_xlsx(xlsx_path, rows())
+    shared_path = os.path.join(directory, 'students-shared.xlsx')
+    _write_shared_strings_xlsx(shared_path, rows())
+    
+    for label, path in (('CSV', csv_path), ('XLSX', xlsx_path), ('XLSX с sharedStrings', shared_path)):
+        report = import_file(path)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"{label}: {report['rows']} строк за {report['seconds']} с ({report['per_second']} в секунду), "
+              f"добавлено {report['imported']}, повторов {report['duplicates']}, ошибок {report['error_count']}, "
+              f"пик памяти процесса {peak:.0f} МБ")
+    database.stop_writer()
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'bench':
+        _benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 100000)
+    elif len(sys.argv) in (2, 3):
+        database.init_db()
+        print(format_report(import_file(sys.argv[1], sys.argv[2] if len(sys.argv) == 3 else None)))
+        database.stop_writer()
+    else:
+        print(__doc__)
@@ -0,0 +1,237 @@
+"""Серверные сессии сайта: в cookie только случайный идентификатор, данные лежат в SQLite,
+а перед базой стоит LRU-кэш процесса.
+
+SESSION_BACKEND=cookie - обычные подписанные cookie Flask, как раньше.
+
+python session_store.py bench           - размер cookie и время запроса в обоих режимах
+python session_store.py revoke USER_ID  - выйти из аккаунта пользователя на всех устройствах
+"""
+import os
+import secrets
+import sys
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask.sessions import SessionInterface, SessionMixin
+import database
+
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'sqlite')
+CACHE_SIZE = 4096  # Сколько сессий держать в памяти процесса
+# Срок жизни продлевается при обращении, но в базу пишется не чаще раза за этот интервал
+REFRESH_INTERVAL = timedelta(hours=1)
+SID_BYTES = 16
+
+class ServerSession(SessionMixin):
+    """Сессия, которая идёт в хранилище только при первом обращении к данным"""
+    
+    def __init__(self, store, sid=None):
+        self.sid = sid
+        self.version = None
+        self.expires_at = None
+        self.loaded_user_id = None
+        self.modified = False
+        self.accessed = False
+        self._store = store
+        self._data = None
+    
+    @property
+    def data(self):
+        if self._data is None:
+            self.accessed = True
+            record = self._store.load(self.sid) if self.sid else None
+            if record is None:
+                self.sid = None
+                self._data = {}
+            else:
+                self.version, self.expires_at, self._data = record
+                self.loaded_user_id = self._data.get('user_id')
+        return self._data
+    
+    def __getitem__(self, key):
+        return self.data[key]
+    
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.modified = True
+    
+    def __delitem__(self, key):
+        del self.data[key]
+        self.modified = True
+    
+    def __iter__(self):
+        return iter(self.data)
+    
+    def __len__(self):
+        return len(self.data)
+
+class SessionStore:
+    """Сессии в SQLite с LRU-кэшем; кэш сверяется с базой по номеру версии,
+    поэтому изменения из других воркеров и отзыв сессий видны сразу"""
+    
+    def __init__(self, size=CACHE_SIZE):
+        self._entries = OrderedDict()  # sid -> (версия, данные)
+        self._lock = threading.Lock()
+        self._size = size
+    
+    def _remember(self, sid, version, data):
+        with self._lock:
+            self._entries[sid] = (version, data)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+    
+    def _forget(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+    
+    def load(self, sid):
+        """Возвращает (версия, срок жизни, копия данных) или None, если сессии нет"""
+        with self._lock:
+            cached = self._entries.get(sid)
+        
+        record = database.get_session(sid, cached[0] if cached else None)
+        if record is None:
+            self._forget(sid)
+            return None
+        
+        if record['data'] is None:
+            data = cached[1]  # Версия не изменилась - данные из кэша
+        else:
+            data = record['data']
+        self._remember(sid, record['version'], data)
+        return record['version'], record['expires_at'], dict(data)
+    
+    def save(self, sid, data, expires_at):
+        version = database.save_session(sid, data.get('user_id'), data, expires_at)
+        self._remember(sid, version, dict(data))
+    
+    def replace(self, old_sid, sid, data, expires_at):
+        """Удаляет старую сессию и сохраняет новую одной транзакцией"""
+        self._forget(old_sid)
+        version = database.replace_session(old_sid, sid, data.get('user_id'), data, expires_at)
+        self._remember(sid, version, dict(data))
+    
+    def touch(self, sid, expires_at):
+        database.touch_session(sid, expires_at)
+    
+    def delete(self, sid):
+        self._forget(sid)
+        database.delete_session(sid)
+
+class SQLiteSessionInterface(SessionInterface):
+    def __init__(self, store=None):
+        self.store = store or SessionStore()
+    
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and len(sid) > 64:
+            sid = None
+        return ServerSession(self.store, sid)
+    
+    def save_session(self, app, session, response):
+        if not session.accessed:
+            return  # Страница не трогала сессию - ни запроса к базе, ни Set-Cookie
+        
+        response.vary.add('Cookie')
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        
+        if not session:
+            if session.sid:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        
+        now = datetime.now()
+        expires_at = now + app.permanent_session_lifetime
+        
+        if session.modified:
+            if session.sid and session.get('user_id') != session.loaded_user_id:
+                # Вход или выход под другим пользователем - новый идентификатор сессии
+                old_sid, session.sid = session.sid, secrets.token_urlsafe(SID_BYTES)
+                self.store.replace(old_sid, session.sid, dict(session), expires_at)
+            else:
+                session.sid = session.sid or secrets.token_urlsafe(SID_BYTES)
+                self.store.save(session.sid, dict(session), expires_at)
+        elif session.expires_at and session.expires_at - now < app.permanent_session_lifetime - REFRESH_INTERVAL:
+            self.store.touch(session.sid, expires_at)
+        else:
+            return
+        
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+def init_app(app):
+    """Подключает серверные сессии, если не выбран SESSION_BACKEND=cookie"""
+    if SESSION_BACKEND != 'cookie':
+        app.session_interface = SQLiteSessionInterface()
+
+def revoke_user(user_id):
+    """Завершает все сессии пользователя, возвращает их количество"""
+    return database.delete_user_sessions(user_id)
+
+def _benchmark(requests=2000):
+    import tempfile
+    import time
+    from flask import Flask, session
+    from flask.sessions import SecureCookieSessionInterface
+    
+    database.DATABASE = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    database.init_db()
+    
+    for label, interface in (('cookie', SecureCookieSessionInterface()), ('sqlite', SQLiteSessionInterface())):
+        app = Flask(__name__)
+        app.secret_key = secrets.token_hex(32)
+        app.session_interface = interface
+        
+        @app.route('/login')
+        def login():
+            session.update({
+                'cookie_id': secrets.token_hex(16),
+                'selected_group': 'ИСиП25-1',
+                'login_user_id': 123,
+                'delivery_id': secrets.token_hex(8),
+                'user_id': 123,
+                'selected_group_obsh': 'ОИБ25-1',
+            })
+            session.permanent = True
+            return 'ok'
+        
+        @app.route('/page')
+        def page():
+            return 'yes' if 'user_id' in session else 'no'
+        
+        @app.route('/static-page')
+        def static_page():
+            return 'ok'
+        
+        client = app.test_client()
+        response = client.get('/login')
+        cookie = response.headers['Set-Cookie'].split(';')[0]
+        
+        timings = {}
+        for route in ('/page', '/static-page'):
+            started = time.perf_counter()
+            for _ in range(requests):
+                client.get(route)
+            timings[route] = (time.perf_counter() - started) / requests * 1e6
+        
+        print(f"{label}: cookie {len(cookie)} байт, страница с сессией {timings['/page']:.0f} мкс, "
+              f"без сессии {timings['/static-page']:.0f} мкс")
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == 'revoke':
+        print(f"✅ Завершено сессий: {revoke_user(int(sys.argv[2]))}")
+    elif len(sys.argv) == 2 and sys.argv[1] == 'bench':
+        _benchmark()
+    else:
+        print(__doc__)
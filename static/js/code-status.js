@@ -0,0 +1,26 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const status = document.getElementById('codeStatus');
+    if (!status) return;
+    
+    const url = status.dataset.statusUrl;
+    let polls = 0;
+    
+    function poll() {
+        fetch(url, { credentials: 'same-origin' })
+            .then(response => response.json())
+            .then(data => {
+                if (data.status === 'sent') {
+                    status.textContent = 'Код доставлен';
+                } else if (data.status === 'failed') {
+                    status.textContent = 'Не удалось отправить код. Вернись назад и попробуй ещё раз.';
+                    status.classList.add('error-message');
+                } else if (++polls < 30) {
+                    // Неизвестный статус - не окончательный: запись из другого воркера могла ещё не дойти
+                    setTimeout(poll, 1000);
+                }
+            })
+            .catch(() => {});
+    }
+    
+    poll();
+});
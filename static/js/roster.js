@@ -0,0 +1,31 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const form = document.getElementById('groupForm');
+    const step = document.getElementById('userStep');
+    if (!form || !step || !window.fetch) return;
+    
+    // Список группы кэширует браузер: сервер отдаёт ETag и no-cache,
+    // поэтому повторный выбор той же группы - это короткий ответ 304
+    form.addEventListener('submit', function(event) {
+        const group = form.elements.group.value;
+        if (!group) return;
+        event.preventDefault();
+        
+        fetch(form.dataset.rosterUrl.replace('__group__', encodeURIComponent(group)), { credentials: 'same-origin' })
+            .then(response => {
+                if (!response.ok) throw new Error(response.status);
+                return response.json();
+            })
+            .then(data => {
+                // Пустую группу и ошибки показывает сервер обычной отправкой формы
+                if (!data.users.length) throw new Error('empty');
+                
+                const card = step.content.firstElementChild.cloneNode(true);
+                card.querySelector('.breadcrumb strong').textContent = data.group;
+                card.querySelector('input[name="group"]').value = data.group;
+                const select = card.querySelector('select[name="user_id"]');
+                data.users.forEach(user => select.add(new Option(`${user.last_name} ${user.first_name}`, user.id)));
+                form.closest('.login-card').replaceWith(card);
+            })
+            .catch(() => form.submit());
+    });
+});
@@ -0,0 +1,29 @@
+"""Общие фикстуры: схема базы создаётся один раз, каждый тест получает свою копию"""
+import os
+import shutil
+import pytest
+
+os.environ.setdefault('BOT_TOKEN', '123456:ABCDEFabcdef')
+
+import database
+
+@pytest.fixture(scope='session')
+def db_template(tmp_path_factory):
+    """Пустая база со всеми миграциями"""
+    path = str(tmp_path_factory.mktemp('template') / 'npek.db')
+    with pytest.MonkeyPatch.context() as patch:
+        database.close_pool()
+        patch.setattr(database, 'DATABASE', path)
+        database.init_db()
+        database.close_pool()
+    return path
+
+@pytest.fixture
+def db(db_template, tmp_path, monkeypatch):
+    """Модуль database, который работает с копией пустой базы; пул и писатель закрываются после теста"""
+    path = str(tmp_path / 'npek.db')
+    shutil.copyfile(db_template, path)
+    database.close_pool()
+    monkeypatch.setattr(database, 'DATABASE', path)
+    yield database
+    database.close_pool()
@@ -0,0 +1,38 @@
+"""Статус доставки кода виден воркеру, который его не отправлял"""
+from collections import deque
+import pytest
+import delivery
+
+@pytest.fixture
+def worker(db, monkeypatch):
+    """Делает вид, что следующие вызовы идут из другого воркера: память процесса пуста"""
+    monkeypatch.setattr(delivery, 'DELIVERY_STATUS_BACKEND', 'sqlite')
+    monkeypatch.setattr(delivery, '_jobs', deque())
+    monkeypatch.setattr(delivery, '_statuses', {})
+    
+    def switch():
+        db.submit_write(lambda: None).result()  # Писатель дописал всё, что было в очереди раньше
+        monkeypatch.setattr(delivery, '_statuses', {})
+    
+    return switch
+
+def test_status_is_shared_between_workers(worker):
+    delivery_id = delivery.send_login_code(1, '1234')
+    worker()
+    assert delivery.get_status(delivery_id) == delivery.QUEUED
+    
+    delivery._set_status(delivery_id, delivery.SENDING)
+    delivery._set_status(delivery_id, delivery.SENT)
+    worker()
+    assert delivery.get_status(delivery_id) == delivery.SENT
+
+def test_unknown_delivery_has_no_status(worker):
+    assert delivery.get_status('missing') is None
+    assert delivery.get_status(None) is None
+
+def test_memory_backend_does_not_touch_database(db, monkeypatch):
+    monkeypatch.setattr(delivery, '_jobs', deque())
+    delivery_id = delivery.send_login_code(1, '1234')
+    assert delivery.get_status(delivery_id) == delivery.QUEUED
+    with db.get_db() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM delivery_statuses').fetchone()[0] == 0
@@ -0,0 +1,40 @@
+"""Выгрузка пользователей: заголовки ответа и экранирование формул"""
+import pytest
+from flask import Flask
+import export
+from roster_import import read_rows
+
+DANGEROUS = ('=HYPERLINK("http://x","y")', '+7 999', '-1', '@SUM(A1)', '\tТаб', '\rВозврат')
+
+@pytest.fixture
+def exported(db, tmp_path):
+    """Сохраняет выгрузку в файл и возвращает (ответ, строки файла)"""
+    for i, value in enumerate(DANGEROUS):
+        db.create_user(i, 'ЭМ25', value, 'Имя', middle_name=value, telegram_username=f'user{i}')
+    app = Flask(__name__)
+    
+    def run(fmt):
+        with app.test_request_context():
+            response = export.users_response(fmt)
+        path = str(tmp_path / f'users.{fmt}')
+        with open(path, 'wb') as f:
+            f.write(b''.join(response.response))
+        rows = list(read_rows(path))
+        assert list(rows[0]) == list(export.COLUMNS), rows[0]
+        assert {row[6] for row in rows[1:]} == {f'user{i}' for i in range(len(DANGEROUS))}
+        return response, rows[1:]
+    
+    return run
+
+def _cells(rows):
+    return {cell for row in rows for cell in (row[2], row[4])}
+
+def test_csv_escapes_formulas(exported):
+    response, rows = exported('csv')
+    assert response.headers['Content-Type'] == 'text/csv; charset=utf-8'
+    assert _cells(rows) == {"'" + value for value in DANGEROUS}
+
+def test_xlsx_keeps_text_as_is(exported):
+    response, rows = exported('xlsx')
+    assert response.headers['Content-Type'] == export.MIMETYPES['xlsx']
+    assert _cells(rows) == set(DANGEROUS)
@@ -0,0 +1,92 @@
+"""SQLiteStorage: сохранение между перезапусками, запись во время записи пачки, срок жизни"""
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+import database_async
+from fsm_storage import SQLiteStorage, FLUSH_DELAY, FSM_STATE_TTL, _storage_key
+
+@pytest.fixture
+def run(db):
+    """Выполняет корутину в новом цикле событий на временной базе"""
+    return asyncio.run
+
+def _stored(db, user_id):
+    return db.get_fsm_record(SQLiteStorage._key(_storage_key(user_id)), datetime.now() - FSM_STATE_TTL)
+
+def test_state_survives_restart(run):
+    async def scenario():
+        storage = SQLiteStorage(flush_delay=0.1)
+        await storage.set_state(_storage_key(1), 'Registration:waiting_for_fio')
+        await storage.set_data(_storage_key(1), {'group': 'ЭМ25'})
+        await storage.close()
+        restarted = SQLiteStorage()
+        return await restarted.get_state(_storage_key(1)), await restarted.get_data(_storage_key(1))
+    
+    assert run(scenario()) == ('Registration:waiting_for_fio', {'group': 'ЭМ25'})
+
+def test_write_during_flush_is_not_lost(db, run, monkeypatch):
+    save = database_async.save_fsm_records
+    
+    async def slow_save(records):
+        await asyncio.sleep(0.3)
+        await save(records)
+    
+    monkeypatch.setattr(database_async, 'save_fsm_records', slow_save)
+    
+    async def scenario():
+        storage = SQLiteStorage()
+        await storage.set_state(_storage_key(2), 'Registration:waiting_for_group')
+        await asyncio.sleep(FLUSH_DELAY + 0.1)  # Первая пачка уже пишется
+        await storage.set_state(_storage_key(3), 'Registration:waiting_for_group')
+        await asyncio.sleep(2)
+    
+    run(scenario())
+    assert _stored(db, 2) is not None
+    assert _stored(db, 3) is not None
+
+def test_expired_record_is_not_read_from_database(db, run):
+    async def write():
+        storage = SQLiteStorage(flush_delay=0.1)
+        await storage.set_state(_storage_key(4), 'Registration:waiting_for_fio')
+        await storage.close()
+    
+    run(write())
+    with db.get_db() as conn:
+        conn.execute('UPDATE fsm_states SET updated_at = ? WHERE key = ?',
+                     (datetime.now() - FSM_STATE_TTL * 2, SQLiteStorage._key(_storage_key(4))))
+        conn.commit()
+    assert run(SQLiteStorage().get_state(_storage_key(4))) is None
+
+def test_expired_record_is_not_read_from_cache(run):
+    async def scenario():
+        storage = SQLiteStorage(flush_delay=0.05, ttl=timedelta(seconds=0.3))
+        await storage.set_state(_storage_key(5), 'Registration:waiting_for_fio')
+        fresh = await storage.get_state(_storage_key(5))
+        await asyncio.sleep(0.4)
+        expired = await storage.get_state(_storage_key(5))
+        await storage.close()
+        return fresh, expired
+    
+    assert run(scenario()) == ('Registration:waiting_for_fio', None)
+
+def test_record_loaded_from_database_keeps_its_age(db, run):
+    # Запись из базы, которой осталось жить 0.2 с, истекает в кэше по своему времени изменения
+    async def write():
+        storage = SQLiteStorage(flush_delay=0.05)
+        await storage.set_state(_storage_key(6), 'Registration:waiting_for_fio')
+        await storage.close()
+    
+    run(write())
+    ttl = timedelta(seconds=1)
+    with db.get_db() as conn:
+        conn.execute('UPDATE fsm_states SET updated_at = ? WHERE key = ?',
+                     (datetime.now() - ttl + timedelta(seconds=0.2), SQLiteStorage._key(_storage_key(6))))
+        conn.commit()
+    
+    async def scenario():
+        storage = SQLiteStorage(ttl=ttl)
+        fresh = await storage.get_state(_storage_key(6))
+        await asyncio.sleep(0.3)
+        return fresh, await storage.get_state(_storage_key(6))
+    
+    assert run(scenario()) == ('Registration:waiting_for_fio', None)
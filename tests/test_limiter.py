@@ -0,0 +1,83 @@
+"""Блокировки входа на одном IP (весь колледж за NAT)"""
+import pytest
+from werkzeug.middleware.proxy_fix import ProxyFix
+from limiter import Limiter, MemoryBackend, MAX_ATTEMPTS, IP_USER_MAX_ATTEMPTS, IP_FLOOD_ATTEMPTS
+
+IP = '10.0.0.1'
+
+@pytest.fixture
+def limiter():
+    return Limiter(MemoryBackend())
+
+def test_students_behind_one_ip_are_not_blocked(limiter):
+    # Десять студентов с одного IP ошибаются по два раза - никого не блокируем
+    for student in range(10):
+        for _ in range(2):
+            limiter.register_failure(f'cookie{student}', student, IP)
+        assert not limiter.is_blocked(f'cookie{student}', IP, student)
+    assert not limiter.is_blocked('fresh', IP, 100)
+
+def test_cookie_is_blocked_after_max_attempts(limiter):
+    for _ in range(MAX_ATTEMPTS):
+        limiter.register_failure('cookie-bad', 200, IP)
+    assert limiter.is_blocked('cookie-bad', IP, 200)
+    assert not limiter.is_blocked('fresh', IP, 100)
+
+def test_rotating_cookies_blocks_only_ip_and_user(limiter):
+    for attempt in range(IP_USER_MAX_ATTEMPTS):
+        limiter.register_failure(f'rotated{attempt}', 300, IP)
+    assert limiter.is_blocked('new-cookie', IP, 300)
+    assert not limiter.is_blocked('new-cookie', IP, 100)
+    assert not limiter.is_blocked('new-cookie', '10.0.0.2', 300)
+
+def test_flood_blocks_whole_ip(limiter):
+    for attempt in range(IP_FLOOD_ATTEMPTS):
+        limiter.register_failure(f'flood{attempt}', 1000 + attempt, IP)
+    assert limiter.is_blocked('fresh', IP, 100)
+    assert not limiter.is_blocked('fresh', '10.0.0.2', 100)
+
+def test_failures_without_user_do_not_count_toward_ip(limiter):
+    for attempt in range(IP_FLOOD_ATTEMPTS * 2):
+        limiter.register_failure(f'junk{attempt}', None, IP)
+    assert not limiter.is_blocked('fresh', IP, 100)
+
+@pytest.fixture
+def web(db, limiter, monkeypatch):
+    """Тестовый клиент сайта с лимитером в памяти и функция входа до шага ввода кода"""
+    import app
+    monkeypatch.setattr(app, 'limiter', limiter)
+    monkeypatch.setattr(app.code_store, 'verify', lambda user_id, code: False)
+    user_id = db.create_user(1, 'ЭМ25', 'Иванов', 'Иван')
+    
+    def client(ip=IP, login_user_id=None, forwarded_for=None):
+        client = app.app.test_client()
+        client.environ_base['REMOTE_ADDR'] = ip
+        if forwarded_for:
+            client.environ_base['HTTP_X_FORWARDED_FOR'] = forwarded_for
+        if login_user_id is not None:
+            with client.session_transaction() as session:
+                session['login_user_id'] = login_user_id
+        return client
+    
+    return app, client, user_id
+
+@pytest.mark.parametrize('path', ('/login', '/rub'))
+def test_anonymous_posts_cannot_block_ip(web, limiter, path):
+    app, client, user_id = web
+    for _ in range(IP_FLOOD_ATTEMPTS + 10):
+        # Без запрошенного кода и без кода в форме - в обоих случаях не попытка подбора
+        client().post(path, data={'action': 'verify_code', 'code': '0000'})
+        client(login_user_id=user_id).post(path, data={'action': 'verify_code'})
+    assert not limiter.is_blocked('fresh', IP, user_id)
+    assert not limiter.backend._hits
+
+def test_clients_behind_proxy_are_counted_separately(web, limiter, monkeypatch):
+    app, client, user_id = web
+    monkeypatch.setattr(app.app, 'wsgi_app', ProxyFix(app.app.wsgi_app, x_for=1))
+    proxy = '127.0.0.1'
+    for attempt in range(IP_FLOOD_ATTEMPTS):
+        client(proxy, user_id, forwarded_for='203.0.113.7').post(
+            '/login', data={'action': 'verify_code', 'code': f'{attempt:04d}'})
+    assert limiter.is_blocked('fresh', '203.0.113.7', user_id)
+    assert not limiter.is_blocked('fresh', '203.0.113.8', user_id)
+    assert not limiter.is_blocked('fresh', proxy, user_id)
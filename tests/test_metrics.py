@@ -0,0 +1,48 @@
+"""Замеры database.* и доступ к /metrics"""
+import time
+import types
+import pytest
+import database
+import metrics
+
+def _db_count(name):
+    series = metrics.DB_SECONDS._series.get((name,))
+    return series[-1] if series else 0
+
+def test_helpers_are_not_instrumented():
+    metrics.instrument_database()
+    assert database.get_user_by_id.__instrumented__
+    assert not hasattr(database.roster_name_key, '__instrumented__')
+    assert set(metrics.DB_QUERIES) <= set(vars(database))
+
+def test_generator_is_timed_over_iteration():
+    def iter_rows():
+        for _ in range(3):
+            time.sleep(0.02)
+            yield [1]
+    
+    module = types.SimpleNamespace(iter_rows=iter_rows)
+    metrics.instrument_database(module, ('iter_rows',))
+    rows = module.iter_rows()
+    assert _db_count('iter_rows') == 0
+    time.sleep(0.1)  # работа читателя между выдачами не входит в замер
+    assert list(rows) == [[1], [1], [1]]
+    assert _db_count('iter_rows') == 1
+    assert 0.06 <= metrics.DB_SECONDS._series[('iter_rows',)][-2] < 0.15
+
+@pytest.fixture
+def client(db):
+    import app
+    return app.app.test_client()
+
+def test_metrics_are_closed_without_token(client, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_TOKEN', None)
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '127.0.0.1'}).status_code == 403
+
+def test_metrics_require_token(client, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_TOKEN', 'secret')
+    assert client.get('/metrics').status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    assert b'db_call_duration_seconds' in response.data
@@ -0,0 +1,61 @@
+"""Пул соединений против соединения на каждый вызов get_db"""
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+THREADS = 8
+REQUESTS_PER_THREAD = 200
+USERS = 3000
+
+def _page(database, n):
+    # Те же обращения к базе, что при отрисовке профиля и списка группы
+    user = database.get_user_by_id(n % USERS + 1)
+    database.get_session(f'sid{n}')
+    database.get_users_by_group(user['group_name'])
+    database.get_roster_version(user['group_name'])
+    database.get_teachers()
+
+def _requests_per_second(database):
+    barrier = threading.Barrier(THREADS + 1)
+    
+    def worker(n):
+        barrier.wait()
+        for i in range(REQUESTS_PER_THREAD):
+            _page(database, n * REQUESTS_PER_THREAD + i)
+    
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(THREADS)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return THREADS * REQUESTS_PER_THREAD / (time.perf_counter() - started)
+
+def test_pool_beats_connection_per_call(db, monkeypatch):
+    with db.get_db() as conn:
+        conn.executemany(
+            "INSERT INTO users (telegram_id, group_name, last_name, first_name) VALUES (?, ?, ?, 'Имя')",
+            [(i, f'Группа{i % 30}', f'Фамилия{i}') for i in range(USERS)]
+        )
+        conn.commit()
+    
+    @contextmanager
+    def connect_per_call():
+        # get_db без пула, как было раньше: новое соединение на каждый вызов
+        conn = sqlite3.connect(db.DATABASE)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+    
+    with monkeypatch.context() as patch:
+        patch.setattr(db, 'get_db', connect_per_call)
+        per_call = _requests_per_second(db)
+    pooled = _requests_per_second(db)
+    
+    print(f"\n🔥 {THREADS} потоков по {REQUESTS_PER_THREAD} запросов, 5 обращений к базе на запрос: "
+          f"соединение на каждый вызов {per_call:.0f} запросов в секунду, пул {pooled:.0f}")
+    assert pooled > per_call
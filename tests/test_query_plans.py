@@ -0,0 +1,181 @@
+"""EXPLAIN QUERY PLAN для каждого запроса database.py на синтетической базе:
+ни один запрос не должен читать таблицу целиком (SCAN) мимо поиска по индексу.
+
+Размер базы: QUERY_PLAN_USERS (100 тыс.) и QUERY_PLAN_LOGIN_CODES (5 млн) из окружения.
+План и время каждого запроса выводятся с python -m pytest -s tests/test_query_plans.py
+"""
+import os
+import time
+from datetime import datetime, timedelta
+import pytest
+import database
+
+USERS = int(os.environ.get('QUERY_PLAN_USERS', 100000))
+LOGIN_CODES = int(os.environ.get('QUERY_PLAN_LOGIN_CODES', 5000000))
+GROUP = 'Группа7'
+NOW = datetime.now()
+EXPIRES_AT = NOW + timedelta(days=30)
+
+CALLS = [
+    ('get_user_by_telegram', lambda db: db.get_user_by_telegram(42)),
+    ('get_user_by_id', lambda db: db.get_user_by_id(42)),
+    ('get_users_by_group', lambda db: db.get_users_by_group(GROUP)),
+    ('get_roster_version', lambda db: db.get_roster_version(GROUP)),
+    ('get_teachers', lambda db: db.get_teachers()),
+    ('get_teachers_and_admins', lambda db: db.get_teachers_and_admins()),
+    ('get_login_code', lambda db: db.get_login_code(42)),
+    ('save_login_codes', lambda db: db.save_login_codes([(42, 'hmac', NOW + timedelta(minutes=5), 0)])),
+    ('record_login_code_failure', lambda db: db.record_login_code_failure(42)),
+    ('delete_login_code', lambda db: db.delete_login_code(42)),
+    ('get_active_blocks', lambda db: db.get_active_blocks()),
+    ('block_cookie', lambda db: db.block_cookie('cookie:42')),
+    ('create_pending_registration',
+     lambda db: db.create_pending_registration(USERS * 2, 'Ф', 'И', None, 'teacher', 0)),
+    ('get_pending_registration', lambda db: db.get_pending_registration(USERS + 1)),
+    ('delete_pending_registration', lambda db: db.delete_pending_registration(USERS + 2)),
+    ('confirm_pending_registration', lambda db: db.confirm_pending_registration(USERS + 3, '123456')),
+    ('find_roster_student', lambda db: db.find_roster_student(GROUP, 'Список7', 'Имя')),
+    ('register_student', lambda db: db.register_student(USERS * 3, GROUP, 'Список47', 'Имя')),
+    ('update_user_profile', lambda db: db.update_user_profile(42, 'username', 'Имя')),
+    ('update_user_photo', lambda db: db.update_user_photo(42, None, None, None)),
+    ('record_login', lambda db: db.record_login(42)),
+    ('create_broadcast', lambda db: db.create_broadcast(0, GROUP, 'текст')),
+    ('get_broadcast', lambda db: db.get_broadcast(1)),
+    ('get_running_broadcasts', lambda db: db.get_running_broadcasts()),
+    ('get_broadcast_batch', lambda db: db.get_broadcast_batch(1, 30)),
+    ('save_broadcast_results', lambda db: db.save_broadcast_results(1, [1000], [2000])),
+    ('finish_broadcast', lambda db: db.finish_broadcast(1)),
+    ('get_fsm_record', lambda db: db.get_fsm_record('fsm:42', NOW - timedelta(days=1))),
+    ('save_fsm_records',
+     lambda db: db.save_fsm_records({'fsm:42': {'state': None, 'data': {}}, 'fsm:43': None})),
+    ('get_delivery_status', lambda db: db.get_delivery_status('delivery42', NOW - timedelta(minutes=10))),
+    ('save_delivery_status', lambda db: db.save_delivery_status('delivery42', 'sent')),
+    ('get_session', lambda db: db.get_session('sid42')),
+    ('save_session', lambda db: db.save_session('sid42', 42, {}, EXPIRES_AT)),
+    ('touch_session', lambda db: db.touch_session('sid42', EXPIRES_AT)),
+    ('replace_session', lambda db: db.replace_session('sid42', 'sid-new', 42, {}, EXPIRES_AT)),
+    ('delete_session', lambda db: db.delete_session('sid43')),
+    ('delete_user_sessions', lambda db: db.delete_user_sessions(44)),
+    ('iter_users_export', lambda db: list(db.iter_users_export(GROUP, 'student'))),
+] + [
+    (f'purge_expired_rows {table}',
+     lambda db, table=table, column=column: db._purge_batch(table, column, NOW, 500))
+    for table, column in (('login_codes', 'expires_at'), ('blocked_cookies', 'blocked_until'),
+                          ('failed_attempts', 'last_attempt'), ('fsm_states', 'updated_at'),
+                          ('sessions', 'expires_at'), ('delivery_statuses', 'updated_at'))
+]
+
+# Чтения всей таблицы по смыслу (загрузка списка, выгрузка): SCAN допустим,
+# но результат не должен сортироваться во временном B-дереве на всю таблицу
+FULL_READS = [
+    ('iter_users_export без фильтров', lambda db: list(db.iter_users_export())),
+    ('get_registered_names', lambda db: db.get_registered_names()),
+    ('count_roster_students', lambda db: db.count_roster_students()),
+]
+
+@pytest.fixture(scope='module')
+def plan_db(tmp_path_factory):
+    """База на USERS пользователей и LOGIN_CODES кодов входа, заполняется один раз на модуль"""
+    path = str(tmp_path_factory.mktemp('plans') / 'plans.db')
+    started = time.perf_counter()
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(database, 'DATABASE', path)
+        database.close_pool()
+        database.init_db()
+        with database.get_db() as conn:
+            conn.executemany(
+                '''INSERT INTO users (telegram_id, group_name, last_name, first_name, role, is_admin)
+                   VALUES (?, ?, ?, 'Имя', ?, ?)''',
+                [(i, f'Группа{i % 40}', f'Фамилия{i}', 'teacher' if i % 50 == 0 else 'student', i % 500 == 0)
+                 for i in range(USERS)]
+            )
+            # Коды входа генерирует сам SQLite: миллионы строк через executemany заполняются в разы дольше
+            conn.execute(
+                '''WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+                   INSERT INTO login_codes (user_id, code, expires_at)
+                   SELECT i, 'hmac', datetime('now', 'localtime', (i % 10 - 5) || ' minutes') FROM n''',
+                (LOGIN_CODES,)
+            )
+            conn.executemany(
+                'INSERT INTO sessions (sid, user_id, expires_at) VALUES (?, ?, ?)',
+                [(f'sid{i}', i % USERS + 1, NOW + timedelta(days=i % 60 - 30)) for i in range(USERS * 2)]
+            )
+            conn.executemany(
+                'INSERT INTO blocked_cookies (cookie_id, blocked_until) VALUES (?, ?)',
+                [(f'cookie:{i}', NOW + timedelta(minutes=i % 20 - 10)) for i in range(USERS // 2)]
+            )
+            conn.executemany(
+                'INSERT INTO failed_attempts (cookie_id, user_id, attempts, last_attempt) VALUES (?, ?, 1, ?)',
+                [(f'cookie:{i}', i, NOW - timedelta(minutes=i % 120)) for i in range(USERS // 2)]
+            )
+            conn.executemany(
+                "INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, 'Registration:fio', '{}', ?)",
+                [(f'fsm:{i}', NOW - timedelta(hours=i % 96)) for i in range(USERS // 2)]
+            )
+            conn.executemany(
+                'INSERT INTO delivery_statuses (delivery_id, status, updated_at) VALUES (?, ?, ?)',
+                [(f'delivery{i}', 'sent', NOW - timedelta(minutes=i % 20)) for i in range(USERS // 2)]
+            )
+            conn.executemany(
+                '''INSERT INTO pending_registrations (telegram_id, last_name, first_name, role, confirmation_code)
+                   VALUES (?, 'Фамилия', 'Имя', 'teacher', '123456')''',
+                [(USERS + i,) for i in range(USERS // 10)]
+            )
+            conn.executemany(
+                "INSERT INTO roster_students (group_name, last_name, first_name, name_key) VALUES (?, ?, 'Имя', ?)",
+                [(f'Группа{i % 40}', f'Список{i}', f'список{i} имя') for i in range(USERS // 2)]
+            )
+            conn.executemany(
+                "INSERT INTO broadcasts (sender_telegram_id, group_name, text, status) VALUES (0, ?, 'текст', ?)",
+                [(f'Группа{i % 40}', 'running' if i % 100 == 0 else 'done') for i in range(1000)]
+            )
+            conn.executemany(
+                'INSERT INTO broadcast_recipients (broadcast_id, telegram_id, status) VALUES (?, ?, ?)',
+                [(i % 1000 + 1, i, i % 3) for i in range(USERS)]
+            )
+            conn.commit()
+            conn.execute('ANALYZE')
+        database.close_pool()
+    print(f"\n🔧 База: {USERS} пользователей, {LOGIN_CODES} кодов входа, "
+          f"заполнена за {time.perf_counter() - started:.1f} с")
+    return path
+
+@pytest.fixture
+def explain(plan_db, monkeypatch):
+    """Выполняет вызов и возвращает (шаги плана всех его запросов, время вызова в мс)"""
+    statements = []
+    connect = database._connect
+    
+    def traced_connect():
+        conn = connect()
+        conn.set_trace_callback(statements.append)
+        return conn
+    
+    database.close_pool()
+    monkeypatch.setattr(database, 'DATABASE', plan_db)
+    monkeypatch.setattr(database, '_connect', traced_connect)
+    
+    def run(call):
+        started = time.perf_counter()
+        call(database)
+        elapsed = (time.perf_counter() - started) * 1000
+        queries = [query for query in statements
+                   if query.lstrip().upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE'))]
+        with database.get_db() as conn:
+            plan = {row[3] for query in queries for row in conn.execute(f'EXPLAIN QUERY PLAN {query}')}
+        return sorted(plan), elapsed
+    
+    yield run
+    database.close_pool()
+
+@pytest.mark.parametrize('name, call', CALLS, ids=[name for name, _ in CALLS])
+def test_query_uses_index(explain, name, call):
+    plan, elapsed = explain(call)
+    print(f"\n{name}: {elapsed:.1f} мс; {'; '.join(plan)}")
+    assert not [step for step in plan if step.startswith('SCAN')], plan
+
+@pytest.mark.parametrize('name, call', FULL_READS, ids=[name for name, _ in FULL_READS])
+def test_full_read_is_not_sorted_in_memory(explain, name, call):
+    plan, elapsed = explain(call)
+    print(f"\n{name}: {elapsed:.1f} мс; {'; '.join(plan)}")
+    assert not [step for step in plan if 'TEMP B-TREE' in step], plan
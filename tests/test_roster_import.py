@@ -0,0 +1,25 @@
+"""Загрузка списков студентов из XLSX"""
+import zipfile
+import pytest
+import roster_import
+
+ROWS = [['Группа', 'Фамилия', 'Имя', 'Отчество'], ['ЭМ25', 'Иванов', 'Иван', ''], ['ЭМ25', 'Петрова', 'Анна', 'Сергеевна']]
+
+def test_shared_strings_are_resolved(tmp_path):
+    path = str(tmp_path / 'students.xlsx')
+    roster_import._write_shared_strings_xlsx(path, ROWS)
+    assert list(roster_import.read_rows(path)) == ROWS
+
+def test_workbook_without_sheets_is_rejected(db, tmp_path):
+    path = str(tmp_path / 'empty.xlsx')
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('xl/workbook.xml', '<workbook/>')
+    with pytest.raises(ValueError, match='нет ни одного листа'):
+        roster_import.import_file(path)
+
+def test_import_from_shared_strings(db, tmp_path):
+    path = str(tmp_path / 'students.xlsx')
+    roster_import._write_shared_strings_xlsx(path, ROWS)
+    report = roster_import.import_file(path, groups=['ЭМ25'])
+    assert (report['rows'], report['imported'], report['error_count']) == (2, 2, 0)
+    assert db.find_roster_student('ЭМ25', 'Петрова', 'Анна', 'Сергеевна')
@@ -0,0 +1,39 @@
+"""Пользователь читается из базы не больше одного раза за запрос"""
+import pytest
+
+PAGES = ('/', '/info', '/profile', '/o', '/of')
+
+@pytest.fixture
+def traced(db, monkeypatch):
+    """Список SQL всех соединений, открытых после подключения фикстуры"""
+    statements = []
+    connect = db._connect
+    
+    def traced_connect():
+        conn = connect()
+        conn.set_trace_callback(statements.append)
+        return conn
+    
+    monkeypatch.setattr(db, '_connect', traced_connect)
+    return statements
+
+@pytest.fixture
+def client():
+    from app import app
+    return app.test_client()
+
+def _user_queries(client, statements, path):
+    statements.clear()
+    client.get(path).close()
+    return sum('FROM users WHERE id' in statement for statement in statements)
+
+@pytest.mark.parametrize('path', PAGES)
+def test_anonymous_request_reads_no_user(traced, client, path):
+    assert _user_queries(client, traced, path) == 0
+
+@pytest.mark.parametrize('path', PAGES)
+def test_logged_in_request_reads_user_once(db, traced, client, path):
+    user_id = db.create_user(1, 'ЭМ25', 'Иванов', 'Иван', role='teacher')
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    assert _user_queries(client, traced, path) == 1
@@ -0,0 +1,34 @@
+"""Запуск приёма обновлений: накопленные за простой обновления не сбрасываются"""
+import asyncio
+import webhook
+
+class FakeBot:
+    def __init__(self):
+        self.calls = []
+    
+    async def delete_webhook(self, **kwargs):
+        self.calls.append(('delete_webhook', kwargs))
+    
+    async def set_webhook(self, url, **kwargs):
+        self.calls.append(('set_webhook', kwargs))
+
+class FakeDispatcher:
+    async def start_polling(self, bot):
+        bot.calls.append(('start_polling', {}))
+
+def test_polling_keeps_pending_updates(monkeypatch):
+    monkeypatch.setattr(webhook, 'BOT_MODE', 'polling')
+    bot = FakeBot()
+    asyncio.run(webhook.run(bot, FakeDispatcher()))
+    assert bot.calls == [('delete_webhook', {'drop_pending_updates': False}), ('start_polling', {})]
+
+def test_webhook_keeps_pending_updates(monkeypatch):
+    monkeypatch.setattr(webhook, 'BOT_MODE', 'webhook')
+    received = {}
+    
+    async def run_webhook(bot, dp, **kwargs):
+        received.update(kwargs)
+    
+    monkeypatch.setattr(webhook, 'run_webhook', run_webhook)
+    asyncio.run(webhook.run(FakeBot(), FakeDispatcher()))
+    assert received == {'drop_pending_updates': False}
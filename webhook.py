@@ -0,0 +1,284 @@
+"""Приём обновлений Telegram: long polling или webhook на aiohttp (BOT_MODE=webhook).
+
+В режиме webhook обновления складываются в ограниченную очередь и разбираются
+фиксированным числом обработчиков. Повторные доставки одного update_id
+отбрасываются. Если обработчики не успевают (например, медленная база), Telegram
+получает 503 и присылает обновление позже.
+
+Нагрузочная проверка: python webhook.py bench [количество обновлений]
+"""
+import asyncio
+import os
+import secrets
+import sys
+import time
+from collections import OrderedDict, deque
+from aiohttp import web
+from aiogram.types import Update
+
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')  # Публичный адрес сайта, например https://npek.example.ru
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram/webhook')
+WEBHOOK_HOST = os.environ.get('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', 8081))
+# Секрет, который Telegram присылает в заголовке; без переменной - новый при каждом запуске
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+
+HANDLER_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 16))  # Одновременно обрабатываемых обновлений
+QUEUE_SIZE = 256           # Принятых, но ещё не обработанных обновлений
+ENQUEUE_TIMEOUT = 2        # Сколько секунд ждать места в очереди до ответа 503
+DEDUP_SIZE = 10000         # Сколько последних update_id помнить для отсева повторов
+MAX_CONNECTIONS = 40       # Параллельных соединений от Telegram
+
+class UpdateIngress:
+    """Принимает обновления по HTTP и передаёт их диспетчеру через ограниченную очередь"""
+    
+    def __init__(self, bot, dp, secret=WEBHOOK_SECRET, workers=HANDLER_WORKERS, queue_size=QUEUE_SIZE):
+        self.bot = bot
+        self.dp = dp
+        self.secret = secret
+        self.queue = asyncio.Queue(queue_size)
+        self.stats = {'received': 0, 'duplicates': 0, 'rejected': 0, 'handled': 0, 'errors': 0}
+        self.latencies = deque(maxlen=10000)  # секунды от приёма до конца обработки
+        self._workers_count = workers
+        self._workers = []
+        self._seen = OrderedDict()
+    
+    def start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self._workers_count)]
+    
+    async def stop(self, timeout=10):
+        """Дожидается обработки принятых обновлений и останавливает обработчиков"""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Не обработано обновлений при остановке: {self.queue.qsize()}")
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+    
+    async def handle(self, request):
+        token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not secrets.compare_digest(token, self.secret):
+            return web.Response(status=401)
+        
+        try:
+            data = await request.json()
+            update_id = int(data['update_id'])
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=400)
+        
+        self.stats['received'] += 1
+        if update_id in self._seen:
+            self.stats['duplicates'] += 1
+            return web.Response()
+        
+        # Запоминаем до ожидания очереди, чтобы параллельный повтор не прошёл дважды
+        self._seen[update_id] = None
+        if len(self._seen) > DEDUP_SIZE:
+            self._seen.popitem(last=False)
+        
+        try:
+            await asyncio.wait_for(self.queue.put((time.perf_counter(), data)), ENQUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Обработчики не успевают - пусть Telegram повторит доставку позже
+            self._seen.pop(update_id, None)
+            self.stats['rejected'] += 1
+            return web.Response(status=503, headers={'Retry-After': '1'})
+        
+        return web.Response()
+    
+    async def _worker(self):
+        while True:
+            received_at, data = await self.queue.get()
+            try:
+                update = Update.model_validate(data, context={'bot': self.bot})
+                await self.dp.feed_update(self.bot, update)
+                self.stats['handled'] += 1
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"❌ Ошибка обработки обновления {data.get('update_id')}: {e}")
+            finally:
+                self.latencies.append(time.perf_counter() - received_at)
+                self.queue.task_done()
+    
+    def report(self):
+        latencies = sorted(self.latencies)
+        return {**self.stats, **{f'p{p}_ms': _percentile(latencies, p) for p in (50, 95, 99)}}
+
+def _percentile(latencies, p):
+    """Процентиль отсортированных задержек в миллисекундах"""
+    return latencies[min(len(latencies) - 1, len(latencies) * p // 100)] * 1000 if latencies else 0
+
+async def _serve(ingress, host, port):
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, ingress.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+async def run_webhook(bot, dp, drop_pending_updates=False):
+    if not WEBHOOK_URL:
+        raise RuntimeError('Для BOT_MODE=webhook задайте WEBHOOK_URL')
+    
+    ingress = UpdateIngress(bot, dp)
+    workflow_data = {'dispatcher': dp, 'bots': [bot], **dp.workflow_data}
+    await dp.emit_startup(bot=bot, **workflow_data)
+    ingress.start()
+    runner = await _serve(ingress, WEBHOOK_HOST, WEBHOOK_PORT)
+    
+    await bot.set_webhook(
+        WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        drop_pending_updates=drop_pending_updates,
+        max_connections=MAX_CONNECTIONS
+    )
+    print(f"🔗 Webhook: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH} -> {WEBHOOK_HOST}:{WEBHOOK_PORT}")
+    
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await ingress.stop()
+        print(f"📊 Webhook: {ingress.report()}")
+        await dp.emit_shutdown(bot=bot, **workflow_data)
+        await bot.session.close()
+
+async def run(bot, dp, drop_pending_updates=False):
+    """Запускает приём обновлений в режиме из BOT_MODE.
+    
+    Обновления, пришедшие пока бот был выключен, по умолчанию сохраняются и обрабатываются.
+    """
+    if BOT_MODE == 'webhook':
+        await run_webhook(bot, dp, drop_pending_updates=drop_pending_updates)
+    else:
+        # Пока webhook установлен, getUpdates не работает - снимаем его
+        await bot.delete_webhook(drop_pending_updates=drop_pending_updates)
+        await dp.start_polling(bot)
+
+async def _benchmark(count=5000, connections=MAX_CONNECTIONS, duplicate_every=20):
+    """Один и тот же поток обновлений от локального «Telegram»: сначала на webhook,
+    затем через getUpdates для long polling. Обработчик делает запрос к базе."""
+    import tempfile
+    from aiogram import Dispatcher
+    import database
+    import database_async
+    
+    database.DATABASE = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    database.init_db()
+    
+    def make_update(update_id):
+        user = {'id': 1000 + update_id % 500, 'is_bot': False, 'first_name': 'Тест'}
+        return {'update_id': update_id, 'message': {
+            'message_id': update_id, 'date': int(time.time()), 'text': '/start',
+            'chat': {'id': user['id'], 'type': 'private'}, 'from': user}}
+    
+    updates = [make_update(i) for i in range(count)]
+    polling = {'served_at': {}, 'latencies': [], 'done': asyncio.Event()}
+    dp = Dispatcher()
+    
+    @dp.message()
+    async def handler(message):
+        await database_async.get_user_by_telegram(message.from_user.id)
+        served_at = polling['served_at'].pop(message.message_id, None)
+        if served_at is not None:
+            polling['latencies'].append(time.perf_counter() - served_at)
+            if len(polling['latencies']) == count:
+                polling['done'].set()
+    
+    results = [
+        ('Webhook', *await _benchmark_webhook(dp, updates, connections, duplicate_every)),
+        ('Long polling', *await _benchmark_polling(dp, updates, polling)),
+    ]
+    database_async.shutdown()
+    
+    for mode, handled, elapsed, report in results:
+        print(f"✅ {mode}: обработано {handled} обновлений за {elapsed:.2f} с: {handled / elapsed:.0f} в секунду")
+        print(f"   задержка p50 {report['p50_ms']:.1f} мс, p95 {report['p95_ms']:.1f} мс, p99 {report['p99_ms']:.1f} мс")
+        if 'duplicates' in report:
+            print(f"   повторов отброшено {report['duplicates']}, ответов 503 {report['rejected']}, "
+                  f"ошибок {report['errors']}")
+
+async def _benchmark_webhook(dp, updates, connections, duplicate_every):
+    """«Telegram» шлёт обновления и повторные доставки (каждое duplicate_every-е) на webhook"""
+    import aiohttp
+    from aiogram import Bot
+    
+    bot = Bot(token='123456:ABCDEFabcdef')
+    ingress = UpdateIngress(bot, dp, secret='bench')
+    ingress.start()
+    port = 18081
+    runner = await _serve(ingress, '127.0.0.1', port)
+    url = f'http://127.0.0.1:{port}{WEBHOOK_PATH}'
+    pending = deque(updates + updates[::duplicate_every])
+    
+    async def telegram(session):
+        while pending:
+            update = pending.popleft()
+            while True:
+                async with session.post(url, json=update, headers={'X-Telegram-Bot-Api-Secret-Token': 'bench'}) as r:
+                    if r.status != 503:
+                        break
+                await asyncio.sleep(0.05)
+    
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(telegram(session) for _ in range(connections)))
+    await ingress.queue.join()
+    elapsed = time.perf_counter() - started
+    
+    await runner.cleanup()
+    await ingress.stop()
+    await bot.session.close()
+    report = ingress.report()
+    return report['handled'], elapsed, report
+
+async def _benchmark_polling(dp, updates, polling):
+    """Тот же поток через поддельный Bot API: getUpdates отдаёт обновления пачками по 100 начиная с offset"""
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    
+    token = '123456:ABCDEFabcdef'
+    
+    async def get_me(request):
+        return web.json_response({'ok': True, 'result': {'id': 123456, 'is_bot': True, 'first_name': 'Bench'}})
+    
+    async def get_updates(request):
+        form = await request.post()
+        offset = int(form.get('offset') or 0)
+        batch = updates[offset:offset + 100]
+        if not batch:
+            await asyncio.sleep(0.1)  # вместо долгого ожидания новых обновлений
+        now = time.perf_counter()
+        for update in batch:
+            polling['served_at'].setdefault(update['update_id'], now)
+        return web.json_response({'ok': True, 'result': batch})
+    
+    app = web.Application()
+    app.router.add_post(f'/bot{token}/getMe', get_me)
+    app.router.add_post(f'/bot{token}/getUpdates', get_updates)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    port = 18082
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    
+    bot = Bot(token=token, session=AiohttpSession(api=TelegramAPIServer.from_base(f'http://127.0.0.1:{port}')))
+    started = time.perf_counter()
+    task = asyncio.create_task(dp.start_polling(bot, handle_signals=False))
+    await polling['done'].wait()
+    elapsed = time.perf_counter() - started
+    
+    await dp.stop_polling()
+    await task
+    await runner.cleanup()
+    latencies = sorted(polling['latencies'])
+    return len(latencies), elapsed, {f'p{p}_ms': _percentile(latencies, p) for p in (50, 95, 99)}
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'bench':
+        asyncio.run(_benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 5000))
+    else:
+        print(__doc__)